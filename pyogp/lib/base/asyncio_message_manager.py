@@ -0,0 +1,191 @@
+
+"""
+asyncio_message_manager.py
+Implements the AsyncioMessageManager class, a MessageManager that runs its
+UDP and event queue loops on an asyncio event loop rather than in eventlet
+coroutines.
+
+Contributors: http://svn.secondlife.com/svn/linden/projects/2008/pyogp/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may obtain a copy of the License at:
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/LICENSE.txt
+$/LicenseInfo$
+"""
+#stdlib
+from logging import getLogger
+
+# related
+from eventlet import patcher
+
+# pyogp.lib.base
+from pyogp.lib.base.message_manager import MessageManager
+from pyogp.lib.base.message.asyncio_dispatcher import get_asyncio, AsyncioUDPClient, \
+     UDPDispatcherProtocol, DatagramSocketTransport
+
+# initialize logging
+logger = getLogger('pyogp.lib.base.asyncio_message_manager')
+
+class AsyncioMessageManager(MessageManager):
+    """
+    A MessageManager driven by an asyncio event loop. Packets are read as
+    the loop finds the socket readable, and sending, acks and resends run
+    as callbacks scheduled for when they are due. Everything else, the
+    dispatcher, circuits, throttles and handlers, is the MessageManager's.
+
+    Methods must be called from the loop's thread. Event queue posts block,
+    so they run in the loop's default executor, and the events are handled
+    back on the loop. The socket module is left unpatched, eventlet's
+    cooperative sockets can't be used from the executor's threads.
+    """
+
+    # the loop waits on the standard library's sockets
+    coroutine_sockets = False
+
+    def __init__(self, host, loop = None, **kwargs):
+
+        asyncio = get_asyncio()
+
+        if patcher.is_monkey_patched('socket'):
+            logger.warning("The socket module is patched by eventlet, event queue posts may fail in the executor")
+
+        if loop == None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+
+        self.transport = None
+        self._udp_timer = None
+        self._udp_scheduled = False
+        self._event_queue_timer = None
+
+        kwargs.setdefault('udp_client', AsyncioUDPClient())
+
+        super(AsyncioMessageManager, self).__init__(host, **kwargs)
+
+    def start_monitors(self):
+        """ starts reading the socket, and polling the event queue """
+
+        self._is_running = True
+
+        logger.debug('Starting region UDP connection')
+
+        protocol = UDPDispatcherProtocol(self.udp_dispatcher, self._received)
+        self.transport = DatagramSocketTransport(self.loop, self.udp_dispatcher, protocol,
+                                                 self.settings.RECEIVE_BATCH_PACKETS,
+                                                 self.settings.RECEIVE_BATCH_BYTES)
+        self.transport.start()
+
+        self.wake()
+
+        if self.event_queue != None and self.settings.ENABLE_REGION_EVENT_QUEUE:
+            logger.debug('Starting region event queue connection')
+            self.event_queue._running = True
+            self.event_queue.stopped = False
+            self._event_queue_timer = self.loop.call_later(self.settings.REGION_EVENT_QUEUE_POLL_INTERVAL,
+                                                           self._poll_event_queue)
+
+    def stop_monitors(self):
+        """ stops reading the socket, and polling the event queue """
+
+        self._is_running = False
+
+        if self._udp_timer != None:
+            self._udp_timer.cancel()
+            self._udp_timer = None
+
+        if self.transport != None:
+            self.transport.close()
+            self.transport = None
+
+        if self.event_queue != None and self.event_queue._running:
+            self.event_queue.stopped = True
+            if self._event_queue_timer != None:
+                # not waiting on a post, so finish now
+                self._event_queue_timer.cancel()
+                self._event_queue_timer = None
+                self._finish_event_queue()
+
+    def wake(self):
+        """ schedules the UDP loop to send what is queued """
+
+        if not self._is_running or self._udp_scheduled:
+            return
+
+        self._udp_scheduled = True
+        self.loop.call_soon(self._udp_dispatcher)
+
+    def _received(self, packets):
+        """ called with each batch of packets received """
+
+        #they may need acking, or have acked what was waiting to be resent
+        self.wake()
+
+    def _udp_dispatcher(self):
+        """
+        Sends UDP messages, acks and resends, then schedules itself for
+        when the next ack or resend is due.
+        """
+
+        self._udp_scheduled = False
+
+        if self._udp_timer != None:
+            self._udp_timer.cancel()
+            self._udp_timer = None
+
+        if not self._is_running:
+            return
+
+        self.udp_dispatcher.process_acks()
+
+        self.send_outgoing()
+
+        wait = self.get_wait_time()
+        if wait != None:
+            self._udp_timer = self.loop.call_later(wait, self._udp_dispatcher)
+
+    def _poll_event_queue(self):
+        """ posts to the event queue in the executor """
+
+        self._event_queue_timer = None
+
+        if self.event_queue.stopped:
+            self._finish_event_queue()
+            return
+
+        data = self.event_queue._region_poll_data()
+        future = self.loop.run_in_executor(None, self.event_queue.cap.POST, data)
+        future.add_done_callback(self._event_queue_result)
+
+    def _event_queue_result(self, future):
+        """ handles the events a post returned, and schedules the next """
+
+        try:
+            result = future.result()
+        except Exception, error:
+            result = self.event_queue._region_poll_error(error)
+
+        try:
+            self.event_queue._region_poll_result(result)
+        except Exception, error:
+            logger.warning("Error in a post to the event queue. Error was: %s" % (error))
+
+        if self.event_queue.stopped:
+            self._finish_event_queue()
+        else:
+            self._event_queue_timer = self.loop.call_later(self.settings.REGION_EVENT_QUEUE_POLL_INTERVAL,
+                                                           self._poll_event_queue)
+
+    def _finish_event_queue(self):
+        """ acks the last events received, so they aren't sent again """
+
+        done_data = self.event_queue._region_done_data()
+        if done_data != None:
+            self.loop.run_in_executor(None, self.event_queue.cap.POST, done_data)
+
+        self.event_queue._running = False
+
+        logger.debug("Stopped event queue processing for %s" % (self.host))
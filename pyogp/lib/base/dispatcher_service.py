@@ -0,0 +1,286 @@
+
+"""
+dispatcher_service.py
+Implements the UDPDispatcherService class, which sends and receives the UDP
+messages of many MessageManagers, of any number of agents and regions, over
+a few shared sockets.
+
+Contributors: http://svn.secondlife.com/svn/linden/projects/2008/pyogp/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may obtain a copy of the License at:
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/LICENSE.txt
+$/LicenseInfo$
+"""
+#stdlib
+from logging import getLogger
+import socket
+
+# pyogp.lib.base
+from pyogp.lib.base.message.udpdispatcher import UDPDispatcher
+from pyogp.lib.base.network.net import NetUDPClient, receive_error_delay
+from pyogp.lib.base.settings import Settings
+from pyogp.lib.base.helpers import use_coroutine_sockets
+
+# related
+from eventlet import api, queue
+
+# initialize logging
+logger = getLogger('pyogp.lib.base.dispatcher_service')
+
+class UDPDispatcherService(object):
+    """
+    Runs the UDP side of many MessageManagers, so that a process with
+    hundreds of agents doesn't need a socket and a pair of loops for each.
+
+    Each UDPDispatcher, and its socket, carries the circuits of many agents
+    to different regions. Incoming packets are routed by the (ip, port)
+    they came from to the circuit, and handed to the message handler of the
+    MessageManager subscribed to it. A region tells circuits apart by the
+    address they come from, so the circuits of two agents in one region go
+    over different sockets: a dispatcher is added whenever every existing
+    one already has a circuit to the region. The templates are parsed once
+    and shared by all of them.
+
+    One coroutine sends for every manager, and one per socket receives.
+
+    Sample:
+
+    service = UDPDispatcherService()
+    message_manager = MessageManager(host, udp_service = service)
+    message_manager.start_monitors()
+    """
+
+    def __init__(self, settings = None, message_template = None, udp_client_factory = None):
+        """
+        udp_client_factory returns a new udp client for each socket, and
+        defaults to NetUDPClient
+        """
+
+        # the loops are eventlet coroutines, waiting on cooperative sockets
+        use_coroutine_sockets()
+
+        # allow the settings to be passed in
+        # otherwise, grab the defaults
+        if settings != None:
+            self.settings = settings
+        else:
+            self.settings = Settings()
+
+        if udp_client_factory == None:
+            udp_client_factory = NetUDPClient
+        self.udp_client_factory = udp_client_factory
+
+        self.message_template = message_template
+
+        self.udp_dispatchers = []
+
+        # the subscribed MessageManagers, by (ip, port), one dict per
+        # dispatcher
+        self.managers = []
+
+        # the managers with messages waiting to be sent
+        self._pending = set()
+
+        self._is_running = False
+
+        # wakes _udp_dispatcher up when there is something to send
+        self._wakeup = queue.LightQueue()
+        self._udp_dispatcher_thread = None
+        self._udp_receiver_threads = []
+
+    def subscribe(self, message_manager):
+        """
+        Routes the packets from message_manager's host to its message
+        handler, returning the UDPDispatcher it is to send with
+        """
+
+        key = (message_manager.host.ip, message_manager.host.port)
+
+        # already subscribed, on whichever socket
+        for index in range(len(self.udp_dispatchers)):
+            if self.managers[index].get(key) is message_manager:
+                return self.udp_dispatchers[index]
+
+        # the first socket without a circuit to the region
+        for index in range(len(self.udp_dispatchers)):
+            if key not in self.managers[index]:
+                break
+        else:
+            index = self.__add_dispatcher()
+
+        udp_dispatcher = self.udp_dispatchers[index]
+        udp_dispatcher.subscribe(message_manager.host, getattr(message_manager, 'message_handler', None))
+        self.managers[index][key] = message_manager
+
+        logger.debug("Subscribed to %s on socket %s" % (message_manager.host, index))
+
+        return udp_dispatcher
+
+    def unsubscribe(self, message_manager):
+        """
+        Closes message_manager's circuit, and stops routing its packets
+        """
+
+        key = (message_manager.host.ip, message_manager.host.port)
+
+        for index in range(len(self.udp_dispatchers)):
+            if self.managers[index].get(key) is message_manager:
+                del self.managers[index][key]
+                self.udp_dispatchers[index].unsubscribe(message_manager.host)
+                break
+
+        self._pending.discard(message_manager)
+
+    def __add_dispatcher(self):
+
+        udp_dispatcher = UDPDispatcher(udp_client = self.udp_client_factory(),
+                                       settings = self.settings,
+                                       message_template = self.message_template)
+
+        self.udp_dispatchers.append(udp_dispatcher)
+        self.managers.append({})
+
+        if self._is_running:
+            self._udp_receiver_threads.append(api.spawn(self._udp_receiver, udp_dispatcher))
+
+        return len(self.udp_dispatchers) - 1
+
+    def start(self):
+        """ spawns the coroutines, if they aren't running already """
+
+        if self._is_running:
+            return
+
+        self._is_running = True
+
+        logger.debug('Spawning the shared UDP connections')
+
+        self._udp_dispatcher_thread = api.spawn(self._udp_dispatcher)
+        for udp_dispatcher in self.udp_dispatchers:
+            self._udp_receiver_threads.append(api.spawn(self._udp_receiver, udp_dispatcher))
+
+    def stop(self):
+        """ stops the coroutines """
+
+        self._is_running = False
+        self.wake()
+
+        for thread in self._udp_receiver_threads:
+            # one that hasn't started yet sees _is_running, and returns
+            if thread:
+                api.kill(thread)
+        self._udp_receiver_threads = []
+
+    def wake(self, message_manager = None):
+        """ wakes the UDP loop up, to send what message_manager has queued """
+
+        if message_manager != None:
+            self._pending.add(message_manager)
+
+        if self._wakeup.qsize() == 0:
+            self._wakeup.put(None)
+
+    def _udp_dispatcher(self):
+        """
+        Sends the UDP messages, acks and resends of every socket. Sleeps
+        until a message is enqueued, a packet comes in, or an ack or resend
+        is due.
+        """
+
+        while self._is_running:
+            # a copy, sending can yield to a subscribe adding a socket
+            for udp_dispatcher in list(self.udp_dispatchers):
+                udp_dispatcher.process_acks()
+
+            pending = self._pending
+            self._pending = set()
+
+            for message_manager in pending:
+                if not message_manager._is_running:
+                    continue
+
+                message_manager.send_outgoing()
+
+                # held back by its throttle
+                if len(message_manager.outgoing_queue) > 0:
+                    self._pending.add(message_manager)
+
+            try:
+                self._wakeup.get(timeout = self.get_wait_time())
+            except queue.Empty:
+                pass
+
+        logger.debug("Stopped the shared UDP connections")
+
+    def _udp_receiver(self, udp_dispatcher):
+        """
+        Receives the UDP messages of one socket, as
+        MessageManager._udp_receiver does
+        """
+        udp_client = udp_dispatcher.udp_client
+        errors = 0
+
+        while self._is_running:
+            try:
+                if self.settings.ENABLE_RECEIVE_RING:
+                    packets = udp_client.receive_into(udp_dispatcher.socket,
+                                                      self.settings.RECEIVE_BATCH_PACKETS,
+                                                      self.settings.RECEIVE_BATCH_BYTES)
+                else:
+                    packets = udp_client.receive_batch(udp_dispatcher.socket,
+                                                       self.settings.RECEIVE_BATCH_PACKETS,
+                                                       self.settings.RECEIVE_BATCH_BYTES)
+            except socket.error, error:
+                errors += 1
+                delay = receive_error_delay(error, errors)
+                if delay == None or not self._is_running:
+                    logger.error("Stopped receiving on a shared UDP connection: %s" % (error))
+                    break
+                logger.warning("Error receiving from a shared UDP connection: %s" % (error))
+                api.sleep(delay)
+                continue
+
+            errors = 0
+
+            if len(packets) == 0:
+                continue
+
+            if self.settings.ENABLE_RECEIVE_RING:
+                udp_dispatcher.receive_views(packets)
+            else:
+                udp_dispatcher.receive_batch(packets)
+            #it may need acking, or have acked what was waiting to be resent
+            self.wake()
+
+    def get_wait_time(self):
+        """
+        Returns how long the UDP loop can sleep for, or None if it can
+        sleep until it is woken up
+        """
+
+        wait = None
+
+        for udp_dispatcher in self.udp_dispatchers:
+            deadline = udp_dispatcher.next_process_time()
+            if deadline != None:
+                dispatcher_wait = max(deadline - udp_dispatcher.clock(), 0.0)
+                if wait == None or dispatcher_wait < wait:
+                    wait = dispatcher_wait
+
+        for message_manager in self._pending:
+            send_wait = message_manager.get_send_wait_time()
+            if send_wait != None and (wait == None or send_wait < wait):
+                wait = send_wait
+
+        return wait
+
+    def get_stats(self):
+        """ returns the statistics of every circuit, by (ip, port), one
+            dict per socket """
+
+        return [udp_dispatcher.circuit_manager.get_stats() for udp_dispatcher in self.udp_dispatchers]
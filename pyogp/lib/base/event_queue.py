@@ -21,19 +21,17 @@ from logging import getLogger
 import traceback
 
 # related
-from eventlet import api, util
-
-# the following makes socket calls nonblocking. magic
-util.wrap_socket_with_coroutine_socket()
+from eventlet import api
 
 # pyogp
 
 from pyogp.lib.base.exc import RegionCapNotAvailable
+from pyogp.lib.base.helpers import use_coroutine_sockets
 
 # messaging
 from pyogp.lib.base.message.message_handler import MessageHandler
 from pyogp.lib.base.message.message import Message, Block, Variable
-from pyogp.lib.base.message.template_dict import TemplateDictionary
+from pyogp.lib.base.message.template_dict import get_template_dict
 
 # initialize logging
 logger = getLogger('pyogp.lib.base.event_queue')
@@ -98,12 +96,15 @@ class EventQueueClient(object):
         self.result = None
 
         # enables proper packet parsing in event queue responses
-        self.template_dict = TemplateDictionary()
+        self.template_dict = get_template_dict()
         self.current_template = None
 
     def start(self):
         """ spawns a coroutine connecting to the event queue on the target """
 
+        # the posts block, so they have to yield to the other coroutines
+        use_coroutine_sockets()
+
         try:
 
             if self.cap.name == 'event_queue':
@@ -175,46 +176,79 @@ class EventQueueClient(object):
                 try:
                     api.sleep(self.settings.REGION_EVENT_QUEUE_POLL_INTERVAL)
 
-                    self.data = {}
-                    if self.last_id != -1:
-                        self.data = {'ack':self.last_id}
-
-                    if self.settings.ENABLE_EQ_LOGGING: 
-                        if self.settings.ENABLE_HOST_LOGGING:
-                            host_string = ' to (%s)' % self.host
-                        else:
-                            host_string = ''
-                        logger.debug('Posting to the event queue%s: %s' % (host_string, self.data))
+                    self._region_poll_data()
 
                     try:
-                        self.result = self.cap.POST(self.data)
+                        result = self.cap.POST(self.data)
                     except Exception, error:
-                        if self.settings.ENABLE_HOST_LOGGING:
-                            host_string = ' from (%s)' % self.host
-                        else:
-                            host_string = ''
-                        logger.info("Received an error we ought not care about%s: %s" % (host_string, error))
-
-                    if self.result != None: 
-                        self.last_id = self.result['id']
-                    else:
-                        self.last_id = -1
+                        result = self._region_poll_error(error)
 
-                    self._parse_result(self.result)
+                    self._region_poll_result(result)
 
                 except Exception, error:
                     logger.warning("Error in a post to the event queue. Error was: %s" % (error))
 
-            if self.last_id != -1:
-                # Need to ack the last message received, otherwise it will be
-                # resent if we re-connect to the same queue
-                self.data = {'ack':self.last_id, 'done':True}
-                self.cap.POST(self.data)
+            done_data = self._region_done_data()
+            if done_data != None:
+                self.cap.POST(done_data)
 
             self._running = False
 
             logger.debug("Stopped event queue processing for %s" % (self.host))
 
+    # the steps of a poll of a region's event queue, which an event loop
+    # other than eventlet's can run the POST between
+
+    def _region_poll_data(self):
+        """ returns the data to post, acking the last events received """
+
+        self.data = {}
+        if self.last_id != -1:
+            self.data = {'ack':self.last_id}
+
+        if self.settings.ENABLE_EQ_LOGGING: 
+            if self.settings.ENABLE_HOST_LOGGING:
+                host_string = ' to (%s)' % self.host
+            else:
+                host_string = ''
+            logger.debug('Posting to the event queue%s: %s' % (host_string, self.data))
+
+        return self.data
+
+    def _region_poll_error(self, error):
+        """ logs a failed post, returning the result to carry on with """
+
+        if self.settings.ENABLE_HOST_LOGGING:
+            host_string = ' from (%s)' % self.host
+        else:
+            host_string = ''
+        logger.info("Received an error we ought not care about%s: %s" % (host_string, error))
+
+        return self.result
+
+    def _region_poll_result(self, result):
+        """ handles the events a post returned """
+
+        self.result = result
+
+        if self.result != None: 
+            self.last_id = self.result['id']
+        else:
+            self.last_id = -1
+
+        self._parse_result(self.result)
+
+    def _region_done_data(self):
+        """ returns the data to post when stopping, or None """
+
+        if self.last_id != -1:
+            # Need to ack the last message received, otherwise it will be
+            # resent if we re-connect to the same queue
+            self.data = {'ack':self.last_id, 'done':True}
+            return self.data
+
+        return None
+
     def _processADEventQueue(self):
         """ connects to an agent domain's event queue """
 
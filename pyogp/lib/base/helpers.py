@@ -24,7 +24,7 @@ import math
 
 # related
 from llbase import llsd
-from eventlet import api
+from eventlet import api, patcher
 
 # pyogp
 from pyogp.lib.base.exc import DataParsingError, DeserializationFailed
@@ -32,6 +32,16 @@ from pyogp.lib.base.exc import DataParsingError, DeserializationFailed
 # initialize loggin
 logger = getLogger('...utilities.helpers')
 
+def use_coroutine_sockets():
+    """ patches the socket module so that the sockets made from then on
+    are eventlet's cooperative ones, and a coroutine blocked on one doesn't
+    block the others. called by the classes driven by eventlet coroutines,
+    before they make a socket, so that a process using the asyncio backend
+    only keeps the standard library's sockets """
+
+    # a no-op once the socket module is patched
+    patcher.monkey_patch(all = False, socket = True)
+
 
 
 
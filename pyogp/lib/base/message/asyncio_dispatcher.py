@@ -0,0 +1,177 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+"""
+An asyncio transport for UDPDispatcher. Datagrams are read when the event
+loop sees the socket is readable, and handed to the dispatcher's usual
+serializer, deserializer and circuit logic through a DatagramProtocol.
+
+asyncio is optional, and comes from trollius, its backport to python 2.
+trollius is deprecated and no longer maintained. Only callbacks are used,
+no coroutines, so nothing here depends on how the backport differs.
+"""
+
+# standard python libs
+import socket
+import errno
+from logging import getLogger
+
+# related
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+# pyogp
+from pyogp.lib.base.network.net import NetUDPClient, RECEIVE_BATCH_PACKETS, RECEIVE_BATCH_BYTES
+
+logger = getLogger('message.asyncio_dispatcher')
+
+if asyncio != None:
+    DatagramProtocol = asyncio.DatagramProtocol
+else:
+    DatagramProtocol = object
+
+def get_asyncio():
+    """ returns the asyncio module, or trollius, raising ImportError if
+    neither is available """
+
+    if asyncio == None:
+        raise ImportError("the asyncio backend needs trollius")
+
+    return asyncio
+
+class AsyncioUDPClient(NetUDPClient):
+    """ a NetUDPClient with a non blocking socket, for an asyncio loop
+
+    the asyncio loop waits on the socket itself, so it has to be one of
+    the standard library's, see AsyncioMessageManager
+    """
+
+    def start_udp_connection(self):
+        """ Starts a udp connection, returning a non blocking socket """
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(0)
+
+        return sock
+
+    def send_packet(self, sock, send_buffer, host):
+        """ sends send_buffer to host, dropping it if the kernel's send
+        buffer is full. reliable packets are resent, like any other loss """
+
+        if send_buffer == None:
+            raise Exception("No data specified")
+
+        try:
+            sock.sendto(send_buffer, (host.ip, host.port))
+        except socket.error, error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                raise
+            logger.debug("Dropped a packet to %s: %s" % (host, error))
+
+class UDPDispatcherProtocol(DatagramProtocol):
+    """ hands the datagrams received to a UDPDispatcher
+
+    received is called with the packets the dispatcher returns after
+    each batch, so whatever sends acks and queued messages can be woken
+    """
+
+    def __init__(self, dispatcher, received = None):
+        self.dispatcher = dispatcher
+        self.received = received
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.datagrams_received([(data, addr)])
+
+    def datagrams_received(self, data_addr_pairs):
+        """ receives a batch of (data, addr) pairs at once """
+
+        # the data can be a str or a view, as for the receive ring
+        packets = self.dispatcher.receive_views(data_addr_pairs)
+
+        if self.received != None:
+            self.received(packets)
+
+    def error_received(self, error):
+        logger.warning("Error on the UDP socket: %s" % (error))
+
+    def connection_lost(self, error):
+        self.transport = None
+
+class DatagramSocketTransport(object):
+    """ runs a UDPDispatcherProtocol on the dispatcher's own socket
+
+    the socket is created by the dispatcher's udp_client, which not every
+    version of create_datagram_endpoint() can be handed, so this reads it
+    with add_reader() and drains it with NetUDPClient.receive_batch()
+    """
+
+    def __init__(self, loop, dispatcher, protocol,
+                 max_packets = RECEIVE_BATCH_PACKETS, max_bytes = RECEIVE_BATCH_BYTES):
+        self.loop = loop
+        self.dispatcher = dispatcher
+        self.protocol = protocol
+        self.sock = dispatcher.socket
+        self.max_packets = max_packets
+        self.max_bytes = max_bytes
+        self.reading = False
+
+    def start(self):
+
+        self.loop.add_reader(self.sock.fileno(), self.__read_ready)
+        self.reading = True
+        self.protocol.connection_made(self)
+
+    def __read_ready(self):
+
+        try:
+            packets = self.dispatcher.udp_client.receive_batch(self.sock, self.max_packets,
+                                                               self.max_bytes, block = False)
+        except socket.error, error:
+            self.protocol.error_received(error)
+            return
+
+        if packets:
+            self.protocol.datagrams_received([(data, (host.ip, host.port)) for host, data in packets])
+
+    def sendto(self, data, addr):
+
+        self.sock.sendto(data, addr)
+
+    def get_extra_info(self, name, default = None):
+
+        if name == 'socket':
+            return self.sock
+        if name == 'sockname':
+            return self.sock.getsockname()
+        return default
+
+    def close(self):
+
+        if self.reading:
+            self.loop.remove_reader(self.sock.fileno())
+            self.reading = False
+            self.protocol.connection_lost(None)
@@ -16,7 +16,34 @@ or in
 $/LicenseInfo$
 """
 
-from msgtypes import PackFlags
+# standard python libs
+import time
+
+from msgtypes import PackFlags, PacketLayout
+from stats import Histogram
+from throttle import Throttle
+
+# how many incoming packet ids, back from the newest, a circuit remembers
+# having seen
+PACKET_IN_WINDOW = 1024
+PACKET_IN_MASK = (1 << PACKET_IN_WINDOW) - 1
+
+# retransmission timeout estimation, as in RFC 6298. times are in seconds
+RTO_INITIAL = 1.0
+RTO_MIN = 1.0
+RTO_MAX = 60.0
+RTT_ALPHA = 1.0 / 8
+RTT_BETA = 1.0 / 4
+RTT_K = 4
+# the granularity of the clock the round trips are timed with
+RTT_GRANULARITY = 0.01
+
+# the counters Circuit.get_stats() reports, which add up across circuits
+STAT_COUNTERS = ('packets_in', 'bytes_in', 'packets_out', 'bytes_out',
+                 'packets_resent', 'duplicates_in', 'reordered_in',
+                 'acks_in', 'acks_out', 'retransmits_avoided', 'rtt_samples',
+                 'unack_packet_count', 'unack_packet_bytes',
+                 'final_packet_count')
 
 class Host(object):
 
@@ -40,11 +67,10 @@ class Host(object):
 
 class Circuit(object):
     """ This is used to keep track of a given circuit. It keeps statistics
-        as well as circuit information. """
-    """ Some statistics things we may need: bytes/packets in, bytes/packets out,
-        unacked packet count/bytes, acked packet count/bytes"""
+        as well as circuit information. get_stats() returns a snapshot of
+        the statistics. """
 
-    def __init__(self, host, pack_in_id):
+    def __init__(self, host, pack_in_id, clock = None):
         self.host = host
         self.circuit_code = 0
         self.session_id = 0
@@ -53,15 +79,54 @@ class Circuit(object):
         self.is_blocked = False
         self.allow_timeout = True
         self.last_packet_out_id  = 0  #id of the packet we last sent
-        self.last_packet_in_id   = pack_in_id
+        self.last_packet_in_id   = pack_in_id #highest id we have received
+
+        #bit n is set when packet last_packet_in_id - n has been received
+        self.packet_in_window    = 0
+        self.duplicates_in       = 0  #packets dropped as already received
+        self.reordered_in        = 0  #packets received after a higher id
 
         self.acks                = [] #packets we need to ack (ids)       
+        self.oldest_ack_time     = None #when the oldest of those came in
         self.unacked_packets     = {} #packets we want acked, can be resent
         self.unack_packet_count  = 0
         self.unack_packet_bytes  = 0
         self.final_retry_packets = {} #packets we want acked, can't be resent
         self.final_packet_count  = 0
 
+        #acks read from packets that weren't decoded, which cleared a
+        #packet that would otherwise have been resent
+        self.retransmits_avoided = 0
+
+        #traffic counters, kept up to date by the dispatcher
+        self.packets_in          = 0
+        self.bytes_in            = 0
+        self.packets_out         = 0  #including resends and PacketAcks
+        self.bytes_out           = 0
+        self.packets_resent      = 0
+        self.acks_in             = 0  #acks received for our packets
+        self.acks_out            = 0  #acks sent, appended or in PacketAcks
+
+        #round trip time estimates, from the acks to our reliable packets
+        if clock == None:
+            clock = time.time
+        self.clock               = clock
+        self.srtt                = None #smoothed round trip time
+        self.rttvar              = None #round trip time variation
+        self.rto                 = RTO_INITIAL #retransmission timeout
+        self.rtt_samples         = 0
+        self.last_rtt            = None
+        self.rtt_histogram       = Histogram()
+        #the differences between consecutive round trip times
+        self.jitter_histogram    = Histogram()
+
+        #the bandwidth this circuit may send with, by traffic category
+        self.throttle            = Throttle(clock = clock)
+
+        #the handler of the agent this circuit belongs to, when a
+        #dispatcher is shared, or None for the dispatcher's own
+        self.message_handler     = None
+
     def next_packet_id(self):
         self.last_packet_out_id += 1
         return self.last_packet_out_id
@@ -72,21 +137,55 @@ class Circuit(object):
 
         packet.packet_id = self.next_packet_id()
 
-        #if we have acks that we can add on, add them
-        ack_count = len(self.acks)
-        if ack_count > 0 and packet.name != "PacketAck":
-            packet.send_flags |= PackFlags.LL_ACK_FLAG
-
-            #also, sends as many acks as we can onto the end of the packet
-            #acks are just the packet_id that we are acking
-            for packet_id in self.acks:
+        #offer the acks we owe to the serializer, which appends as many as
+        #fit in the packet and sets LL_ACK_FLAG. acks_sent() then takes
+        #those off the list. acks are just the packet_id that we are acking
+        packet.acks = []
+        packet.num_acks = 0
+        if len(self.acks) > 0 and packet.name != "PacketAck":
+            for packet_id in self.acks[:PacketLayout.MAX_APPENDED_ACKS]:
                 packet.add_ack(packet_id)
 
         if flag == PackFlags.LL_RELIABLE_FLAG:
             self.add_reliable_packet(packet)
 
+    def track_packet_in(self, packet_id):
+        """ records an incoming packet id, returning True if it has
+            already been received on this circuit """
+
+        delta = packet_id - self.last_packet_in_id
+
+        if delta > 0:
+            #the newest packet yet, slide the window up to it
+            if delta >= PACKET_IN_WINDOW:
+                self.packet_in_window = 1
+            else:
+                self.packet_in_window = ((self.packet_in_window << delta) | 1) & PACKET_IN_MASK
+            self.last_packet_in_id = packet_id
+            return False
+
+        delta = -delta
+
+        if delta >= PACKET_IN_WINDOW:
+            #too old to tell, let it through
+            self.reordered_in += 1
+            return False
+
+        bit = 1 << delta
+
+        if self.packet_in_window & bit:
+            self.duplicates_in += 1
+            return True
+
+        self.packet_in_window |= bit
+        if delta > 0:
+            self.reordered_in += 1
+
+        return False
+
     def handle_packet(self, packet):
         #if its a reliable packet, get all acks from packet, set them to be acked
+        self.acks_in += len(packet.acks)
         for ack_packet_id in packet.acks:
             self.ack_reliable_packet(ack_packet_id)
 
@@ -94,18 +193,90 @@ class Circuit(object):
             self.collect_ack(packet.packet_id)
 
     def ack_reliable_packet(self, packet_id):
+        """ marks one of our reliable packets as acked, returning True if
+            it was still waiting to be resent """
+        acked = False
+
         #go through the packets waiting to be acked, and set them as acked
         if packet_id in self.unacked_packets:
-            del self.unacked_packets[packet_id]
+            packet = self.unacked_packets.pop(packet_id)
             self.unack_packet_count -= 1
+            if packet.buffer != None:
+                self.unack_packet_bytes -= len(packet.buffer)
+            acked = True
+
+            #only time the round trip of packets that were sent once, as
+            #the ack for a resent packet could be for either copy (Karn)
+            if not packet.resent and packet.sent_time != None:
+                self.update_rtt(self.clock() - packet.sent_time)
 
         if packet_id in self.final_retry_packets:
             del self.final_retry_packets[packet_id]
             self.final_packet_count -= 1
 
+        return acked
+
+    def handle_acks(self, packet_ids):
+        """ applies the acks read from a packet that wasn't decoded,
+            returning how many of them cleared a packet waiting to be resent """
+        avoided = 0
+
+        self.acks_in += len(packet_ids)
+        for packet_id in packet_ids:
+            if self.ack_reliable_packet(packet_id):
+                avoided += 1
+
+        self.retransmits_avoided += avoided
+
+        return avoided
+
+    def acks_sent(self, packet_ids):
+        """ takes acks that went out appended to a packet off the list of
+            acks this circuit still needs to send """
+
+        sent = set(packet_ids)
+        self.acks = [packet_id for packet_id in self.acks if packet_id not in sent]
+
+        if len(self.acks) == 0:
+            self.oldest_ack_time = None
+
+    def take_acks(self):
+        """ returns the acks this circuit needs to send, and clears them """
+
+        acks = self.acks
+        self.acks = []
+        self.oldest_ack_time = None
+
+        return acks
+
+    def update_rtt(self, rtt):
+        """ updates the round trip time estimates and the retransmission
+            timeout with a measured round trip time """
+
+        if self.srtt == None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+
+        self.rtt_samples += 1
+        self.rtt_histogram.add(rtt)
+        if self.last_rtt != None:
+            self.jitter_histogram.add(abs(rtt - self.last_rtt))
+        self.last_rtt = rtt
+        self.rto = min(max(self.srtt + max(RTT_GRANULARITY, RTT_K * self.rttvar), RTO_MIN), RTO_MAX)
+
+    def back_off(self):
+        """ doubles the retransmission timeout after a packet timed out """
+
+        self.rto = min(self.rto * 2, RTO_MAX)
+
     def collect_ack(self, packet_id):
         """ set a packet_id that this circuit needs to eventually ack
             (need to send ack out)"""
+        if len(self.acks) == 0:
+            self.oldest_ack_time = self.clock()
         self.acks.append(packet_id)
 
     def add_reliable_packet(self, packet):
@@ -121,12 +292,38 @@ class Circuit(object):
         #else:
         #self.final_retry_packets[packet.packet_id] = packet
 
+    def remove_reliable_packet(self, packet):
+        """ takes back a packet added with add_reliable_packet, that was
+            never sent """
+
+        if self.unacked_packets.get(packet.packet_id) is packet:
+            del self.unacked_packets[packet.packet_id]
+            self.unack_packet_count -= 1
+            if packet.buffer != None:
+                self.unack_packet_bytes -= len(packet.buffer)
+
+    def get_stats(self):
+        """ returns a dict of the circuit's current statistics """
+
+        stats = {}
+        for name in STAT_COUNTERS:
+            stats[name] = getattr(self, name)
+
+        stats['srtt'] = self.srtt
+        stats['rttvar'] = self.rttvar
+        stats['rto'] = self.rto
+        stats['rtt'] = self.rtt_histogram.snapshot()
+        stats['jitter'] = self.jitter_histogram.snapshot()
+
+        return stats
+
 class CircuitManager(object):
     """ Manages a collection of circuits and provides some higher-level
         functionality to do so. """
-    def __init__(self):
+    def __init__(self, clock = None):
         self.circuit_map = {}
         self.unacked_circuits = {}
+        self.clock = clock
 
     def get_unacked_circuits(self):
         #go through circuits, if it has any unacked packets waiting ack, add
@@ -140,7 +337,7 @@ class CircuitManager(object):
         return None
 
     def add_circuit(self, host, packet_in_id):
-        circuit = Circuit(host, packet_in_id)
+        circuit = Circuit(host, packet_in_id, self.clock)
 
         self.circuit_map[(host.ip, host.port)] = circuit
         return circuit
@@ -156,5 +353,32 @@ class CircuitManager(object):
         circuit = self.circuit_map[(host.ip, host.port)]
         return circuit.is_alive
 
+    def get_stats(self):
+        """ returns a dict of the statistics of each circuit, by
+            (ip, port) """
+
+        stats = {}
+        for key, circuit in self.circuit_map.items():
+            stats[key] = circuit.get_stats()
+
+        return stats
+
+    def get_total_stats(self):
+        """ returns the statistics of all the circuits added together,
+            with the round trip times of every circuit in one histogram """
+
+        stats = dict([(name, 0) for name in STAT_COUNTERS])
+        rtt = Histogram()
+        jitter = Histogram()
+
+        for circuit in self.circuit_map.values():
+            for name in STAT_COUNTERS:
+                stats[name] += getattr(circuit, name)
+            rtt.merge(circuit.rtt_histogram)
+            jitter.merge(circuit.jitter_histogram)
 
+        stats['circuits'] = len(self.circuit_map)
+        stats['rtt'] = rtt.snapshot()
+        stats['jitter'] = jitter.snapshot()
 
+        return stats
@@ -0,0 +1,234 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+"""
+Columnar decoding of message blocks into NumPy structured arrays, one
+row per block repetition and one column per variable, so that all the
+repetitions of a block can be processed with vectorized operations.
+
+numpy is optional, and only needed when a ColumnarDecoder is built.
+"""
+
+# standard python libs
+from logging import getLogger
+
+# related
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# pyogp
+from pyogp.lib.base import exc
+
+# pyogp messaging
+from msgtypes import MsgType
+from template_decoder import FixedRun
+
+logger = getLogger('message.columnar')
+
+# maps each fixed size type to the numpy dtype of its column, laid out
+# exactly as it is on the wire. raw types (uuids, ip addresses and fixed
+# data) are void columns, vectors are sub arrays, and quaternions are the
+# three components that are sent
+COLUMN_TYPES = {
+    MsgType.MVT_S8:           'i1',
+    MsgType.MVT_U8:           'u1',
+    MsgType.MVT_BOOL:         'u1',
+    MsgType.MVT_LLUUID:       'V16',
+    MsgType.MVT_IP_ADDR:      'V4',
+    MsgType.MVT_IP_PORT:      '>u2',
+    MsgType.MVT_U16:          '<u2',
+    MsgType.MVT_U32:          '<u4',
+    MsgType.MVT_U64:          '<u8',
+    MsgType.MVT_S16:          '<i2',
+    MsgType.MVT_S32:          '<i4',
+    MsgType.MVT_S64:          '<i8',
+    MsgType.MVT_F32:          '<f4',
+    MsgType.MVT_F64:          '<f8',
+    MsgType.MVT_LLVector3:    ('<f4', (3,)),
+    MsgType.MVT_LLVector3d:   ('<f8', (3,)),
+    MsgType.MVT_LLVector4:    ('<f4', (4,)),
+    MsgType.MVT_LLQuaternion: ('<f4', (3,)),
+    }
+
+def column_type(variable):
+    """ returns the dtype description of a template variable's column.
+    MVT_VARIABLE data is held in an object column """
+
+    if variable.type == MsgType.MVT_VARIABLE:
+        return object
+    elif variable.type == MsgType.MVT_FIXED:
+        return 'V%d' % (variable.size)
+
+    return COLUMN_TYPES[variable.type]
+
+def block_dtype(template_block):
+    """ returns the numpy structured dtype for the repetitions of a
+    MessageTemplateBlock, with one field per variable in template order """
+
+    return variables_dtype(template_block.variables)
+
+def variables_dtype(variables):
+    """ returns the packed numpy structured dtype for a list of template
+    variables """
+
+    if numpy == None:
+        raise exc.MessageDeserializationError("columnar", "numpy is not available")
+
+    fields = []
+    for variable in variables:
+        column = column_type(variable)
+        if isinstance(column, tuple):
+            fields.append((variable.name,) + column)
+        else:
+            fields.append((variable.name, column))
+
+    return numpy.dtype(fields)
+
+class ColumnarBlockDecoder(object):
+    """ decodes every repetition of one block into a structured array """
+
+    def __init__(self, block_decoder, template_block):
+
+        self.block = block_decoder
+        self.name = block_decoder.name
+        self.dtype = block_dtype(template_block)
+
+        # the fixed size variables, as they are packed in each repetition
+        fixed = [variable for variable in template_block.variables if variable.type != MsgType.MVT_VARIABLE]
+        self.fixed_dtype = variables_dtype(fixed)
+        self.fixed_names = [variable.name for variable in fixed]
+
+        # blocks without variable data are read straight from the buffer
+        self.packed = block_decoder.size != None
+
+    def decode(self, data, decode_pos, data_len):
+        """ decodes the block repetitions at decode_pos, returning
+        (array, position after them), or (None, -1) if the data is short
+
+        blocks of fixed size variables only are returned as read only
+        arrays over data, without copying it
+        """
+
+        repeat_count, decode_pos = self.block.repeat_count(data, decode_pos, data_len)
+        if repeat_count < 0:
+            return None, -1
+
+        if self.packed:
+
+            end = decode_pos + repeat_count * self.block.size
+            if end > data_len:
+                logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(end), str(data_len), self.block.template_name))
+                return None, -1
+
+            return numpy.frombuffer(data, self.dtype, repeat_count, decode_pos), end
+
+        # gather the fixed size variables of every repetition into one
+        # buffer, and the variable data into per column lists
+        chunks = []
+        columns = {}
+        for step in self.block.steps:
+            if step.__class__ is not FixedRun:
+                columns[step.name] = []
+
+        for i in range(repeat_count):
+            for step in self.block.steps:
+
+                if step.__class__ is FixedRun:
+
+                    if decode_pos + step.size > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + step.size), str(data_len), self.block.template_name))
+                        return None, -1
+
+                    chunks.append(data[decode_pos:decode_pos + step.size])
+                    decode_pos += step.size
+
+                else:
+
+                    if (decode_pos + step.prefix_size) > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + step.prefix_size), str(data_len), self.block.template_name))
+                        return None, -1
+
+                    var_size = step.prefix.unpack_from(data, decode_pos)[0]
+                    decode_pos += step.prefix_size
+
+                    if (decode_pos + var_size) > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + var_size), str(data_len), self.block.template_name))
+                        return None, -1
+
+                    value = data[decode_pos:decode_pos + var_size]
+                    if step.strip:
+                        value = value.rstrip('\x00')
+
+                    columns[step.name].append(value)
+                    decode_pos += var_size
+
+        array = numpy.zeros(repeat_count, self.dtype)
+
+        if self.fixed_names:
+            fixed = numpy.frombuffer(''.join(chunks), self.fixed_dtype, repeat_count)
+            for name in self.fixed_names:
+                array[name] = fixed[name]
+
+        for name, values in columns.items():
+            column = array[name]
+            for i in range(repeat_count):
+                column[i] = values[i]
+
+        return array, decode_pos
+
+class ColumnarDecoder(object):
+    """ decodes the blocks of a template into structured arrays
+
+    Use TemplateDictionary.get_columnar_decoder() to get the cached instance
+    for a template.
+    """
+
+    def __init__(self, template, template_decoder):
+
+        self.name = template.name
+        self.blocks = [ColumnarBlockDecoder(block_decoder, template_block)
+                       for block_decoder, template_block in zip(template_decoder.blocks, template.blocks)]
+        self.block_map = dict([(block.name, block) for block in self.blocks])
+
+    def decode_block(self, block_name, data, decode_pos, data_len = None):
+        """ decodes the block at decode_pos, as located by
+        TemplateDecoder.scan(), returning its array or None """
+
+        if data_len == None:
+            data_len = len(data)
+
+        return self.block_map[block_name].decode(data, decode_pos, data_len)[0]
+
+    def decode(self, data, decode_pos, data_len = None):
+        """ decodes the message body starting at decode_pos, returning a
+        dict of block name to array, or None if the data is short """
+
+        if data_len == None:
+            data_len = len(data)
+
+        arrays = {}
+
+        for block in self.blocks:
+            array, decode_pos = block.decode(data, decode_pos, data_len)
+            if decode_pos < 0:
+                return None
+            arrays[block.name] = array
+
+        return arrays
@@ -19,6 +19,7 @@ $/LicenseInfo$
 # standard python libs
 import array
 import binascii
+import math
 import struct
 import traceback
 
@@ -53,6 +54,12 @@ class DataUnpacker(object):
         self.unpacker[MsgType.MVT_LLVector4]      = ('<',self.__unpack_vector4)
         self.unpacker[MsgType.MVT_LLQuaternion]   = ('<',self.__unpack_quat)
 
+        # types handed back as raw bytes by unpack_data_from
+        self.raw_types = (MsgType.MVT_FIXED, MsgType.MVT_VARIABLE, MsgType.MVT_IP_ADDR)
+
+        # struct.Struct instances used by unpack_data_from, by format
+        self.structs = {}
+
     def unpack_data(self, data, data_type, start_index=-1, \
                     var_size=-1, endian_type=EndianType.NONE):
         if start_index != -1:
@@ -84,6 +91,73 @@ class DataUnpacker(object):
 
         return None
 
+    def unpack_data_from(self, data, data_type, offset=0, \
+                         var_size=-1, endian_type=EndianType.NONE, as_view=False):
+        """ unpacks the value at offset in data without slicing the buffer
+
+        numeric types are read in place with struct.unpack_from, and
+        when as_view is True MVT_FIXED, MVT_VARIABLE and MVT_IP_ADDR
+        payloads are returned as a memoryview into data instead of a copy
+        """
+
+        if data_type not in self.unpacker:
+            return None
+
+        endian, unpack = self.unpacker[data_type]
+        #override endian
+        if endian_type != EndianType.NONE:
+            endian = endian_type
+
+        if var_size == -1:
+            var_size = sizeof(data_type)
+
+        try:
+
+            if data_type in self.raw_types:
+                if offset + var_size > len(data):
+                    raise struct.error("unpack requires a buffer of %s bytes" % (offset + var_size))
+                if as_view:
+                    return memoryview(data)[offset:offset+var_size]
+                return data[offset:offset+var_size]
+
+            elif data_type == MsgType.MVT_LLUUID:
+                return UUID(bytes=self.__get_struct('16s').unpack_from(data, offset)[0])
+
+            elif data_type == MsgType.MVT_LLVector3:
+                x, y, z = self.__get_struct('<3f').unpack_from(data, offset)
+                return Vector3(X=x, Y=y, Z=z)
+
+            elif data_type == MsgType.MVT_LLVector3d:
+                return self.__get_struct('<3d').unpack_from(data, offset)
+
+            elif data_type == MsgType.MVT_LLVector4:
+                return self.__get_struct('<4f').unpack_from(data, offset)
+
+            elif data_type == MsgType.MVT_LLQuaternion:
+                x, y, z = self.__get_struct('<3f').unpack_from(data, offset)
+                # the quaternion is packed as a vector3, as in Quaternion.unpack_from_bytes
+                t = 1.0 - (x*x + y*y + z*z)
+                if t > 0:
+                    w = math.sqrt(t)
+                else:
+                    w = 0
+                quat = Quaternion(X=x, Y=y, Z=z)
+                quat.W = w
+                return quat
+
+            return self.__get_struct(endian + unpack).unpack_from(data, offset)[0]
+
+        except struct.error, error:
+            raise DataUnpackingError(data_type, error)
+
+    def __get_struct(self, fmt):
+        """ returns a cached struct.Struct for fmt """
+
+        try:
+            return self.structs[fmt]
+        except KeyError:
+            return self.structs.setdefault(fmt, struct.Struct(fmt))
+
     def __unpack_tuple(self, endian, tup, tp, var_size=None):
         size = len(tup) / struct.calcsize(tp)
         return struct.unpack(endian + str(size) + tp, tup)
@@ -18,11 +18,13 @@ $/LicenseInfo$
 
 # standard
 from binascii import hexlify
+from UserDict import DictMixin
 
 #related
 from llbase import llsd
 
 # pyogp
+from pyogp.lib.base import exc
 from template import MsgData, MsgBlockData, MsgVariableData
 from msgtypes import PackFlags
 
@@ -95,6 +97,7 @@ class Message(MessageBase):
         self.send_flags         = PackFlags.LL_NONE
         self.packet_id          = 0 # aka, sequence number
         self.event_queue_id     = 0 # aka, event queue id
+        self.template_id        = None # set when deserialized from udp
 
         #self.message_data       = context
         #self.blocks = {}
@@ -110,6 +113,10 @@ class Message(MessageBase):
         self.host               = None
         self.expiration_time    = 0
 
+        #the packet as sent, kept while a reliable packet waits for its ack
+        self.buffer             = None
+        self.sent_time          = None #when a reliable packet was first sent
+
     def add_ack(self, packet_id):
 
         self.acks.append(packet_id)
@@ -204,6 +211,123 @@ class Message(MessageBase):
 
         return self.data()
 
+class LazyBlocks(DictMixin):
+    """ the blocks of a LazyMessage, keyed by block name like
+    MsgData.blocks, but decoding each block from the buffer the first time
+    it is looked up """
+
+    def __init__(self, data, data_len, offsets, view = None, keep_data = False):
+
+        self.data = data
+        self.data_len = data_len
+        self.view = view
+        self.keep_data = keep_data
+
+        # block name -> (BlockDecoder, position), for every block present
+        self.positions = {}
+
+        # block name -> (BlockDecoder, position), for the undecoded blocks
+        self.pending = {}
+        # block name -> list of MsgBlockData, for the decoded ones
+        self.decoded = {}
+        # block names in template order; blocks with no repetitions, and
+        # blocks skipped by a projected decoder, are left out, as they are
+        # when a message is decoded up front
+        self.order = []
+
+        for block, decode_pos, repeat_count in offsets:
+            if repeat_count > 0 and not block.skipped:
+                self.pending[block.name] = (block, decode_pos)
+                self.positions[block.name] = (block, decode_pos)
+                self.order.append(block.name)
+
+    def is_decoded(self, block_name):
+
+        return block_name in self.decoded
+
+    def __decode(self, block_name):
+
+        block, decode_pos = self.pending.pop(block_name)
+
+        collector = MsgData(block_name)
+        block.decode(self.data, decode_pos, self.data_len, collector, self.view)
+
+        self.decoded[block_name] = collector.blocks.get(block_name, [])
+
+        # let go of the buffer once everything has been decoded
+        if len(self.pending) == 0 and not self.keep_data:
+            self.data = None
+            self.view = None
+
+    def __getitem__(self, block_name):
+
+        if block_name not in self.decoded:
+            if block_name not in self.pending:
+                raise KeyError(block_name)
+            self.__decode(block_name)
+
+        return self.decoded[block_name]
+
+    def __setitem__(self, block_name, value):
+
+        self.pending.pop(block_name, None)
+        if block_name not in self.order:
+            self.order.append(block_name)
+        self.decoded[block_name] = value
+
+    def __delitem__(self, block_name):
+
+        if block_name not in self.order:
+            raise KeyError(block_name)
+
+        self.pending.pop(block_name, None)
+        self.decoded.pop(block_name, None)
+        self.order.remove(block_name)
+
+    def __contains__(self, block_name):
+
+        return block_name in self.pending or block_name in self.decoded
+
+    def __iter__(self):
+
+        return iter(list(self.order))
+
+    def __len__(self):
+
+        return len(self.order)
+
+    def keys(self):
+
+        return list(self.order)
+
+    def __repr__(self):
+
+        return repr(dict(self.iteritems()))
+
+class LazyMessage(Message):
+    """ a Message that keeps the decoded buffer and the block offsets found
+    by TemplateDecoder.scan(), and decodes a block only when it is first
+    looked up through blocks, get_block() or message[block_name] """
+
+    def __init__(self, name, data, data_len, offsets, view = None, columnar_decoder = None):
+
+        super(LazyMessage, self).__init__(name)
+
+        # the buffer is kept for get_columns() when columns can be decoded
+        self.blocks = LazyBlocks(data, data_len, offsets, view, 
+                                 keep_data = columnar_decoder != None)
+        self.columnar_decoder = columnar_decoder
+
+    def get_columns(self, block_name):
+        """ returns every repetition of a block as a numpy structured
+        array with a column per variable, see columnar.ColumnarDecoder.
+        only available when the message was deserialized with
+        ENABLE_COLUMNAR_BLOCKS """
+
+        if self.columnar_decoder == None:
+            raise exc.MessageDeserializationError(self.name, "columnar decoding is not enabled")
 
+        block, decode_pos = self.blocks.positions[block_name]
 
+        return self.columnar_decoder.decode_block(block_name, self.blocks.data, decode_pos, self.blocks.data_len)
 
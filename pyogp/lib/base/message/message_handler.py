@@ -42,11 +42,61 @@ class MessageHandler(object):
 
         self.handlers = {}
 
-    def register(self, message_name):
+        # the handlers indexed by template id, once bound to a TemplateDictionary
+        self.template_dict = None
+        self.handlers_by_id = None
+
+    def bind(self, template_dict):
+        """ indexes the handlers by the template ids of template_dict, so
+        that deserialized messages are dispatched without name lookups """
+
+        self.template_dict = template_dict
+        self.handlers_by_id = [None] * len(template_dict.templates_by_id)
+
+        for message_name in self.handlers:
+            self.__index(message_name)
+
+    def __index(self, message_name):
+
+        if self.template_dict == None:
+            return
+
+        template = self.template_dict.get_template(message_name)
+        if template != None:
+            self.handlers_by_id[template.template_id] = self.handlers[message_name]
+
+    def register(self, message_name, fields = None):
+        """ returns the notifier for message_name
+
+        fields optionally lists the parts of the message the subscriber
+        needs, as 'Block.Variable' or 'Block' strings, e.g.
+        ['ObjectData.FullID', 'ObjectData.ObjectData']. the message is then
+        only decoded for the fields requested across all registrations.
+        registering without fields always gets the whole message.
+        """
 
         if self.settings.LOG_VERBOSE: logger.debug('Creating a monitor for %s' % (message_name))
 
-        return self.handlers.setdefault(message_name, MessageHandledNotifier(message_name, self.settings))
+        if message_name not in self.handlers:
+            self.handlers[message_name] = MessageHandledNotifier(message_name, self.settings, fields)
+            self.__index(message_name)
+
+        handler = self.handlers[message_name]
+        handler.add_fields(fields)
+
+        return handler
+
+    def get_fields(self, message_name):
+        """ returns the set of fields requested for message_name, or None
+        when the whole message is needed """
+
+        try:
+
+            return self.handlers[message_name].fields
+
+        except KeyError:
+
+            return None
 
     def is_message_handled(self, message_name):
         """ if the message is being monitored, return True, otherwise, return False 
@@ -63,12 +113,27 @@ class MessageHandler(object):
 
             return False
 
+    def get_handler_by_id(self, template_id):
+        """ returns the notifier for a template id, or None if the message
+        is not being monitored or the handler is not bound """
+
+        if self.handlers_by_id == None:
+            return None
+
+        return self.handlers_by_id[template_id]
+
     def handle(self, message):
         """ essentially a case statement to pass messages to event notifiers in the form of self attributes """
 
         try:
 
-            handler = self.handlers[message.name]
+            # deserialized udp messages carry their template id
+            if message.template_id != None and self.handlers_by_id != None:
+                handler = self.handlers_by_id[message.template_id]
+                if handler == None:
+                    return
+            else:
+                handler = self.handlers[message.name]
 
             # Handle the message if we have subscribers
             # Conveniently, this will also enable verbose message logging
@@ -84,11 +149,23 @@ class MessageHandler(object):
 class MessageHandledNotifier(object):
     """ pseudo subclassing the Event class to treat the message like an event """
 
-    def __init__(self, message_name, settings):
+    def __init__(self, message_name, settings, fields = None):
         self.event = Event()
         self.message_name = message_name
         self.settings = settings
 
+        # the fields decoded for subscribers, None for the whole message
+        self.fields = None
+        if fields != None:
+            self.fields = frozenset(fields)
+
+    def add_fields(self, fields):
+
+        if fields == None:
+            self.fields = None
+        elif self.fields != None:
+            self.fields = self.fields.union(fields)
+
     def subscribe(self, *args, **kwdargs):
         self.event.subscribe(*args, **kwdargs)
 
@@ -27,6 +27,10 @@ class PacketLayout(object):
     PHL_NAME = 6
     #1 byte flags, 4 bytes sequence, 1 byte offset + 1 byte message name (high)
     MINIMUM_VALID_PACKET_SIZE = PACKET_ID_LENGTH + 1
+    #acks are appended after the body as 4 byte ids, followed by a count byte
+    MAX_APPENDED_ACKS = 255
+    #packets only get acks appended while they stay within this size
+    ACK_MTU = 1200
 
 class EndianType(object):
     LITTLE  = '<'
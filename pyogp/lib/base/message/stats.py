@@ -0,0 +1,84 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+from bisect import bisect_left
+
+# the upper bounds, in seconds, of the buckets round trip times and
+# jitter are counted in. the last bucket counts everything above them
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram(object):
+    """ counts values in buckets with fixed upper bounds
+
+    bounds is a sorted sequence, a value goes in the first bucket whose
+    bound is not below it, or in the extra bucket past the last bound
+    """
+
+    def __init__(self, bounds = TIME_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """ adds the counts of another histogram with the same bounds """
+
+        if other.bounds != self.bounds:
+            raise ValueError("histogram bounds differ")
+
+        for i in range(len(self.counts)):
+            self.counts[i] += other.counts[i]
+        self.count += other.count
+        self.total += other.total
+
+        if other.min != None and (self.min == None or other.min < self.min):
+            self.min = other.min
+        if other.max != None and (self.max == None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def snapshot(self):
+        """ returns a dict of the histogram's current values """
+
+        return {'bounds': self.bounds,
+                'counts': list(self.counts),
+                'count': self.count,
+                'mean': self.mean(),
+                'min': self.min,
+                'max': self.max}
+
+    def __repr__(self):
+        return 'Histogram(count=%s, mean=%s, min=%s, max=%s)' % (self.count, self.mean(), self.min, self.max)
@@ -179,6 +179,16 @@ class MessageTemplate(object):
         self.msg_deprecation = None
         self.msg_encoding = None
 
+        # the dense integer id assigned by TemplateDictionary
+        self.template_id = None
+
+        # the compiled TemplateDecoder, built on first use by TemplateDictionary
+        self.decoder = None
+        # the compiled TemplateEncoder, built on first use by TemplateDictionary
+        self.encoder = None
+        # the ColumnarDecoder, built on first use by TemplateDictionary
+        self.columnar_decoder = None
+
     def add_block(self, block):
         self.block_map[block.name] = block
         self.blocks.append(block)
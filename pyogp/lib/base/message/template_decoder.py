@@ -0,0 +1,508 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+import copy
+import struct
+from logging import getLogger
+
+# pyogp
+from pyogp.lib.base.datatypes import UUID, Vector3, Quaternion
+from pyogp.lib.base import exc
+
+# pyogp messaging
+from template import MsgBlockData, MsgVariableData
+from msgtypes import MsgType, MsgBlockType, EndianType
+
+logger = getLogger('message.template_decoder')
+
+def _to_uuid(data):
+    return UUID(bytes = data)
+
+def _to_vector3(data):
+    return Vector3(X = data[0], Y = data[1], Z = data[2])
+
+def _to_quaternion(data):
+    return Quaternion(data, 0)
+
+# maps each fixed size type to (endian, struct code, converter)
+# endian is NONE for single byte and raw string types, which can be merged
+# into a run of either endianness
+# the resulting values match what DataUnpacker.unpack_data returns
+FIXED_FORMATS = {
+    MsgType.MVT_S8:           (EndianType.NONE, 'b', None),
+    MsgType.MVT_U8:           (EndianType.NONE, 'B', None),
+    MsgType.MVT_BOOL:         (EndianType.NONE, 'B', None),
+    MsgType.MVT_LLUUID:       (EndianType.NONE, '16s', _to_uuid),
+    MsgType.MVT_IP_ADDR:      (EndianType.NONE, '4s', None),
+    MsgType.MVT_IP_PORT:      (EndianType.BIG, 'H', None),
+    MsgType.MVT_U16:          (EndianType.LITTLE, 'H', None),
+    MsgType.MVT_U32:          (EndianType.LITTLE, 'I', None),
+    MsgType.MVT_U64:          (EndianType.LITTLE, 'Q', None),
+    MsgType.MVT_S16:          (EndianType.LITTLE, 'h', None),
+    MsgType.MVT_S32:          (EndianType.LITTLE, 'i', None),
+    MsgType.MVT_S64:          (EndianType.LITTLE, 'q', None),
+    MsgType.MVT_F32:          (EndianType.LITTLE, 'f', None),
+    MsgType.MVT_F64:          (EndianType.LITTLE, 'd', None),
+    MsgType.MVT_LLVector3:    (EndianType.LITTLE, '3f', _to_vector3),
+    MsgType.MVT_LLVector3d:   (EndianType.LITTLE, '3d', tuple),
+    MsgType.MVT_LLVector4:    (EndianType.LITTLE, '4f', tuple),
+    MsgType.MVT_LLQuaternion: (EndianType.NONE, '12s', _to_quaternion),
+    }
+
+# the struct codes for the length prefix of MVT_VARIABLE data, by prefix size
+VARIABLE_SIZE_FORMATS = {1: struct.Struct('>B'),
+                         2: struct.Struct('<H'),
+                         4: struct.Struct('<I')}
+
+class FixedRun(object):
+    """ a run of adjacent fixed size variables read with one struct.Struct """
+
+    def __init__(self, endian):
+        self.endian = endian
+        self.codes = []
+        self.fields = []    # (name, var_type, key, converter, offset, size)
+        self.variables = [] # (variable, endian, code, converter), as added
+        self.count = 0
+        self.packer = None
+        self.size = 0
+
+    def accepts(self, endian):
+        return endian == EndianType.NONE or \
+               self.endian == EndianType.NONE or \
+               endian == self.endian
+
+    def add(self, variable, endian, code, converter):
+        self.variables.append((variable, endian, code, converter))
+
+        if self.endian == EndianType.NONE:
+            self.endian = endian
+
+        offset = struct.calcsize('<' + ''.join(self.codes))
+
+        if variable.type == MsgType.MVT_FIXED:
+            # raw payloads are skipped by the struct and sliced out by
+            # offset, so that they can be handed back as views
+            code = '%dx' % (variable.size)
+            key = None
+        # multi-value codes (vectors) are handed back as a slice of the values
+        elif code[0].isdigit() and not code.endswith('s'):
+            items = int(code[:-1])
+            key = slice(self.count, self.count + items)
+            self.count += items
+        else:
+            key = self.count
+            self.count += 1
+
+        self.codes.append(code)
+        self.fields.append((variable.name, variable.type, key, converter, offset, variable.size))
+
+    def add_padding(self, size):
+        self.codes.append('%dx' % (size))
+
+    def project(self, var_names):
+        """ returns a copy of this run that only reads the variables in
+        var_names, the others are skipped as padding """
+
+        run = FixedRun(self.endian)
+
+        for variable, endian, code, converter in self.variables:
+            if variable.name in var_names:
+                run.add(variable, endian, code, converter)
+            elif variable.type == MsgType.MVT_FIXED:
+                run.add_padding(variable.size)
+            else:
+                run.add_padding(struct.calcsize('<' + code))
+
+        run.compile()
+        return run
+
+    def compile(self):
+        endian = self.endian
+        if endian == EndianType.NONE:
+            endian = EndianType.LITTLE
+        self.packer = struct.Struct(endian + ''.join(self.codes))
+        self.size = self.packer.size
+
+class VariableField(object):
+    """ a MVT_VARIABLE variable, prefixed with its length """
+
+    def __init__(self, variable):
+        self.name = variable.name
+        self.type = variable.type
+        self.prefix_size = variable.size
+
+        if self.prefix_size not in VARIABLE_SIZE_FORMATS:
+            raise exc.MessageDeserializationError("variable", "unknown data size")
+
+        self.prefix = VARIABLE_SIZE_FORMATS[self.prefix_size]
+
+        # HACK: some variable data needs to be treated as binary instead of as string
+        self.strip = self.name != 'Data'
+
+        # projected decoders step over the variables nobody asked for
+        self.skipped = False
+
+    def project(self, var_names):
+        field = copy.copy(self)
+        field.skipped = self.name not in var_names
+        return field
+
+class BlockDecoder(object):
+    """ decodes every repetition of one block of a template """
+
+    def __init__(self, template_name, template_block):
+        self.template_name = template_name
+        self.name = template_block.name
+        self.block_type = template_block.block_type
+        self.number = template_block.number
+        self.steps = []
+
+        # projected decoders step over the blocks nobody asked for
+        self.skipped = False
+
+        run = None
+
+        for variable in template_block.variables:
+
+            if variable.type == MsgType.MVT_VARIABLE:
+
+                run = None
+                self.steps.append(VariableField(variable))
+
+            else:
+
+                if variable.type == MsgType.MVT_FIXED:
+                    endian, code, converter = EndianType.NONE, None, None
+                else:
+                    endian, code, converter = FIXED_FORMATS[variable.type]
+
+                if run == None or not run.accepts(endian):
+                    run = FixedRun(endian)
+                    self.steps.append(run)
+
+                run.add(variable, endian, code, converter)
+
+        # the size of one repetition, or None when it holds variable data
+        self.size = 0
+
+        for step in self.steps:
+            if isinstance(step, FixedRun):
+                step.compile()
+                if self.size != None:
+                    self.size += step.size
+            else:
+                self.size = None
+
+    def repeat_count(self, data, decode_pos, data_len):
+        """ returns (repeat count, position of the first repetition) for
+        the block at decode_pos, or (-1, -1) for an unknown block type """
+
+        if self.block_type == MsgBlockType.MBT_SINGLE:
+            return 1, decode_pos
+        elif self.block_type == MsgBlockType.MBT_MULTIPLE:
+            return self.number, decode_pos
+        elif self.block_type == MsgBlockType.MBT_VARIABLE:
+            #if the block type is VARIABLE, then the current position
+            #will be the repeat count written in
+            if decode_pos >= data_len:
+                raise exc.DataUnpackingError('', "no repeat count for block %s" % (self.name))
+            return ord(data[decode_pos]), decode_pos + 1
+
+        logger.warning("ERROR: Unknown block type: %s in %s packet." % (str(self.block_type), self.template_name))
+        return -1, -1
+
+    def skip(self, data, decode_pos, data_len):
+        """ walks over the block repetitions at decode_pos without
+        decoding them, returning (repeat count, position after them).
+        the position is -1 if the data is short """
+
+        repeat_count, decode_pos = self.repeat_count(data, decode_pos, data_len)
+        if repeat_count < 0:
+            return -1, -1
+
+        if self.size != None:
+            end = decode_pos + repeat_count * self.size
+            if end > data_len:
+                logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(end), str(data_len), self.template_name))
+                return repeat_count, -1
+            return repeat_count, end
+
+        for i in range(repeat_count):
+            for step in self.steps:
+
+                if step.__class__ is FixedRun:
+                    decode_pos += step.size
+                    if decode_pos > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos), str(data_len), self.template_name))
+                        return repeat_count, -1
+
+                else:
+                    if (decode_pos + step.prefix_size) > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + step.prefix_size), str(data_len), self.template_name))
+                        return repeat_count, -1
+
+                    var_size = step.prefix.unpack_from(data, decode_pos)[0]
+                    decode_pos += step.prefix_size + var_size
+
+                    if decode_pos > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos), str(data_len), self.template_name))
+                        return repeat_count, -1
+
+        return repeat_count, decode_pos
+
+    def project(self, var_names):
+        """ returns a copy of this block decoder that only reads the
+        variables in var_names. with None the whole block is skipped """
+
+        block = copy.copy(self)
+
+        if var_names == None:
+            block.skipped = True
+        else:
+            block.steps = [step.project(var_names) for step in self.steps]
+
+        return block
+
+    def decode(self, data, decode_pos, data_len, message, view = None, copy_values = False):
+        """ decodes the block repetitions at decode_pos into message,
+        returning the position after them, or -1 if the data is short
+
+        raw payloads are sliced from view instead of data when it is given.
+        with copy_values, data is a memoryview and the slices read from it
+        are copied out as str
+        """
+
+        repeat_count, decode_pos = self.repeat_count(data, decode_pos, data_len)
+        if repeat_count < 0:
+            return -1
+
+        name = self.name
+
+        for i in range(repeat_count):
+            block_data = MsgBlockData(name)
+            block_data.block_number = i
+            message.add_block(block_data)
+
+            for step in self.steps:
+
+                if step.__class__ is FixedRun:
+
+                    if decode_pos + step.size > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + step.size), str(data_len), self.template_name))
+                        return -1
+
+                    if not step.fields:
+                        decode_pos += step.size
+                        continue
+
+                    try:
+                        values = step.packer.unpack_from(data, decode_pos)
+                    except struct.error, error:
+                        raise exc.DataUnpackingError(data[decode_pos:decode_pos + step.size], error)
+
+                    for var_name, var_type, key, converter, offset, size in step.fields:
+                        if key == None:
+                            offset += decode_pos
+                            if view != None:
+                                value = view[offset:offset + size]
+                            elif copy_values:
+                                value = data[offset:offset + size].tobytes()
+                            else:
+                                value = data[offset:offset + size]
+                        else:
+                            value = values[key]
+                            if converter != None:
+                                value = converter(value)
+                        block_data.add_variable(MsgVariableData(var_name, value, var_type))
+
+                    decode_pos += step.size
+
+                else:
+
+                    if (decode_pos + step.prefix_size) > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + step.prefix_size), str(data_len), self.template_name))
+                        return -1
+
+                    var_size = step.prefix.unpack_from(data, decode_pos)[0]
+                    decode_pos += step.prefix_size
+
+                    if (decode_pos + var_size) > data_len:
+                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + var_size), str(data_len), self.template_name))
+                        return -1
+
+                    if step.skipped:
+                        decode_pos += var_size
+                        continue
+
+                    if view != None and not step.strip:
+                        value = view[decode_pos:decode_pos + var_size]
+                    else:
+                        value = data[decode_pos:decode_pos + var_size]
+                        if copy_values:
+                            value = value.tobytes()
+                        if step.strip:
+                            value = value.rstrip('\x00')
+
+                    block_data.add_variable(MsgVariableData(step.name, value, step.type))
+                    decode_pos += var_size
+
+        return decode_pos
+
+class TemplateDecoder(object):
+    """ a decoder specialized for a single MessageTemplate
+
+    The template's blocks and variables are walked once, when the decoder
+    is built, and adjacent fixed size variables are merged into precompiled
+    struct.Struct formats. Use TemplateDictionary.get_decoder() to get the
+    cached instance for a template.
+    """
+
+    def __init__(self, template):
+        self.name = template.name
+        self.blocks = [BlockDecoder(template.name, block) for block in template.blocks]
+
+        # projected copies of this decoder, by the fields they read
+        self.projections = {}
+        # the fields read by this decoder, None for all of them
+        self.fields = None
+
+        self.__compile_layout()
+
+    def __compile_layout(self):
+
+        # when every block has a fixed size and repeat count, the block
+        # offsets are known from the template alone
+        self.layout = []
+        self.size = 0
+        for block in self.blocks:
+            if block.size == None or block.block_type == MsgBlockType.MBT_VARIABLE:
+                self.layout = None
+                self.size = None
+                break
+            repeat_count = block.number
+            if block.block_type == MsgBlockType.MBT_SINGLE:
+                repeat_count = 1
+            self.layout.append((block, self.size, repeat_count))
+            self.size += repeat_count * block.size
+
+    def decode(self, data, decode_pos, message, data_len = None, views = False):
+        """ decodes the message body starting at decode_pos into the
+        blocks of message. returns False if the data was too short.
+
+        with views, MVT_FIXED and binary MVT_VARIABLE payloads are
+        memoryviews into data rather than copies. data can itself be a
+        memoryview of a reused receive buffer, the values are then copied
+        out of it one by one, so they outlive the buffer
+        """
+
+        if data_len == None:
+            data_len = len(data)
+
+        copy_values = isinstance(data, memoryview)
+
+        view = None
+        if views:
+            view = memoryview(data)
+
+        for block in self.blocks:
+            if block.skipped:
+                repeat_count, decode_pos = block.skip(data, decode_pos, data_len)
+            else:
+                decode_pos = block.decode(data, decode_pos, data_len, message, view, copy_values)
+            if decode_pos < 0:
+                return False
+
+        return True
+
+    def project(self, fields):
+        """ returns a decoder that only reads the given fields, each either
+        'Block.Variable' or 'Block' for every variable of a block. blocks
+        without requested fields are skipped entirely, and so are left out
+        of the decoded message. with None, returns this decoder.
+        """
+
+        if fields == None:
+            return self
+
+        fields = frozenset(fields)
+
+        try:
+            return self.projections[fields]
+        except KeyError:
+            pass
+
+        block_names = [block.name for block in self.blocks]
+
+        # block name -> the variables wanted, or None for all of them
+        wanted = {}
+        for field in fields:
+            block_name, sep, var_name = field.partition('.')
+            if block_name not in block_names:
+                logger.warning("Ignoring unknown field %s of %s" % (field, self.name))
+            elif not var_name:
+                wanted[block_name] = None
+            elif block_name not in wanted:
+                wanted[block_name] = set([var_name])
+            elif wanted[block_name] != None:
+                wanted[block_name].add(var_name)
+
+        decoder = copy.copy(self)
+        decoder.projections = {}
+        decoder.fields = fields
+        decoder.blocks = []
+
+        for block in self.blocks:
+            if block.name not in wanted:
+                decoder.blocks.append(block.project(None))
+            elif wanted[block.name] == None:
+                decoder.blocks.append(block)
+            else:
+                decoder.blocks.append(block.project(wanted[block.name]))
+
+        decoder.__compile_layout()
+
+        self.projections[fields] = decoder
+        return decoder
+
+    def scan(self, data, decode_pos, data_len = None):
+        """ locates the blocks of the message body starting at decode_pos
+        without decoding them. returns a list of (block decoder, position,
+        repeat count), or None if the data was too short. the position is
+        where BlockDecoder.decode expects to start.
+        """
+
+        if data_len == None:
+            data_len = len(data)
+
+        if self.layout != None:
+            if decode_pos + self.size > data_len:
+                logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + self.size), str(data_len), self.name))
+                return None
+            return [(block, decode_pos + offset, repeat_count) for block, offset, repeat_count in self.layout]
+
+        offsets = []
+
+        for block in self.blocks:
+            repeat_count, end = block.skip(data, decode_pos, data_len)
+            if end < 0:
+                return None
+            offsets.append((block, decode_pos, repeat_count))
+            decode_pos = end
+
+        return offsets
@@ -20,6 +20,8 @@ from msgtypes import MsgFrequency
 from data import msg_tmpl, msg_details
 from template_parser import MessageTemplateParser
 from data_packer import DataPacker
+from template_decoder import TemplateDecoder
+from template_encoder import TemplateEncoder
 from msgtypes import MsgType, EndianType
 
 from pyogp.lib.base import exc
@@ -37,7 +39,6 @@ class TemplateDictionary(object):
                 parser = MessageTemplateParser(message_template)
 
             template_list = parser.message_templates
-            template_dict = TemplateDictionary(template_list)
             # adding below so we can check how many packets we can parse easily len(self.template_list)
             self.template_list = template_list
 
@@ -47,6 +48,16 @@ class TemplateDictionary(object):
         # maps (freq,num) to template
         self.message_dict = {}
 
+        # maps the dense integer template_id to template
+        self.templates_by_id = []
+
+        # map the message number in a packet header to template, one table
+        # per frequency, so that headers are decoded by indexing
+        self.high_templates = [None] * 256
+        self.medium_templates = [None] * 256
+        self.low_templates = [None] * 65536
+        self.fixed_templates = [None] * 256
+
         self.build_dictionaries(template_list)
         self.build_message_ids()
 
@@ -74,6 +85,18 @@ class TemplateDictionary(object):
             self.message_dict[(frequency_str, \
                                template.msg_num)] = template
 
+            template.template_id = len(self.templates_by_id)
+            self.templates_by_id.append(template)
+
+            if template.frequency == MsgFrequency.FIXED_FREQUENCY_MESSAGE:
+                self.fixed_templates[template.msg_num] = template
+            elif template.frequency == MsgFrequency.LOW_FREQUENCY_MESSAGE:
+                self.low_templates[template.msg_num] = template
+            elif template.frequency == MsgFrequency.MEDIUM_FREQUENCY_MESSAGE:
+                self.medium_templates[template.msg_num] = template
+            elif template.frequency == MsgFrequency.HIGH_FREQUENCY_MESSAGE:
+                self.high_templates[template.msg_num] = template
+
     def build_message_ids(self):
         packer = DataPacker()
         for template in self.message_templates.values():
@@ -104,6 +127,76 @@ class TemplateDictionary(object):
 
         return None
 
+    def get_decoder(self, template):
+        """ returns the compiled TemplateDecoder for a template, building
+        and caching it on the template the first time it is needed """
+
+        if template.decoder == None:
+            template.decoder = TemplateDecoder(template)
+
+        return template.decoder
+
+    def get_encoder(self, template):
+        """ returns the compiled TemplateEncoder for a template, building
+        and caching it on the template the first time it is needed """
+
+        if template.encoder == None:
+            template.encoder = TemplateEncoder(template)
+
+        return template.encoder
+
+    def get_columnar_decoder(self, template):
+        """ returns the ColumnarDecoder for a template, building and
+        caching it on the template the first time it is needed. this
+        needs numpy """
+
+        if template.columnar_decoder == None:
+            # imported here, as numpy is only needed for ENABLE_COLUMNAR_BLOCKS
+            from columnar import ColumnarDecoder
+            template.columnar_decoder = ColumnarDecoder(template, self.get_decoder(template))
+
+        return template.columnar_decoder
+
+    def get_template_by_id(self, template_id):
+        if 0 <= template_id < len(self.templates_by_id):
+            return self.templates_by_id[template_id]
+
+        return None
+
+    def get_template_by_header(self, data, decode_pos = 0, data_len = None):
+        """ returns the template for the message number at decode_pos,
+        or None if it is unknown or cut short """
+
+        if data_len == None:
+            data_len = len(data)
+
+        if decode_pos >= data_len:
+            return None
+
+        byte = ord(data[decode_pos])
+        #if it is not a high
+        if byte != 0xFF:
+            return self.high_templates[byte]
+
+        if decode_pos + 1 >= data_len:
+            return None
+
+        byte = ord(data[decode_pos + 1])
+        #if it is not a medium frequency message
+        if byte != 0xFF:
+            return self.medium_templates[byte]
+
+        if decode_pos + 3 >= data_len:
+            return None
+
+        byte = ord(data[decode_pos + 2])
+        #if it is a Fixed frequency message
+        if byte == 0xFF:
+            return self.fixed_templates[ord(data[decode_pos + 3])]
+
+        #then it is low
+        return self.low_templates[(byte << 8) | ord(data[decode_pos + 3])]
+
     def get_template_by_pair(self, frequency, num):
         if (frequency, num) in self.message_dict:
             return self.message_dict[(frequency, num)]
@@ -114,3 +207,25 @@ class TemplateDictionary(object):
         return self.get_template(i)
 
 
+# the templates of the embedded message_template.msg, parsed once and shared
+_default_template_dict = None
+
+def get_template_dict(message_template = None):
+    """ returns the TemplateDictionary of a message_template.msg file
+    handle, or, if it is None, the one shared by everything using the
+    embedded message_template.msg
+
+    a TemplateDictionary only caches decoders on its templates after it is
+    built, so it can be shared by any number of serializers, deserializers
+    and circuits
+    """
+
+    global _default_template_dict
+
+    if message_template != None:
+        return TemplateDictionary(message_template = message_template)
+
+    if _default_template_dict == None:
+        _default_template_dict = TemplateDictionary()
+
+    return _default_template_dict
@@ -0,0 +1,322 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+import struct
+
+# pyogp
+from pyogp.lib.base.datatypes import UUID, Vector3, Quaternion
+from pyogp.lib.base.helpers import Helpers
+from pyogp.lib.base import exc
+
+# pyogp messaging
+from msgtypes import MsgType, MsgBlockType, EndianType
+
+def _from_uuid(value):
+    if isinstance(value, UUID):
+        return value.get_bytes()
+    return value.bytes
+
+def _from_vector3(value):
+    if isinstance(value, Vector3):
+        return value()
+    return value
+
+def _from_quaternion(value):
+    if isinstance(value, Quaternion):
+        value = value()
+    return Helpers.pack_quaternion_to_vector3(value)
+
+def _from_string(value):
+    """ strings are sent UTF-8 encoded and null terminated """
+    if value == None:
+        return '\x00'
+    elif isinstance(value, unicode):
+        return value.encode('utf-8') + '\x00'
+    return value + '\x00'
+
+# maps each fixed size type to (endian, struct code, converter, values)
+# endian is NONE for single byte and raw string types, which can be merged
+# into a run of either endianness. values is the number of struct values a
+# variable takes, the converter's result is spread over them when it is > 1
+# the resulting bytes match what DataPacker.pack_data returns
+FIXED_FORMATS = {
+    MsgType.MVT_S8:           (EndianType.NONE, 'b', None, 1),
+    MsgType.MVT_U8:           (EndianType.NONE, 'B', None, 1),
+    MsgType.MVT_BOOL:         (EndianType.NONE, 'B', None, 1),
+    MsgType.MVT_LLUUID:       (EndianType.NONE, '16s', _from_uuid, 1),
+    MsgType.MVT_IP_PORT:      (EndianType.BIG, 'H', None, 1),
+    MsgType.MVT_U16:          (EndianType.LITTLE, 'H', None, 1),
+    MsgType.MVT_U32:          (EndianType.LITTLE, 'I', None, 1),
+    MsgType.MVT_U64:          (EndianType.LITTLE, 'Q', None, 1),
+    MsgType.MVT_S16:          (EndianType.LITTLE, 'h', None, 1),
+    MsgType.MVT_S32:          (EndianType.LITTLE, 'i', None, 1),
+    MsgType.MVT_S64:          (EndianType.LITTLE, 'q', None, 1),
+    MsgType.MVT_F32:          (EndianType.LITTLE, 'f', None, 1),
+    MsgType.MVT_F64:          (EndianType.LITTLE, 'd', None, 1),
+    MsgType.MVT_LLVector3:    (EndianType.LITTLE, '3f', _from_vector3, 3),
+    MsgType.MVT_LLVector3d:   (EndianType.LITTLE, '3d', None, 3),
+    MsgType.MVT_LLVector4:    (EndianType.LITTLE, '4f', None, 4),
+    MsgType.MVT_LLQuaternion: (EndianType.LITTLE, '3f', _from_quaternion, 3),
+    }
+
+# types that are written as null terminated strings rather than packed
+STRING_TYPES = (MsgType.MVT_FIXED, MsgType.MVT_IP_ADDR)
+
+# the struct codes for the length prefix of MVT_VARIABLE data, by prefix size
+VARIABLE_SIZE_FORMATS = {1: struct.Struct('>B'),
+                         2: struct.Struct('<H'),
+                         4: struct.Struct('<I')}
+
+# the repeat count of a variable block
+BLOCK_COUNT = struct.Struct('>B')
+
+class FixedRun(object):
+    """ a run of adjacent fixed size variables written with one struct.Struct """
+
+    def __init__(self, endian):
+        self.endian = endian
+        self.codes = []
+        self.fields = []    # (name, converter, values)
+        self.packer = None
+        self.size = 0
+
+    def accepts(self, endian):
+        return endian == EndianType.NONE or \
+               self.endian == EndianType.NONE or \
+               endian == self.endian
+
+    def add(self, variable, endian, code, converter, values):
+        if self.endian == EndianType.NONE:
+            self.endian = endian
+
+        self.codes.append(code)
+        self.fields.append((variable.name, converter, values))
+
+    def compile(self):
+        endian = self.endian
+        if endian == EndianType.NONE:
+            endian = EndianType.LITTLE
+        self.packer = struct.Struct(endian + ''.join(self.codes))
+        self.size = self.packer.size
+
+    def values(self, variables):
+        """ returns the struct arguments for the run's variables in a block """
+
+        args = []
+        for name, converter, values in self.fields:
+            value = variables[name].data
+            if converter != None:
+                value = converter(value)
+            if values == 1:
+                args.append(value)
+            else:
+                args.extend(value)
+
+        return args
+
+class StringField(object):
+    """ a variable written as a null terminated string, MVT_VARIABLE data
+    is prefixed with its length """
+
+    def __init__(self, variable):
+        self.name = variable.name
+        self.prefix = None
+
+        if variable.type == MsgType.MVT_VARIABLE:
+            if variable.size not in VARIABLE_SIZE_FORMATS:
+                raise exc.MessageSerializationError("variable size", "unrecognized variable size")
+            self.prefix = VARIABLE_SIZE_FORMATS[variable.size]
+
+class BlockEncoder(object):
+    """ encodes every repetition of one block of a template """
+
+    def __init__(self, template_name, template_block):
+        self.template_name = template_name
+        self.name = template_block.name
+        self.block_type = template_block.block_type
+        self.number = template_block.number
+        self.steps = []
+
+        if self.block_type not in (MsgBlockType.MBT_SINGLE, MsgBlockType.MBT_MULTIPLE, MsgBlockType.MBT_VARIABLE):
+            raise exc.MessageSerializationError(self.name, "unknown block type")
+
+        run = None
+
+        for variable in template_block.variables:
+
+            if variable.type == MsgType.MVT_VARIABLE or variable.type in STRING_TYPES:
+
+                run = None
+                self.steps.append(StringField(variable))
+
+            elif variable.type in FIXED_FORMATS:
+
+                endian, code, converter, values = FIXED_FORMATS[variable.type]
+
+                if run == None or not run.accepts(endian):
+                    run = FixedRun(endian)
+                    self.steps.append(run)
+
+                run.add(variable, endian, code, converter, values)
+
+            else:
+                raise exc.MessageSerializationError(variable.name, "unknown variable type")
+
+        for step in self.steps:
+            if isinstance(step, FixedRun):
+                step.compile()
+
+    def get_blocks(self, message):
+        """ returns the repetitions of this block in message """
+
+        #the MsgData blocks is a list of lists
+        #each block in the list is a block_list because you can have more than
+        #one block for any given name
+        block_list = message.get_block(self.name)
+
+        #multiple block type means there is a static number of these blocks
+        #that make up this message, with the number stored in the template
+        if self.block_type == MsgBlockType.MBT_MULTIPLE:
+            if self.number != len(block_list):
+                raise exc.MessageSerializationError(self.name, "block data mismatch")
+
+        return block_list
+
+    def encode(self, message, pieces):
+        """ appends the encoded repetitions of this block in message to
+        pieces """
+
+        block_list = self.get_blocks(message)
+
+        #variable means the block variables can repeat, so we have to
+        #mark how many blocks there are of this type that repeat
+        if self.block_type == MsgBlockType.MBT_VARIABLE:
+            pieces.append(BLOCK_COUNT.pack(len(block_list)))
+
+        append = pieces.append
+
+        for block in block_list:
+
+            variables = block.vars
+
+            for step in self.steps:
+
+                if step.__class__ is FixedRun:
+
+                    append(step.packer.pack(*step.values(variables)))
+
+                else:
+
+                    data = _from_string(variables[step.name].data)
+
+                    if step.prefix != None:
+                        append(step.prefix.pack(len(data)))
+
+                    append(data)
+
+    def encode_into(self, message, buffer, pos):
+        """ writes the encoded repetitions of this block in message into
+        buffer at pos, returning the position after them """
+
+        block_list = self.get_blocks(message)
+        end = len(buffer)
+
+        if self.block_type == MsgBlockType.MBT_VARIABLE:
+            if pos + 1 > end:
+                raise exc.MessageSerializationError(self.name, "packet does not fit in the buffer")
+            BLOCK_COUNT.pack_into(buffer, pos, len(block_list))
+            pos += 1
+
+        for block in block_list:
+
+            variables = block.vars
+
+            for step in self.steps:
+
+                if step.__class__ is FixedRun:
+
+                    if pos + step.size > end:
+                        raise exc.MessageSerializationError(self.name, "packet does not fit in the buffer")
+
+                    step.packer.pack_into(buffer, pos, *step.values(variables))
+                    pos += step.size
+
+                else:
+
+                    data = _from_string(variables[step.name].data)
+                    size = len(data)
+
+                    if step.prefix != None:
+                        if pos + step.prefix.size + size > end:
+                            raise exc.MessageSerializationError(self.name, "packet does not fit in the buffer")
+                        step.prefix.pack_into(buffer, pos, size)
+                        pos += step.prefix.size
+
+                    elif pos + size > end:
+                        raise exc.MessageSerializationError(self.name, "packet does not fit in the buffer")
+
+                    buffer[pos:pos + size] = data
+                    pos += size
+
+        return pos
+
+class TemplateEncoder(object):
+    """ an encoder specialized for a single MessageTemplate
+
+    The template's blocks and variables are walked and validated once, when
+    the encoder is built, and adjacent fixed size variables are merged into
+    precompiled struct.Struct formats. Use TemplateDictionary.get_encoder()
+    to get the cached instance for a template.
+    """
+
+    def __init__(self, template):
+        self.name = template.name
+        self.msg_num_hex = template.msg_num_hex
+        self.blocks = [BlockEncoder(template.name, block) for block in template.blocks]
+
+    def encode(self, message, pieces = None):
+        """ appends the message number and the encoded blocks of message to
+        pieces, returning pieces """
+
+        if pieces == None:
+            pieces = []
+
+        pieces.append(self.msg_num_hex)
+
+        for block in self.blocks:
+            block.encode(message, pieces)
+
+        return pieces
+
+    def encode_into(self, message, buffer, pos = 0):
+        """ writes the message number and the encoded blocks of message
+        into the bytearray buffer at pos, returning the position after
+        them. raises MessageSerializationError if they don't fit """
+
+        size = len(self.msg_num_hex)
+        if pos + size > len(buffer):
+            raise exc.MessageSerializationError(self.name, "packet does not fit in the buffer")
+
+        buffer[pos:pos + size] = self.msg_num_hex
+        pos += size
+
+        for block in self.blocks:
+            pos = block.encode_into(message, buffer, pos)
+
+        return pos
@@ -136,7 +136,7 @@ class MessageTemplateParser(object):
             msg_num_hex = binTemp
             msg_num = struct.unpack('>h', '\x00' + binTemp[3])[0]
         elif frequency == MsgFrequency.LOW_FREQUENCY_MESSAGE:
-            msg_num_hex = struct.pack('>BBB', 0xff, 0xff, msg_num)
+            msg_num_hex = struct.pack('>BBH', 0xff, 0xff, msg_num)
         elif frequency == MsgFrequency.MEDIUM_FREQUENCY_MESSAGE:
             msg_num_hex = struct.pack('>BB', 0xff, msg_num)
         elif frequency == MsgFrequency.HIGH_FREQUENCY_MESSAGE:
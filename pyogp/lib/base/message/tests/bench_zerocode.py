@@ -0,0 +1,105 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+"""
+Benchmarks zerocode.zero_code_expand against the character by character
+expansion UDPMessageDeserializer used to do.
+
+    python -m pyogp.lib.base.message.tests.bench_zerocode
+"""
+
+#standard libraries
+import random
+import timeit
+
+#local libraries
+from pyogp.lib.base.message.zerocode import zero_code_expand, zero_code_compress
+
+# (name, chance a run is zeros, mean zero run, mean literal run, body size)
+PROFILES = [
+    # ObjectUpdate: padded floats, null uuids and flags, lots of short runs
+    ('ObjectUpdate', 0.5, 4, 5, 1100),
+    # ImageData: compressed texture data, zeros are rare
+    ('ImageData', 0.05, 1, 40, 1100),
+    # LayerData / idle state updates, mostly long zero runs
+    ('sparse', 0.7, 40, 3, 1100),
+    # a small, typical message
+    ('small', 0.5, 3, 6, 60),
+    ]
+
+def legacy_zero_code_expand(msg_buf):
+    """ the original, quadratic expansion, kept here for comparison """
+
+    newstring = ""
+    in_zero = False
+    for c in msg_buf:
+        if c != '\0':
+            if in_zero == True:
+                zero_count = ord(c)
+                zero_count = zero_count -1
+                while zero_count>0:
+                    newstring = newstring + '\x00'
+                    zero_count = zero_count -1
+                in_zero = False
+            else:
+                newstring = newstring + c
+        else:
+            newstring = newstring + c
+            in_zero = True
+    return newstring
+
+def make_body(rand, size, zero_chance = 0.5, zero_run = 4, literal_run = 5):
+    """ builds a message body of size bytes made of alternating runs of
+    zeros and non zero bytes with geometrically distributed lengths """
+
+    pieces = []
+    length = 0
+
+    while length < size:
+        if rand.random() < zero_chance:
+            run = int(rand.expovariate(1.0 / zero_run)) + 1
+            pieces.append('\x00' * run)
+        else:
+            run = int(rand.expovariate(1.0 / literal_run)) + 1
+            pieces.append(''.join([chr(rand.randint(1, 255)) for i in range(run)]))
+        length += run
+
+    return ''.join(pieces)[:size]
+
+def main(number = 200):
+
+    rand = random.Random(0)
+
+    print "%-14s %8s %8s %12s %12s %8s %12s" % ('profile', 'size', 'coded', 'legacy (us)', 'expand (us)', 'speedup', 'compress (us)')
+
+    for name, zero_chance, zero_run, literal_run, size in PROFILES:
+
+        body = make_body(rand, size, zero_chance, zero_run, literal_run)
+        coded = zero_code_compress(body)
+
+        assert zero_code_expand(coded) == body
+        assert legacy_zero_code_expand(coded) == body
+
+        legacy = min(timeit.repeat(lambda: legacy_zero_code_expand(coded), number = number, repeat = 3)) / number
+        expand = min(timeit.repeat(lambda: zero_code_expand(coded), number = number, repeat = 3)) / number
+        compress = min(timeit.repeat(lambda: zero_code_compress(body), number = number, repeat = 3)) / number
+
+        print "%-14s %8d %8d %12.1f %12.1f %7.1fx %12.1f" % (name, len(body), len(coded), legacy * 1e6, expand * 1e6, legacy / expand, compress * 1e6)
+
+if __name__ == '__main__':
+    main()
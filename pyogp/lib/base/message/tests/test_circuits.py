@@ -22,6 +22,7 @@ import pprint
 
 #local libraries
 from pyogp.lib.base.message.circuit import CircuitManager, Circuit, Host
+from pyogp.lib.base.message.msgtypes import PackFlags
 from pyogp.lib.base.message.message import Message, Block
 from pyogp.lib.base.message.message import Message
 
@@ -68,6 +69,75 @@ class TestCircuit(unittest.TestCase):
                str(len(circuit.unacked_packets))
         assert len(circuit.final_retry_packets) == 0, "Has incorrect final unacked"
 
+    def test_track_packet_in(self):
+        circuit = Circuit(self.host, -1)
+
+        assert not circuit.track_packet_in(1)
+        assert not circuit.track_packet_in(2)
+        assert not circuit.track_packet_in(4)
+        assert circuit.last_packet_in_id == 4
+
+        # 3 arrives late, then everything is resent
+        assert not circuit.track_packet_in(3)
+        assert circuit.reordered_in == 1
+        for packet_id in (1, 2, 3, 4):
+            assert circuit.track_packet_in(packet_id), "Duplicate %s not caught" % (packet_id)
+        assert circuit.duplicates_in == 4
+
+        # a jump past the window forgets what came before it
+        assert not circuit.track_packet_in(5000)
+        assert not circuit.track_packet_in(4)
+        assert circuit.track_packet_in(5000)
+        assert circuit.duplicates_in == 5
+
+    def test_piggybacked_acks(self):
+        circuit = Circuit(self.host, 1)
+        for packet_id in range(300):
+            circuit.collect_ack(packet_id)
+
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        circuit.prepare_packet(msg)
+        assert msg.acks == range(255), "Acks not offered up to the count byte"
+        assert not msg.send_flags & PackFlags.LL_ACK_FLAG
+
+        circuit.acks_sent(msg.acks[:10])
+        assert circuit.acks == range(10, 300)
+
+        # acks aren't appended to PacketAcks
+        msg = Message('PacketAck', Block('Packets', ID=1))
+        circuit.prepare_packet(msg)
+        assert msg.acks == []
+
+    def test_rtt(self):
+        now = [10.0]
+        circuit = Circuit(self.host, 1, clock = lambda: now[0])
+        assert circuit.rto == 1.0
+
+        circuit.update_rtt(0.5)
+        assert circuit.srtt == 0.5
+        assert circuit.rttvar == 0.25
+        assert circuit.rto == 1.5
+
+        circuit.update_rtt(1.5)
+        assert circuit.rttvar == 0.75 * 0.25 + 0.25 * 1.0
+        assert circuit.srtt == 0.875 * 0.5 + 0.125 * 1.5
+        assert circuit.rto == circuit.srtt + 4 * circuit.rttvar
+
+        circuit.back_off()
+        assert circuit.rto == 2 * (circuit.srtt + 4 * circuit.rttvar)
+        for i in range(10):
+            circuit.back_off()
+        assert circuit.rto == 60.0
+
+        # acks time the round trip from when a packet was first sent
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        circuit.prepare_packet(msg, PackFlags.LL_RELIABLE_FLAG)
+        msg.sent_time = 9.75
+        assert circuit.ack_reliable_packet(msg.packet_id)
+        assert circuit.rtt_samples == 3
+        # a new sample replaces the backed off timeout
+        assert circuit.rto == circuit.srtt + 4 * circuit.rttvar
+
 class TestCircuitManager(unittest.TestCase):
 
     def tearDown(self):
@@ -94,6 +164,34 @@ class TestCircuitManager(unittest.TestCase):
         assert manager.is_circuit_alive(host) == True, \
                "Incorrect circuit alive state 2"
 
+    def test_stats(self):
+        manager = CircuitManager()
+        circuit = manager.add_circuit(self.host, 1)
+        other = manager.add_circuit(Host((0x00000011, 80)), 10)
+
+        circuit.packets_in += 3
+        other.packets_in += 2
+        circuit.update_rtt(0.25)
+        circuit.update_rtt(0.0625)
+        other.update_rtt(10.0)
+
+        stats = manager.get_stats()
+        assert stats[(0x00000001, 80)]['packets_in'] == 3
+        assert stats[(0x00000001, 80)]['srtt'] == circuit.srtt
+        rtt = stats[(0x00000001, 80)]['rtt']
+        assert rtt['count'] == 2
+        assert rtt['counts'][2] == 0 and rtt['counts'][4] == 1 and rtt['counts'][5] == 1
+        assert rtt['min'] == 0.0625 and rtt['max'] == 0.25
+        assert stats[(0x00000001, 80)]['jitter']['mean'] == 0.1875
+
+        total = manager.get_total_stats()
+        assert total['circuits'] == 2
+        assert total['packets_in'] == 5
+        assert total['rtt']['count'] == 3
+        assert total['rtt']['counts'][-1] == 1
+        assert total['rtt']['max'] == 10.0
+        assert total['jitter']['count'] == 1
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
@@ -0,0 +1,108 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+#standard libraries
+import unittest
+import struct
+
+#related
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#local libraries
+from pyogp.lib.base.settings import Settings
+from pyogp.lib.base.exc import MessageDeserializationError
+from pyogp.lib.base.message.message import Message
+from pyogp.lib.base.message.template_dict import TemplateDictionary
+from pyogp.lib.base.message.udpdeserializer import UDPMessageDeserializer
+from pyogp.lib.base.message.tests.test_packetdata import OBJECT_UPDATE
+
+class TestColumnar(unittest.TestCase):
+
+    def tearDown(self):
+        pass
+
+    def setUp(self):
+        self.template_dict = TemplateDictionary()
+
+        self.settings = Settings()
+        self.settings.ENABLE_DEFERRED_PACKET_PARSING = False
+        self.settings.ENABLE_COLUMNAR_BLOCKS = True
+
+    def test_dtype(self):
+        decoder = self.template_dict.get_columnar_decoder(self.template_dict['CoarseLocationUpdate'])
+        assert self.template_dict.get_columnar_decoder(self.template_dict['CoarseLocationUpdate']) is decoder
+
+        location = decoder.block_map['Location']
+        assert location.dtype.names == ('X', 'Y', 'Z')
+        assert location.dtype.itemsize == 3
+        assert location.packed
+
+        decoder = self.template_dict.get_columnar_decoder(self.template_dict['ObjectUpdate'])
+        object_data = decoder.block_map['ObjectData']
+        assert not object_data.packed
+        assert object_data.dtype['TextureEntry'] == numpy.dtype(object)
+        assert object_data.dtype['FullID'].itemsize == 16
+
+    def test_decode(self):
+        decoder = self.template_dict.get_columnar_decoder(self.template_dict['CoarseLocationUpdate'])
+        body = '\x03' + '\x01\x02\x03' + '\x04\x05\x06' + '\x07\x08\x09' + \
+               struct.pack('<hh', 1, -1) + \
+               '\x02' + 'a' * 16 + 'b' * 16
+
+        arrays = decoder.decode(body, 0)
+        location = arrays['Location']
+        assert location['X'].tolist() == [1, 4, 7]
+        assert (location['Z'] * 4).tolist() == [12, 24, 36]
+        assert arrays['Index']['Prey'][0] == -1
+        assert arrays['AgentData']['AgentID'][1].tostring() == 'b' * 16
+
+        assert decoder.decode(body[:-1], 0) == None
+
+    def test_get_columns(self):
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+
+        columns = packet.get_columns('ObjectData')
+        assert columns['PCode'].tolist() == [9]
+        assert len(columns['ObjectData'][0]) == 48
+
+        # the blocks can still be looked up as usual
+        object_data = packet.blocks['ObjectData'][0]
+        assert object_data['PCode'] == 9
+        assert object_data['FullID'].uuid.bytes == columns['FullID'][0].tostring()
+        assert packet.get_columns('RegionData')['TimeDilation'][0] == 65470
+
+    def test_get_columns_disabled(self):
+        self.settings.ENABLE_COLUMNAR_BLOCKS = False
+        self.settings.ENABLE_LAZY_PACKET_DECODING = True
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+
+        self.assertRaises(MessageDeserializationError, packet.get_columns, 'ObjectData')
+
+if numpy == None:
+    TestColumnar = unittest.skip("numpy is not available")(TestColumnar)
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestColumnar))
+    return suite
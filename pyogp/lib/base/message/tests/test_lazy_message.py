@@ -0,0 +1,108 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+#standard libraries
+import unittest
+
+#local libraries
+from pyogp.lib.base.settings import Settings
+from pyogp.lib.base.message.message import Message, LazyMessage
+from pyogp.lib.base.message.template_dict import TemplateDictionary
+from pyogp.lib.base.message.udpdeserializer import UDPMessageDeserializer
+from pyogp.lib.base.message.tests.test_packetdata import AGENT_DATA_UPDATE, OBJECT_UPDATE
+
+class TestLazyMessage(unittest.TestCase):
+
+    def tearDown(self):
+        pass
+
+    def setUp(self):
+        self.template_dict = TemplateDictionary()
+
+        self.settings = Settings()
+        self.settings.ENABLE_DEFERRED_PACKET_PARSING = False
+        self.settings.ENABLE_LAZY_PACKET_DECODING = True
+
+    def test_static_layout(self):
+        decoder = self.template_dict.get_decoder(self.template_dict['AgentAnimation'])
+        assert decoder.layout == None, "AgentAnimation has variable blocks"
+
+        decoder = self.template_dict.get_decoder(self.template_dict['EnableSimulator'])
+        assert decoder.size == 14
+
+        offsets = decoder.scan('x' * 20, 6)
+        assert [(block.name, pos, count) for block, pos, count in offsets] == [('SimulatorInfo', 6, 1)]
+        assert decoder.scan('x' * 19, 6) == None
+
+    def test_deserialize(self):
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+        assert isinstance(packet, LazyMessage)
+        assert packet.blocks.keys() == ['RegionData', 'ObjectData']
+        assert not packet.blocks.is_decoded('ObjectData')
+
+        assert packet['RegionData'][0]['TimeDilation'] == 65470
+        assert packet.blocks.is_decoded('RegionData')
+        assert not packet.blocks.is_decoded('ObjectData')
+
+        assert packet.blocks['ObjectData'][0]['PCode'] == 9
+        assert packet.blocks.data == None, "Buffer kept after every block was decoded"
+
+    def test_matches_eager(self):
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        lazy = deserializer.deserialize(AGENT_DATA_UPDATE)
+
+        self.settings.ENABLE_LAZY_PACKET_DECODING = False
+        eager = deserializer.deserialize(AGENT_DATA_UPDATE)
+
+        assert not isinstance(eager, LazyMessage)
+        assert 'AgentData' in lazy.blocks
+        assert len(lazy.blocks) == len(eager.blocks)
+        assert lazy.to_dict() == eager.to_dict()
+
+    def test_empty_variable_block(self):
+        # a variable block with no repetitions is left out, as it is
+        # when the whole message is decoded up front
+        template = self.template_dict['ImprovedTerseObjectUpdate']
+        decoder = self.template_dict.get_decoder(template)
+        body = '\x00' * 10 + '\x00'
+
+        eager = Message('ImprovedTerseObjectUpdate')
+        assert decoder.decode(body, 0, eager)
+
+        lazy = LazyMessage('ImprovedTerseObjectUpdate', body, len(body), decoder.scan(body, 0))
+        assert sorted(lazy.blocks.keys()) == sorted(eager.blocks.keys())
+        self.assertRaises(KeyError, lazy.get_block, 'ObjectData')
+
+    def test_add_block(self):
+        decoder = self.template_dict.get_decoder(self.template_dict['EnableSimulator'])
+        body = 'x' * 14
+
+        packet = LazyMessage('EnableSimulator', body, len(body), decoder.scan(body, 0))
+        eager = Message('EnableSimulator')
+        decoder.decode(body, 0, eager)
+        packet.add_block(eager['SimulatorInfo'][0])
+
+        assert len(packet['SimulatorInfo']) == 2
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestLazyMessage))
+    return suite
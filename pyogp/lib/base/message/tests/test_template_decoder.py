@@ -0,0 +1,231 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+#standard libraries
+import unittest
+import struct
+
+#local libraries
+from pyogp.lib.base.settings import Settings
+from pyogp.lib.base.exc import DataUnpackingError
+from pyogp.lib.base.message.msgtypes import MsgType
+from pyogp.lib.base.message.message import Message
+from pyogp.lib.base.message.message_handler import MessageHandler
+from pyogp.lib.base.message.template_dict import TemplateDictionary
+from pyogp.lib.base.message.template_decoder import TemplateDecoder, FixedRun, VariableField
+from pyogp.lib.base.message.data_unpacker import DataUnpacker
+from pyogp.lib.base.message.udpdeserializer import UDPMessageDeserializer
+from pyogp.lib.base.message.tests.test_packetdata import AGENT_DATA_UPDATE, OBJECT_UPDATE
+
+class TestTemplateDecoder(unittest.TestCase):
+
+    def tearDown(self):
+        pass
+
+    def setUp(self):
+        self.template_dict = TemplateDictionary()
+
+        self.settings = Settings()
+        self.settings.ENABLE_DEFERRED_PACKET_PARSING = False
+
+    def test_decoder_is_cached(self):
+        template = self.template_dict['ObjectUpdate']
+        decoder = self.template_dict.get_decoder(template)
+
+        assert isinstance(decoder, TemplateDecoder)
+        assert self.template_dict.get_decoder(template) is decoder, "Decoder was rebuilt"
+        assert template.decoder is decoder, "Decoder not cached on the template"
+
+    def test_fixed_runs_merged(self):
+        decoder = self.template_dict.get_decoder(self.template_dict['AgentAnimation'])
+
+        agent_data = decoder.blocks[0]
+        assert len(agent_data.steps) == 1, "Fixed size variables were not merged"
+        assert agent_data.steps[0].size == 32
+
+    def test_runs_split_on_endian(self):
+        decoder = self.template_dict.get_decoder(self.template_dict['EnableSimulator'])
+
+        steps = decoder.blocks[0].steps
+        assert len(steps) == 2, "IPPORT is big endian and needs its own run"
+        assert steps[0].packer.format == '<Q4s'
+        assert steps[1].packer.format == '>H'
+
+    def test_variable_fields(self):
+        decoder = self.template_dict.get_decoder(self.template_dict['AgentDataUpdate'])
+
+        kinds = [step.__class__ for step in decoder.blocks[0].steps]
+        assert kinds == [FixedRun, VariableField, VariableField, VariableField, FixedRun, VariableField], kinds
+
+    def test_decode_matches_unpacker(self):
+        template = self.template_dict['EnableSimulator']
+        body = struct.pack('<Q', 1099511628032000) + '\x7f\x00\x00\x01' + struct.pack('>H', 13000)
+
+        packet = Message('EnableSimulator')
+        assert self.template_dict.get_decoder(template).decode(body, 0, packet)
+
+        unpacker = DataUnpacker()
+        block = packet.blocks['SimulatorInfo'][0]
+        assert block['Handle'] == unpacker.unpack_data(body, MsgType.MVT_U64, 0)
+        assert block['IP'] == unpacker.unpack_data(body, MsgType.MVT_IP_ADDR, 8)
+        assert block['Port'] == 13000
+        assert block.var_list == ['Handle', 'IP', 'Port']
+
+    def test_short_data(self):
+        template = self.template_dict['EnableSimulator']
+        packet = Message('EnableSimulator')
+
+        assert not self.template_dict.get_decoder(template).decode('\x00' * 10, 0, packet)
+
+    def test_deserialize(self):
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+
+        packet = deserializer.deserialize(AGENT_DATA_UPDATE)
+        agent_data = packet.blocks['AgentData'][0]
+        assert agent_data['FirstName'] == 'JB'
+        assert str(agent_data['AgentID']) == '1c8a7767-e37b-422e-afb3-85093197cad1'
+        assert agent_data['GroupPowers'] == 0
+
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+        object_data = packet.blocks['ObjectData'][0]
+        assert packet.blocks['RegionData'][0]['TimeDilation'] == 65470
+        assert object_data['PCode'] == 9
+        assert len(object_data['ObjectData']) == 48
+
+    def test_views(self):
+        # binary 'Data' payloads come back as memoryviews
+        template = self.template_dict['ImageData']
+        body = '\x00' * 16 + '\x02' + struct.pack('<IH', 5, 1) + struct.pack('<H', 4) + 'abcd'
+        packet = Message('ImageData')
+        assert self.template_dict.get_decoder(template).decode(body, 0, packet, views = True)
+        data = packet.blocks['ImageData'][0]['Data']
+        assert isinstance(data, memoryview)
+        assert data.tobytes() == 'abcd'
+
+        packet = Message('ImageData')
+        assert self.template_dict.get_decoder(template).decode(body, 0, packet)
+        assert packet.blocks['ImageData'][0]['Data'] == 'abcd'
+
+    def test_deserialize_views(self):
+        self.settings.ENABLE_ZERO_COPY_PAYLOADS = True
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+        object_data = packet.blocks['ObjectData'][0]
+        assert isinstance(object_data['Data'], memoryview)
+        # text variables are still stripped strings
+        assert object_data['Text'] == ''
+
+    def test_projection(self):
+        decoder = self.template_dict.get_decoder(self.template_dict['EnableSimulator'])
+        body = struct.pack('<Q', 1099511628032000) + '\x7f\x00\x00\x01' + struct.pack('>H', 13000)
+
+        projected = decoder.project(['SimulatorInfo.Port'])
+        assert decoder.project(['SimulatorInfo.Port']) is projected, "Projection was rebuilt"
+        assert decoder.project(None) is decoder
+
+        packet = Message('EnableSimulator')
+        assert projected.decode(body, 0, packet)
+        block = packet.blocks['SimulatorInfo'][0]
+        assert block.var_list == ['Port']
+        assert block['Port'] == 13000
+
+        # the whole block
+        packet = Message('EnableSimulator')
+        assert decoder.project(['SimulatorInfo']).decode(body, 0, packet)
+        assert packet.blocks['SimulatorInfo'][0].var_list == ['Handle', 'IP', 'Port']
+
+    def test_projection_skips_blocks(self):
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        deserializer.message_handler.register('ObjectUpdate', ['ObjectData.FullID', 'ObjectData.ObjectData'])
+
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+        assert packet.blocks.keys() == ['ObjectData']
+        object_data = packet.blocks['ObjectData'][0]
+        assert object_data.var_list == ['FullID', 'ObjectData']
+        assert len(object_data['ObjectData']) == 48
+
+        # registering without fields gets the whole message back
+        deserializer.message_handler.register('ObjectUpdate')
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+        assert packet.blocks['RegionData'][0]['TimeDilation'] == 65470
+        assert packet.blocks['ObjectData'][0]['PCode'] == 9
+
+    def test_registered_fields(self):
+        handler = MessageHandler()
+        assert handler.get_fields('ObjectUpdate') == None
+
+        handler.register('ObjectUpdate', ['ObjectData.FullID'])
+        handler.register('ObjectUpdate', ['ObjectData.ObjectData'])
+        assert handler.get_fields('ObjectUpdate') == frozenset(['ObjectData.FullID', 'ObjectData.ObjectData'])
+
+        handler.register('ObjectUpdate')
+        handler.register('ObjectUpdate', ['RegionData'])
+        assert handler.get_fields('ObjectUpdate') == None
+
+    def test_dispatch_by_id(self):
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        handler = deserializer.message_handler
+
+        received = []
+        handler.register('ObjectUpdate').subscribe(received.append)
+        template = self.template_dict['ObjectUpdate']
+        assert handler.get_handler_by_id(template.template_id) is handler.handlers['ObjectUpdate']
+
+        packet = deserializer.deserialize(OBJECT_UPDATE)
+        assert packet.template_id == template.template_id
+        handler.handle(packet)
+        assert received == [packet]
+
+        # messages built by name still dispatch by name
+        handler.handle(Message('ObjectUpdate'))
+        assert len(received) == 2
+
+class TestDataUnpacker(unittest.TestCase):
+
+    def setUp(self):
+        self.unpacker = DataUnpacker()
+
+    def test_unpack_data_from(self):
+        data = 'xx' + struct.pack('<I', 7) + struct.pack('>H', 13000) + struct.pack('<3f', 1.0, 2.0, 3.0)
+
+        assert self.unpacker.unpack_data_from(data, MsgType.MVT_U32, 2) == 7
+        assert self.unpacker.unpack_data_from(data, MsgType.MVT_IP_PORT, 6) == 13000
+        vector = self.unpacker.unpack_data_from(data, MsgType.MVT_LLVector3, 8)
+        assert vector() == (1.0, 2.0, 3.0)
+        assert self.unpacker.unpack_data_from(data, MsgType.MVT_U32, 1, endian_type='>') == \
+               self.unpacker.unpack_data(data, MsgType.MVT_U32, 1, endian_type='>')
+
+    def test_unpack_data_from_views(self):
+        data = 'xxabcdyy'
+
+        assert self.unpacker.unpack_data_from(data, MsgType.MVT_FIXED, 2, var_size=4) == 'abcd'
+        view = self.unpacker.unpack_data_from(data, MsgType.MVT_FIXED, 2, var_size=4, as_view=True)
+        assert isinstance(view, memoryview)
+        assert view.tobytes() == 'abcd'
+
+    def test_unpack_data_from_short(self):
+        self.assertRaises(DataUnpackingError, self.unpacker.unpack_data_from, 'xx', MsgType.MVT_U32, 0)
+        self.assertRaises(DataUnpackingError, self.unpacker.unpack_data_from, 'xx', MsgType.MVT_FIXED, 0, 4)
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestTemplateDecoder))
+    suite.addTest(makeSuite(TestDataUnpacker))
+    return suite
@@ -0,0 +1,224 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+#standard libraries
+import unittest
+import random
+import uuid
+
+#local libraries
+from pyogp.lib.base.datatypes import UUID, Vector3, Quaternion
+from pyogp.lib.base.exc import MessageSerializationError
+from pyogp.lib.base.message.msgtypes import MsgType, MsgBlockType
+from pyogp.lib.base.message.message import Message, Block
+from pyogp.lib.base.message.template import MessageTemplate, MessageTemplateBlock, MessageTemplateVariable
+from pyogp.lib.base.message.template_dict import TemplateDictionary
+from pyogp.lib.base.message.template_encoder import TemplateEncoder, FixedRun, StringField
+from pyogp.lib.base.message.udpserializer import UDPMessageSerializer
+
+def random_value(rand, variable):
+    """ returns a random value for a template variable """
+
+    tp = variable.type
+
+    if tp in (MsgType.MVT_U8, MsgType.MVT_BOOL):
+        return rand.randint(0, 255)
+    elif tp == MsgType.MVT_S8:
+        return rand.randint(-128, 127)
+    elif tp in (MsgType.MVT_U16, MsgType.MVT_IP_PORT):
+        return rand.randint(0, 65535)
+    elif tp == MsgType.MVT_S16:
+        return rand.randint(-32768, 32767)
+    elif tp == MsgType.MVT_U32:
+        return rand.randint(0, 2 ** 32 - 1)
+    elif tp == MsgType.MVT_S32:
+        return rand.randint(-2 ** 31, 2 ** 31 - 1)
+    elif tp == MsgType.MVT_U64:
+        return rand.randint(0, 2 ** 64 - 1)
+    elif tp == MsgType.MVT_S64:
+        return rand.randint(-2 ** 63, 2 ** 63 - 1)
+    elif tp in (MsgType.MVT_F32, MsgType.MVT_F64):
+        return rand.uniform(-1000, 1000)
+    elif tp == MsgType.MVT_LLUUID:
+        if rand.random() < 0.5:
+            return UUID(str(uuid.UUID(int = rand.getrandbits(128))))
+        return uuid.UUID(int = rand.getrandbits(128))
+    elif tp == MsgType.MVT_LLVector3:
+        if rand.random() < 0.5:
+            return Vector3(X = 1.5, Y = -2.0, Z = 3.25)
+        return (rand.uniform(-1, 1), rand.uniform(-1, 1), rand.uniform(-1, 1))
+    elif tp == MsgType.MVT_LLVector3d:
+        return (rand.uniform(-1, 1), rand.uniform(-1, 1), rand.uniform(-1, 1))
+    elif tp == MsgType.MVT_LLVector4:
+        return (rand.uniform(-1, 1), rand.uniform(-1, 1), rand.uniform(-1, 1), rand.uniform(-1, 1))
+    elif tp == MsgType.MVT_LLQuaternion:
+        if rand.random() < 0.5:
+            return Quaternion(X = 0.5, Y = 0.5, Z = 0.5, W = -0.5)
+        return (rand.uniform(-1, 1), rand.uniform(-1, 1), rand.uniform(-1, 1), rand.uniform(-1, 1))
+    elif tp == MsgType.MVT_IP_ADDR:
+        return ''.join([chr(rand.randint(0, 255)) for i in range(3)])
+    elif tp == MsgType.MVT_FIXED:
+        return ''.join([chr(rand.randint(0, 255)) for i in range(variable.size - 1)])
+    elif tp == MsgType.MVT_VARIABLE:
+        choice = rand.random()
+        if choice < 0.2:
+            return None
+        elif choice < 0.4:
+            return u'caf\xe9'
+        return ''.join([chr(rand.randint(1, 255)) for i in range(rand.randint(0, 20))])
+
+def random_message(rand, template):
+    """ builds a Message for template with random data """
+
+    blocks = []
+    for template_block in template.blocks:
+
+        if template_block.block_type == MsgBlockType.MBT_SINGLE:
+            count = 1
+        elif template_block.block_type == MsgBlockType.MBT_MULTIPLE:
+            count = template_block.number
+        else:
+            count = rand.randint(1, 3)
+
+        for i in range(count):
+            values = dict([(variable.name, random_value(rand, variable)) for variable in template_block.variables])
+            blocks.append(Block(template_block.name, **values))
+
+    return Message(template.name, *blocks)
+
+class TestTemplateEncoder(unittest.TestCase):
+
+    def tearDown(self):
+        pass
+
+    def setUp(self):
+        self.template_dict = TemplateDictionary()
+        self.serializer = UDPMessageSerializer()
+
+    def legacy_body(self, template, message):
+        body = template.msg_num_hex
+        for template_block in template.blocks:
+            body += self.serializer.build_block(template_block, message)[0]
+        return body
+
+    def test_encoder_is_cached(self):
+        template = self.template_dict['ChatFromViewer']
+        encoder = self.template_dict.get_encoder(template)
+
+        assert isinstance(encoder, TemplateEncoder)
+        assert self.template_dict.get_encoder(template) is encoder, "Encoder was rebuilt"
+        assert template.encoder is encoder, "Encoder not cached on the template"
+
+    def test_runs(self):
+        encoder = self.template_dict.get_encoder(self.template_dict['EnableSimulator'])
+        steps = encoder.blocks[0].steps
+        assert [step.__class__ for step in steps] == [FixedRun, StringField, FixedRun]
+        assert steps[2].packer.format == '>H'
+
+        encoder = self.template_dict.get_encoder(self.template_dict['AgentAnimation'])
+        assert len(encoder.blocks[0].steps) == 1, "Fixed size variables were not merged"
+        assert encoder.blocks[0].steps[0].size == 32
+
+    def test_matches_data_packer(self):
+        rand = random.Random(0)
+
+        for template in self.template_dict.message_templates.values():
+            for i in range(3):
+                message = random_message(rand, template)
+                body = ''.join(self.template_dict.get_encoder(template).encode(message))
+                assert body == self.legacy_body(template, message), template.name
+
+    def test_serialize(self):
+        message = Message('StartPingCheck',
+                          Block('PingID', PingID = 5, OldestUnacked = 3))
+        message.packet_id = 7
+        template = self.template_dict['StartPingCheck']
+
+        packed = self.serializer.serialize(message)
+        assert packed == '\x00\x00\x00\x00\x07\x00' + '\x01\x05\x03\x00\x00\x00'
+        assert packed[6:] == self.legacy_body(template, message)
+
+    def test_serialize_into(self):
+        rand = random.Random(1)
+        buffer = bytearray(4096)
+
+        for template in self.template_dict.message_templates.values():
+            message = random_message(rand, template)
+            packed = self.serializer.serialize(message)
+            if packed == None:
+                assert self.serializer.serialize_into(message, buffer, 3) == None
+                continue
+
+            # zero coded packets come out the same as well
+            size = self.serializer.serialize_into(message, buffer, 3)
+            assert str(buffer[3:3 + size]) == packed, template.name
+
+    def test_serialize_into_short(self):
+        message = Message('StartPingCheck',
+                          Block('PingID', PingID = 5, OldestUnacked = 3))
+
+        buffer = bytearray(12)
+        assert self.serializer.serialize_into(message, buffer) == 12
+        self.assertRaises(MessageSerializationError, self.serializer.serialize_into, message, buffer, 1)
+        self.assertRaises(MessageSerializationError, self.serializer.serialize_into, message, bytearray(4))
+        assert len(buffer) == 12
+
+    def test_block_mismatch(self):
+        message = Message('ChatFromViewer',
+                          Block('AgentData', AgentID = uuid.UUID(int = 1), SessionID = uuid.UUID(int = 2)))
+        self.assertRaises(KeyError, self.serializer.serialize, message)
+
+        template = self.template_dict['EnableSimulator']
+        message = Message('EnableSimulator')
+        message.blocks['SimulatorInfo'] = []
+        encoder = self.template_dict.get_encoder(template)
+        # a SINGLE block with no data is still written as nothing
+        assert encoder.encode(message) == [template.msg_num_hex]
+
+        template = MessageTemplate('Test')
+        block = MessageTemplateBlock('Pair')
+        block.block_type = MsgBlockType.MBT_MULTIPLE
+        block.number = 2
+        block.add_variable(MessageTemplateVariable('Value', MsgType.MVT_U8, 1))
+        template.add_block(block)
+        template.msg_num_hex = '\xff\xff\x00\x01'
+
+        message = Message('Test', Block('Pair', Value = 1))
+        self.assertRaises(MessageSerializationError, TemplateEncoder(template).encode, message)
+
+        message = Message('Test', Block('Pair', Value = 1), Block('Pair', Value = 2))
+        assert ''.join(TemplateEncoder(template).encode(message)) == '\xff\xff\x00\x01\x01\x02'
+
+    def test_compile_checks(self):
+        template = MessageTemplate('Test')
+        block = MessageTemplateBlock('Data')
+        block.block_type = MsgBlockType.MBT_SINGLE
+        block.add_variable(MessageTemplateVariable('Value', MsgType.MVT_VARIABLE, 3))
+        template.add_block(block)
+        template.msg_num_hex = '\xff\xff\x00\x01'
+
+        self.assertRaises(MessageSerializationError, TemplateEncoder, template)
+
+        block.variables[0] = MessageTemplateVariable('Value', 'NotAType', 4)
+        self.assertRaises(MessageSerializationError, TemplateEncoder, template)
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestTemplateEncoder))
+    return suite
@@ -57,6 +57,26 @@ class TestDictionary(unittest.TestCase):
         packet = msg_dict.get_template_by_pair('Medium', 8)
         assert packet.name == 'ConfirmEnableSimulator', "Frequency-Number pair resulting in incorrect packet"        
 
+    def test_get_packet_header(self):
+        msg_dict = TemplateDictionary(self.template_list)
+
+        for template in self.template_list:
+            header = template.msg_num_hex + '\x00\x00'
+            assert msg_dict.get_template_by_header(header) is template, template.name
+
+        assert msg_dict.get_template_by_header('xx\xff\x08', 2).name == 'ConfirmEnableSimulator'
+        assert msg_dict.get_template_by_header('\xff\xff\xff\xfb').name == 'PacketAck'
+        assert msg_dict.get_template_by_header('\xff\xff\x00') == None, "Short header not caught"
+        assert msg_dict.get_template_by_header('\xff\xff\xef\xef') == None
+
+    def test_template_ids(self):
+        msg_dict = TemplateDictionary(self.template_list)
+
+        ids = [template.template_id for template in self.template_list]
+        assert ids == range(len(self.template_list)), "Template ids are not dense"
+        template = msg_dict.get_template('ConfirmEnableSimulator')
+        assert msg_dict.get_template_by_id(template.template_id) is template
+
 class TestTemplates(unittest.TestCase):
 
     def tearDown(self):
@@ -0,0 +1,89 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+#standard libraries
+import unittest
+
+#local libraries
+from pyogp.lib.base.message.throttle import Throttle, ThrottleCategory, TokenBucket
+from pyogp.lib.base.message.udpserializer import UDPMessageSerializer
+from pyogp.lib.base.message.udpdeserializer import UDPMessageDeserializer
+from pyogp.lib.base.datatypes import UUID
+from pyogp.lib.base.settings import Settings
+from pyogp.lib.base.tests.fake_clock import FakeClock
+
+class TestThrottle(unittest.TestCase):
+
+    def tearDown(self):
+        pass
+
+    def setUp(self):
+        self.clock = FakeClock(100.0)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(1000.0, 500.0, self.clock)
+        assert bucket.ready()
+
+        # a send can overdraw the bucket, which then waits to refill
+        bucket.charge(1000)
+        assert not bucket.ready()
+        self.clock.now += 0.25
+        assert not bucket.ready()
+        self.clock.now += 0.5
+        assert bucket.ready()
+        assert bucket.tokens == 250.0
+
+        # it never saves up more than a burst
+        self.clock.now += 10
+        assert bucket.ready()
+        assert bucket.tokens == 500.0
+
+    def test_rates(self):
+        throttle = Throttle(clock = self.clock)
+        throttle.set_rate(ThrottleCategory.TEXTURE, 8000)
+        assert throttle.get_rates()[ThrottleCategory.TEXTURE] == 8000.0
+        assert throttle.buckets[ThrottleCategory.TEXTURE].rate == 1000.0
+        assert throttle.get_category('RequestImage') == ThrottleCategory.TEXTURE
+        assert throttle.get_category('ChatFromViewer') == ThrottleCategory.TASK
+
+        throttle.charge(ThrottleCategory.TEXTURE, 1000)
+        assert not throttle.ready(ThrottleCategory.TEXTURE)
+        assert throttle.ready(ThrottleCategory.TASK)
+
+        self.assertRaises(ValueError, throttle.set_rates, [1.0] * 6)
+
+    def test_agent_throttle(self):
+        rates = [1024.0 * (i + 1) for i in range(ThrottleCategory.COUNT)]
+        throttle = Throttle(rates, clock = self.clock)
+
+        msg = throttle.to_message(UUID(), UUID(), 1234, 5)
+        data = UDPMessageSerializer().serialize(msg)
+        settings = Settings()
+        settings.ENABLE_DEFERRED_PACKET_PARSING = False
+        packet = UDPMessageDeserializer(settings = settings).deserialize(data)
+        assert packet.blocks['Throttle'][0].vars['GenCounter'].data == 5
+
+        other = Throttle(clock = self.clock)
+        other.unpack(packet.blocks['Throttle'][0].vars['Throttles'].data)
+        assert other.get_rates() == rates
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestThrottle))
+    return suite
@@ -0,0 +1,119 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+#standard libraries
+import unittest
+import random
+
+#local libraries
+from pyogp.lib.base.message.timer_wheel import TimerWheel
+from pyogp.lib.base.tests.fake_clock import FakeClock
+
+class TestTimerWheel(unittest.TestCase):
+
+    def tearDown(self):
+        pass
+
+    def setUp(self):
+        self.clock = FakeClock(100.0)
+
+    def test_expire(self):
+        wheel = TimerWheel(resolution = 0.5, clock = self.clock)
+        wheel.schedule(101.0, 'a')
+        wheel.schedule(101.2, 'b')
+        wheel.schedule(99.0, 'late')
+        assert len(wheel) == 3
+
+        assert wheel.expire() == ['late']
+        assert wheel.expire(100.9) == []
+        assert wheel.expire(101.0) == ['a']
+        # deadlines are rounded up to a tick, never down
+        assert wheel.expire(101.4) == []
+        assert wheel.expire(101.5) == ['b']
+        assert len(wheel) == 0
+
+    def test_cancel(self):
+        wheel = TimerWheel(clock = self.clock)
+        timer = wheel.schedule(100.5, 'a')
+        wheel.schedule(100.5, 'b')
+        wheel.cancel(timer)
+        wheel.cancel(timer)
+        assert len(wheel) == 1
+        assert wheel.expire(101) == ['b']
+
+    def test_next_deadline(self):
+        wheel = TimerWheel(resolution = 0.5, clock = self.clock)
+        assert wheel.next_deadline() == None
+
+        timer = wheel.schedule(101.2, 'a')
+        wheel.schedule(250.0, 'b')
+        assert wheel.next_deadline() == 101.5
+        wheel.cancel(timer)
+        # b is a level up, and only known to be due after 128.0
+        assert wheel.next_deadline() == 128.0
+        wheel.schedule(99.0, 'late')
+        assert wheel.next_deadline() == 99.0
+
+    def test_far_deadlines(self):
+        # 4 levels of 4 slots span 256 ticks
+        wheel = TimerWheel(resolution = 1, bits = 2, levels = 4, clock = self.clock)
+        wheel.schedule(150, 'cascaded')
+        wheel.schedule(1000, 'parked')
+
+        assert wheel.expire(149) == []
+        assert wheel.expire(150) == ['cascaded']
+        assert wheel.expire(999) == []
+        assert wheel.expire(1000) == ['parked']
+
+    def test_matches_sorting(self):
+        rand = random.Random(0)
+        wheel = TimerWheel(resolution = 1, bits = 3, levels = 3, clock = self.clock)
+
+        pending = {}
+        now = 100
+        for step in range(2000):
+            for i in range(rand.randint(0, 3)):
+                deadline = now + rand.choice([rand.randint(-2, 10), rand.randint(0, 1000)])
+                pending[wheel.schedule(deadline, (deadline, step, i))] = deadline
+            if pending and rand.random() < 0.1:
+                timer = rand.choice(pending.keys())
+                wheel.cancel(timer)
+                del pending[timer]
+
+            now += rand.choice([0, 1, 1, 2, 5, 40])
+            expired = wheel.expire(now)
+
+            due = [timer.item for timer, deadline in pending.items() if deadline <= now]
+            assert sorted(expired) == sorted(due), (now, sorted(expired), sorted(due))
+            for timer in pending.keys():
+                if pending[timer] <= now:
+                    del pending[timer]
+
+            assert len(wheel) == len(pending)
+
+            deadline = wheel.next_deadline()
+            if pending:
+                assert deadline <= min(pending.values()), (now, deadline, min(pending.values()))
+            else:
+                assert deadline == None
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestTimerWheel))
+    return suite
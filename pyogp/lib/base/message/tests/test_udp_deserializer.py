@@ -18,6 +18,7 @@ $/LicenseInfo$
 
 #standard libraries
 import unittest, doctest
+import threading
 from uuid import UUID
 
 #local libraries
@@ -64,6 +65,80 @@ class TestDeserializer(unittest.TestCase):
 
 
 
+    def test_deserialize_many(self):
+        ack = '\x00' + '\x00\x00\x00\x01' + '\x00' + '\xff\xff\xff\xfb' + '\x01' + '\x05\x00\x00\x00'
+        short = '\x00' + '\x00\x00\x00\x02' + '\x00' + '\xff\xff\xff\xfb' + '\x02' + '\x05\x00\x00\x00'
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+
+        packets = deserializer.deserialize_many([ack, '\x00\x00', short, ack])
+
+        assert len(packets) == 4
+        assert packets[0].blocks['Packets'][0]['ID'] == 5
+        assert packets[1] == None, "Bad packet not skipped"
+        assert packets[2] == None, "Short packet not skipped"
+        assert packets[3].name == 'PacketAck'
+
+        assert deserializer.deserialize_many([]) == []
+
+    def test_read_acks(self):
+        message = '\x10' + '\x00\x00\x00\x01' + '\x00' + '\xff\xff\xff\xfb' + '\x01' + \
+                  '\x05\x00\x00\x00' + '\x00\x00\x01\x02' + '\x00\x00\x00\x03' + '\x02'
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+
+        assert deserializer.read_acks(message) == [0x102, 3]
+        packet = deserializer.deserialize(message)
+        assert packet.acks == [0x102, 3]
+        assert packet.blocks['Packets'][0]['ID'] == 5
+
+        # no ack flag, and more acks than the packet could hold
+        assert deserializer.read_acks('\x00' + message[1:]) == []
+        assert deserializer.read_acks(message[:-1] + '\x09') == []
+
+    def test_views(self):
+        ack = '\x00' + '\x00\x00\x00\x01' + '\x00' + '\xff\xff\xff\xfb' + '\x01' + '\x05\x00\x00\x00'
+        buffer = bytearray(100)
+        buffer[:len(ack)] = ack
+        view = memoryview(buffer)[:len(ack)]
+
+        for lazy in (False, True):
+            self.settings.ENABLE_LAZY_PACKET_DECODING = lazy
+            deserializer = UDPMessageDeserializer(settings = self.settings)
+            packet = deserializer.deserialize(view)
+
+            # the receive buffer is reused for the next packet
+            buffer[11] = '\x09'
+            assert packet.blocks['Packets'][0]['ID'] == 5
+            buffer[11] = '\x05'
+
+    def test_shared_instance(self):
+        # one instance decoding from several threads at once
+        ack = '\x00' + '\x00\x00\x00\x01' + '\x00' + '\xff\xff\xff\xfb' + '\x01' + '\x05\x00\x00\x00'
+        msg = Message('ChatFromViewer',
+                      Block('AgentData', AgentID=UUID('550e8400-e29b-41d4-a716-446655440000'),
+                            SessionID=UUID('550e8400-e29b-41d4-a716-446655440000')),
+                       Block('ChatData', Message='Hi Locklainn Tester', Type=1, Channel=0))
+        serializer = UDPMessageSerializer()
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        errors = []
+
+        def work():
+            try:
+                for i in range(200):
+                    packet = deserializer.deserialize(serializer.serialize(msg))
+                    assert packet.blocks['ChatData'][0]['Message'] == 'Hi Locklainn Tester'
+                    packet = deserializer.deserialize(ack)
+                    assert packet.blocks['Packets'][0]['ID'] == 5
+            except Exception, error:
+                errors.append(error)
+
+        threads = [threading.Thread(target = work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == [], errors
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
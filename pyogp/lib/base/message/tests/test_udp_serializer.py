@@ -22,7 +22,9 @@ from uuid import UUID
 
 #local libraries
 from pyogp.lib.base.settings import Settings
-from pyogp.lib.base.message.msgtypes import MsgType
+from pyogp.lib.base.exc import MessageSerializationError
+from pyogp.lib.base.message.msgtypes import MsgType, PackFlags, PacketLayout
+from pyogp.lib.base.message.message import Message, Block
 from pyogp.lib.base.message.udpdeserializer import UDPMessageDeserializer
 from pyogp.lib.base.message.udpserializer import UDPMessageSerializer
 
@@ -51,6 +53,125 @@ class TestSerializer(unittest.TestCase):
         packed_data = serializer.serialize(packet)
         assert packed_data == message, "Incorrect serialization"
 
+    def test_zero_code(self):
+        msg = Message('ChatFromViewer',
+                      Block('AgentData', AgentID=UUID('550e8400-e29b-41d4-a716-446655440000'),
+                            SessionID=UUID('00000000-0000-0000-0000-000000000000')),
+                      Block('ChatData', Message='Hi', Type=1, Channel=0))
+        serializer = UDPMessageSerializer()
+        packed_data = serializer.serialize(msg)
+
+        assert ord(packed_data[0]) & PackFlags.LL_ZERO_CODE_FLAG, "Zerocoded template was not zero coded"
+        assert serializer.zero_coded_packets == 1
+        assert serializer.zero_code_bytes_saved > 0
+        assert len(packed_data) == serializer.zero_code_bytes_in + 6 - serializer.zero_code_bytes_saved
+
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        packet = deserializer.deserialize(packed_data)
+        assert packet.blocks['ChatData'][0]['Message'] == 'Hi'
+        assert packet.blocks['ChatData'][0]['Channel'] == 0
+        assert str(packet.blocks['AgentData'][0]['AgentID']) == '550e8400-e29b-41d4-a716-446655440000'
+        assert str(packet.blocks['AgentData'][0]['SessionID']) == '00000000-0000-0000-0000-000000000000'
+
+    def test_zero_code_fallback(self):
+        # every zero in this message is on its own, so zero coding would grow it
+        msg = Message('ChatFromViewer',
+                      Block('AgentData', AgentID=UUID('11111111-1111-1111-1111-111111111111'),
+                            SessionID=UUID('11111111-1111-1111-1111-111111111111')),
+                      Block('ChatData', Message='Hi', Type=1, Channel=0x01010101))
+        msg.send_flags = PackFlags.LL_ZERO_CODE_FLAG
+        serializer = UDPMessageSerializer()
+        packed_data = serializer.serialize(msg)
+
+        assert not ord(packed_data[0]) & PackFlags.LL_ZERO_CODE_FLAG, "Zero code flag set on a plain packet"
+        assert serializer.zero_coded_packets == 0
+        assert serializer.zero_code_bytes_saved == 0
+        assert serializer.zero_code_bytes_in == len(packed_data) - 6
+
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        packet = deserializer.deserialize(packed_data)
+        assert packet.blocks['ChatData'][0]['Channel'] == 0x01010101
+
+    def test_appended_acks(self):
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        msg.packet_id = 2
+        msg.send_flags = PackFlags.LL_ACK_FLAG
+        serializer = UDPMessageSerializer()
+
+        # the ack flag is only set when acks are appended
+        packed_data = serializer.serialize(msg)
+        assert packed_data == '\x00\x00\x00\x00\x02\x00\x01\x01\x00\x00\x00\x00'
+
+        msg.add_ack(0x102)
+        msg.add_ack(3)
+        packed_data = serializer.serialize(msg)
+        assert packed_data == '\x10\x00\x00\x00\x02\x00\x01\x01\x00\x00\x00\x00' + \
+               '\x00\x00\x01\x02' + '\x00\x00\x00\x03' + '\x02'
+
+        buffer = bytearray(100)
+        size = serializer.serialize_into(msg, buffer, 1)
+        assert str(buffer[1:1 + size]) == packed_data
+
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        packet = deserializer.deserialize(packed_data)
+        assert packet.acks == [0x102, 3]
+        assert packet.blocks['PingID'][0]['PingID'] == 1
+
+    def test_ack_budget(self):
+        serializer = UDPMessageSerializer()
+
+        # zero coded packets get acks too, after the coded body
+        msg = Message('ChatFromViewer',
+                      Block('AgentData', AgentID=UUID(int=1), SessionID=UUID(int=2)),
+                      Block('ChatData', Message='x' * 1000, Type=1, Channel=0))
+        for packet_id in range(300):
+            msg.add_ack(packet_id)
+
+        packed_data = serializer.serialize(msg)
+        assert len(packed_data) <= PacketLayout.ACK_MTU
+        assert len(packed_data) + 4 > PacketLayout.ACK_MTU
+        assert len(msg.acks) == ord(packed_data[-1])
+        assert msg.acks == range(len(msg.acks))
+
+        deserializer = UDPMessageDeserializer(settings = self.settings)
+        packet = deserializer.deserialize(packed_data)
+        assert packet.acks == msg.acks
+        assert packet.blocks['ChatData'][0]['Message'] == 'x' * 1000
+
+        # no more than the count byte can hold
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        for packet_id in range(300):
+            msg.add_ack(packet_id)
+        packed_data = serializer.serialize(msg)
+        assert msg.acks == range(255)
+        assert len(packed_data) == 12 + 255 * 4 + 1
+
+        # packets already over the budget go without
+        msg = Message('ChatFromViewer',
+                      Block('AgentData', AgentID=UUID(int=1), SessionID=UUID(int=2)),
+                      Block('ChatData', Message='x' * 1300, Type=1, Channel=0))
+        msg.add_ack(1)
+        packed_data = serializer.serialize(msg)
+        assert msg.acks == []
+        assert not ord(packed_data[0]) & PackFlags.LL_ACK_FLAG
+
+    def test_serialize_acks(self):
+        serializer = UDPMessageSerializer()
+
+        for ack_ids in ([5], range(255), [0xffffffff, 0]):
+            msg = Message('PacketAck', *[Block('Packets', ID=ack_id) for ack_id in ack_ids])
+            msg.packet_id = 9
+            assert serializer.serialize_acks(9, ack_ids) == serializer.serialize(msg)
+
+        self.assertRaises(MessageSerializationError, serializer.serialize_acks, 1, range(256))
+
+    def test_high_packet_id(self):
+        serializer = UDPMessageSerializer()
+        msg = Message('PacketAck', Block('Packets', ID=1))
+        msg.packet_id = 0xfffffffe
+        packed_data = serializer.serialize(msg)
+        assert packed_data[1:5] == '\xff\xff\xff\xfe'
+        assert serializer.serialize_acks(0x80000000, [1])[1:5] == '\x80\x00\x00\x00'
 
 def test_suite():
     from unittest import TestSuite, makeSuite
@@ -19,15 +19,18 @@ $/LicenseInfo$
 #standard libraries
 import unittest, doctest
 import pprint
+from uuid import UUID
 
 # pyogp
 from pyogp.lib.base.settings import Settings
 #from pyogp.lib.base.message.udp_connection import MessageSystem
-from pyogp.lib.base.message.msgtypes import MsgType
+from pyogp.lib.base.message.msgtypes import MsgType, PackFlags
 from pyogp.lib.base.tests.mockup_net import MockupUDPServer, MockupUDPClient
+from pyogp.lib.base.tests.fake_clock import FakeClock
 from pyogp.lib.base.message.message import Message, Block
 from pyogp.lib.base.message.circuit import Host
-from pyogp.lib.base.message.udpdispatcher import UDPDispatcher
+from pyogp.lib.base.message.udpdispatcher import UDPDispatcher, SEND_BUFFER_SIZE
+from pyogp.lib.base.message.throttle import ThrottleCategory
 
 class TestUDPConnection(unittest.TestCase):
 
@@ -112,6 +115,22 @@ class TestUDPConnection(unittest.TestCase):
                'Received: ' + repr(msg) + '  ' + \
                'Expected: ' + repr(test_str)
 
+    def test_send_reliable_failed(self):
+        host = self.host
+        circuit = self.udp_connection.find_circuit(host)
+
+        for pooled in (False, True):
+            self.settings.ENABLE_POOLED_SEND_BUFFERS = pooled
+
+            msg = Message('PacketAck', Block('Packets', ID='three'))
+            assert self.udp_connection.send_reliable(msg, host, 10) == None
+
+            # not left waiting for an ack of a packet that was never sent
+            assert circuit.unacked_packets == {}
+            assert circuit.unack_packet_count == 0
+            assert circuit.unack_packet_bytes == 0
+            assert (host.ip, host.port) not in self.udp_connection.circuit_manager.unacked_circuits
+
     def test_receive(self):
         out_message = '\x00' + '\x00\x00\x00\x01' + '\x00' + \
             '\xff\xff\xff\xfb' + '\x01' + '\x01\x00\x00\x00'
@@ -170,6 +189,406 @@ class TestUDPConnection(unittest.TestCase):
         assert server.rec_buffer == test_msg, "Ack received incorrect, got " + \
                repr(server.rec_buffer)
 
+    def test_receive_batch(self):
+        host = Host((MockupUDPServer(), 80))
+        ack = '\x40' + '\x00\x00\x00\x05' + '\x00' + \
+            '\xff\xff\xff\xfb' + '\x01' + '\x01\x00\x00\x00'
+        zero_coded = '\x80' + '\x00\x00\x00\x06' + '\x00' + \
+            '\xff\xff\xff\xfb' + '\x01' + '\x02\x00\x03'
+        unknown = '\x40' + '\x00\x00\x00\x07' + '\x00' + '\xff\xff\xef\xef'
+
+        packets = self.udp_connection.receive_batch([(host, ack), (host, ''),
+                                                     (host, unknown), (host, zero_coded),
+                                                     (host, '\x00\x00')])
+
+        assert [packet.packet_id for packet in packets] == [5, 6]
+        assert packets[1].blocks['Packets'][0]['ID'] == 2
+        assert self.udp_connection.packets_in == 4
+
+        # the reliable packet, and the one we couldn't decode, get acked
+        circuit = self.udp_connection.circuit_manager.get_circuit(host)
+        assert circuit.acks == [5, 7], circuit.acks
+
+    def test_receive_views(self):
+        host = self.host
+        circuit = self.udp_connection.find_circuit(host)
+        ack = '\x40' + '\x00\x00\x00\x05' + '\x00' + \
+            '\xff\xff\xff\xfb' + '\x01' + '\x01\x00\x00\x00'
+        buffer = bytearray(100)
+        buffer[:len(ack)] = ack
+
+        packets = self.udp_connection.receive_views([(memoryview(buffer)[:len(ack)], (host.ip, host.port))])
+        assert [packet.packet_id for packet in packets] == [5]
+        assert circuit.acks == [5]
+
+        # from an address there is no circuit for yet
+        packets = self.udp_connection.receive_views([(memoryview(buffer)[:len(ack)], ('127.0.0.1', 5000))])
+        assert packets[0].blocks['Packets'][0]['ID'] == 1
+        assert ('127.0.0.1', 5000) in self.udp_connection.circuit_manager.circuit_map
+
+    def test_receive_ring(self):
+        import socket
+        from pyogp.lib.base.network.net import NetUDPClient, ReceiveRing
+        from pyogp.lib.base.message.udpserializer import UDPMessageSerializer
+
+        # decoded eagerly, straight from the slot
+        self.settings.ENABLE_LAZY_PACKET_DECODING = False
+        self.settings.ENABLE_ZERO_COPY_PAYLOADS = False
+
+        udp_connection = UDPDispatcher(NetUDPClient(), settings = self.settings)
+        udp_client = udp_connection.udp_client
+        udp_client.receive_ring = ReceiveRing(slots = 1, size = 1500)
+        udp_connection.socket.bind(('127.0.0.1', 0))
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.bind(('127.0.0.1', 0))
+        serializer = UDPMessageSerializer()
+
+        chat = Message('ChatFromViewer',
+                       Block('AgentData', AgentID=UUID(int=1), SessionID=UUID(int=2)),
+                       Block('ChatData', Message='Hello', Type=1, Channel=0))
+        xfer = Message('SendXferPacket',
+                       Block('XferID', ID=1, Packet=0),
+                       Block('DataPacket', Data='\x01\x02\x03\x04'))
+        try:
+            received = []
+            for packet_id, message in ((1, chat), (2, xfer), (3, chat)):
+                message.packet_id = packet_id
+                sender.sendto(serializer.serialize(message), udp_connection.socket.getsockname())
+                views = udp_client.receive_into(udp_connection.socket)
+                received.extend(udp_connection.receive_views(views))
+        finally:
+            sender.close()
+            udp_connection.socket.close()
+
+        # every packet was read into the one slot, overwriting the last
+        assert [packet.name for packet in received] == ['ChatFromViewer', 'SendXferPacket', 'ChatFromViewer']
+        assert received[0].blocks['ChatData'][0].vars['Message'].data == 'Hello'
+        assert str(received[0].blocks['AgentData'][0].vars['AgentID'].data) == str(UUID(int=1))
+        # copies, not views of the slot
+        assert received[1].blocks['DataPacket'][0].vars['Data'].data == '\x01\x02\x03\x04\x00'
+        assert type(received[1].blocks['DataPacket'][0].vars['Data'].data) is str
+        assert type(received[2].blocks['ChatData'][0].vars['Message'].data) is str
+
+    def test_subscribe(self):
+        from pyogp.lib.base.message.message_handler import MessageHandler
+        self.settings.ENABLE_DEFERRED_PACKET_PARSING = True
+        host_a = Host(('127.0.0.1', 5000))
+        host_b = Host(('127.0.0.1', 5001))
+        handler_a = MessageHandler()
+        handler_b = MessageHandler()
+
+        received = []
+        handler_a.register('StartPingCheck').subscribe(received.append)
+        self.udp_connection.subscribe(host_a, handler_a)
+        circuit_b = self.udp_connection.subscribe(host_b, handler_b)
+
+        ping = '\x00' + '\x00\x00\x00\x05' + '\x00' + '\x01' + '\x07' + '\x00\x00\x00\x00'
+        packets = self.udp_connection.receive_batch([(host_b, ping), (host_a, ping), (host_b, ping[:4] + '\x06' + ping[5:])])
+
+        # decoded only for the agent handling it
+        assert [packet.name for packet in packets] == ['StartPingCheck']
+        assert [packet.blocks['PingID'][0]['PingID'] for packet in received] == [7]
+        assert circuit_b.packets_in == 2
+
+        self.udp_connection.unsubscribe(host_b)
+        assert ('127.0.0.1', 5001) not in self.udp_connection.circuit_manager.circuit_map
+        assert self.udp_connection.find_circuit(host_b).message_handler == None
+
+    def test_subscribe_outgoing(self):
+        from pyogp.lib.base.message.message_handler import MessageHandler
+        self.settings.HANDLE_OUTGOING_PACKETS = True
+        message_handler = MessageHandler()
+        sent = []
+        message_handler.register('StartPingCheck').subscribe(sent.append)
+        message_handler.register('PacketAck').subscribe(sent.append)
+        circuit = self.udp_connection.subscribe(self.host, message_handler)
+
+        self.udp_connection.send_message(Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0)),
+                                         self.host)
+        circuit.collect_ack(5)
+        self.udp_connection.send_acks(circuit)
+
+        # seen by the agent the circuit belongs to
+        assert [packet.name for packet in sent] == ['StartPingCheck', 'PacketAck']
+
+    def test_skipped_acks(self):
+        self.settings.ENABLE_DEFERRED_PACKET_PARSING = True
+        host = Host((MockupUDPServer(), 80))
+
+        msg = Message('PacketAck', Block('Packets', ID=0x00000003))
+        self.udp_connection.send_reliable(msg, host, 10)
+        circuit = self.udp_connection.circuit_manager.get_circuit(host)
+        assert circuit.unacked_packets.keys() == [1]
+
+        # an unhandled packet, with our packet id 1 and an unknown id acked
+        out_message = '\x50' + '\x00\x00\x00\x09' + '\x00' + \
+            '\xff\xff\x00\x01' + '\x00\x00\x00\x01' + '\x00\x00\x00\x07' + '\x02'
+        packet = self.udp_connection.receive_check(host, out_message, len(out_message))
+
+        assert packet == None
+        assert circuit.unacked_packets == {}, "Ack in a skipped packet was ignored"
+        assert circuit.acks == [9]
+        assert self.udp_connection.skipped_acks_in == 2
+        assert self.udp_connection.retransmits_avoided == 1
+        assert circuit.retransmits_avoided == 1
+
+    def test_duplicates(self):
+        host = Host((MockupUDPServer(), 80))
+        out_message = '\x40' + '\x00\x00\x00\x05' + '\x00' + \
+            '\xff\xff\xff\xfb' + '\x01' + '\x01\x00\x00\x00'
+        resent = '\x60' + out_message[1:]
+
+        assert self.udp_connection.receive_check(host, out_message, len(out_message)) != None
+        assert self.udp_connection.receive_check(host, resent, len(resent)) == None
+
+        packets = self.udp_connection.receive_batch([(host, resent), (host, out_message)])
+        assert packets == []
+
+        # each copy is acked again
+        circuit = self.udp_connection.circuit_manager.get_circuit(host)
+        assert circuit.acks == [5, 5, 5, 5]
+        assert circuit.duplicates_in == 3
+        assert self.udp_connection.duplicates_in == 3
+
+    def test_pooled_send(self):
+        self.settings.ENABLE_POOLED_SEND_BUFFERS = True
+        server = self.host.ip
+
+        sent = []
+        server.receive_message = lambda client, buf: sent.append(buf.tobytes())
+
+        msg = Message('PacketAck', Block('Packets', ID=0x00000003))
+        assert self.udp_connection.send_message(msg, self.host) == 15
+        msg = Message('PacketAck', Block('Packets', ID=0x00000003))
+        assert self.udp_connection.send_message(msg, self.host) == 15
+
+        assert sent == ['\x00\x00\x00\x00\x01\x00\xff\xff\xff\xfb\x01\x03\x00\x00\x00',
+                        '\x00\x00\x00\x00\x02\x00\xff\xff\xff\xfb\x01\x03\x00\x00\x00']
+        # the one buffer was reused
+        assert len(self.udp_connection.send_buffers) == 1
+
+        # packets too big for a pooled buffer are still sent
+        msg = Message('ChatFromViewer',
+                      Block('AgentData', AgentID=UUID(int=1), SessionID=UUID(int=2)),
+                      Block('ChatData', Message='x' * 3000, Type=1, Channel=0))
+        size = self.udp_connection.send_message(msg, self.host)
+        assert size > SEND_BUFFER_SIZE
+        assert len(sent[-1]) == size
+        assert len(self.udp_connection.send_buffers) == 1
+
+    def test_piggybacked_acks(self):
+        circuit = self.udp_connection.find_circuit(self.host)
+        for packet_id in range(300):
+            circuit.collect_ack(packet_id)
+
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        buf = self.udp_connection.send_message(msg, self.host)
+        assert ord(buf[0]) & PackFlags.LL_ACK_FLAG
+        assert ord(buf[-1]) == 255
+        assert self.udp_connection.udp_deserializer.read_acks(buf) == range(255)
+        assert circuit.acks == range(255, 300)
+
+        # the leftovers go out in a PacketAck
+        self.udp_connection.process_acks()
+        assert circuit.acks == []
+        assert not self.udp_connection.has_unacked()
+
+    def test_resend_unacked(self):
+        clock = FakeClock(1000.0)
+        self.udp_connection = UDPDispatcher(MockupUDPClient(), settings = self.settings, clock = clock)
+        server = self.host.ip
+        sent = []
+        server.receive_message = lambda client, buf: sent.append(str(buf))
+
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        first = self.udp_connection.send_reliable(msg, self.host, 2)
+        circuit = self.udp_connection.find_circuit(self.host)
+        assert msg.expiration_time == 1000.0 + circuit.rto
+
+        # nothing is resent before the retransmission timeout
+        clock.now += 0.5
+        self.udp_connection.process_acks()
+        assert len(sent) == 1
+
+        # resent from the bytes sent, with the same id and the resent flag
+        msg.blocks['PingID'][0].vars['PingID'].data = 2
+        clock.now += 0.5
+        self.udp_connection.process_acks()
+        assert sent[-1] == '\x60' + first[1:]
+        assert self.udp_connection.packets_resent == 1
+        assert circuit.unacked_packets.keys() == [1]
+
+        # and again once the doubled timeout has passed, out of retries
+        assert circuit.rto == 2.0
+        clock.now += 1.5
+        self.udp_connection.process_acks()
+        assert len(sent) == 2
+        clock.now += 0.5
+        self.udp_connection.process_acks()
+        assert sent[-1] == '\x60' + first[1:]
+        assert circuit.unacked_packets == {}
+        assert circuit.final_retry_packets.keys() == [1]
+        assert circuit.unack_packet_count == 0
+
+        clock.now += 100
+        self.udp_connection.process_acks()
+        assert len(sent) == 3
+        assert self.udp_connection.packets_resent == 2
+        assert self.udp_connection.circuit_manager.unacked_circuits == {}
+
+    def test_resend_pooled(self):
+        clock = FakeClock(1000.0)
+        self.settings.ENABLE_POOLED_SEND_BUFFERS = True
+        self.udp_connection = UDPDispatcher(MockupUDPClient(), settings = self.settings, clock = clock)
+        server = self.host.ip
+        sent = []
+        server.receive_message = lambda client, buf: sent.append(bytes(bytearray(buf)))
+
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        self.udp_connection.send_reliable(msg, self.host, 3)
+        self.udp_connection.send_message(Message('StartPingCheck', Block('PingID', PingID=9, OldestUnacked=0)), self.host)
+
+        # the pooled buffer was reused, the kept copy wasn't
+        clock.now += 1
+        self.udp_connection.process_acks()
+        assert sent[-1] == '\x60' + sent[0][1:]
+
+        # an ack clears it, and isn't timed as the packet was resent
+        circuit = self.udp_connection.find_circuit(self.host)
+        circuit.ack_reliable_packet(1)
+        assert circuit.srtt == None
+        clock.now += 10
+        self.udp_connection.process_acks()
+        assert len(sent) == 3
+        assert self.udp_connection.circuit_manager.unacked_circuits == {}
+
+    def test_rtt(self):
+        clock = FakeClock(1000.0)
+        self.udp_connection = UDPDispatcher(MockupUDPClient(), settings = self.settings, clock = clock)
+
+        for packet_id in (1, 2):
+            msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+            self.udp_connection.send_reliable(msg, self.host, 3)
+        circuit = self.udp_connection.find_circuit(self.host)
+
+        # an ack, in a packet that isn't decoded, times the round trip
+        clock.now += 0.25
+        out_message = '\x10' + '\x00\x00\x00\x01' + '\x00' + \
+            '\xff\xff\x00\x01' + '\x00\x00\x00\x01' + '\x01'
+        self.udp_connection.receive_check(self.host, out_message, len(out_message))
+        assert circuit.srtt == 0.25
+        assert circuit.rto == 1.0
+
+        # the other packet times out once, then the ack comes in
+        clock.now += 0.75
+        self.udp_connection.process_acks()
+        assert self.udp_connection.packets_resent == 1
+        assert circuit.rto == 2.0
+        circuit.ack_reliable_packet(2)
+        assert circuit.rtt_samples == 1
+        assert len(self.udp_connection.retransmit_timers) == 1
+
+    def test_ack_flush_policy(self):
+        clock = FakeClock(1000.0)
+        self.settings.ACK_FLUSH_DELAY = 0.125
+        self.settings.ACK_FLUSH_THRESHOLD = 3
+        self.udp_connection = UDPDispatcher(MockupUDPClient(), settings = self.settings, clock = clock)
+        server = self.host.ip
+        sent = []
+        server.receive_message = lambda client, buf: sent.append(str(buf))
+
+        circuit = self.udp_connection.find_circuit(self.host)
+        circuit.collect_ack(5)
+        clock.now += 0.0625
+        circuit.collect_ack(6)
+        assert circuit.oldest_ack_time == 1000.0
+
+        # held until the oldest ack has waited long enough
+        self.udp_connection.process_acks()
+        assert sent == []
+        clock.now += 0.0625
+        self.udp_connection.process_acks()
+        assert sent == ['\x00\x00\x00\x00\x01\x00\xff\xff\xff\xfb\x02' + \
+                        '\x05\x00\x00\x00\x06\x00\x00\x00']
+        assert circuit.acks == [] and circuit.oldest_ack_time == None
+
+        # or until enough are pending
+        for packet_id in range(3):
+            circuit.collect_ack(packet_id)
+        self.udp_connection.process_acks()
+        assert len(sent) == 2
+        assert self.udp_connection.acks_out == 5
+
+    def test_send_acks_split(self):
+        server = self.host.ip
+        sent = []
+        server.receive_message = lambda client, buf: sent.append(str(buf))
+
+        circuit = self.udp_connection.find_circuit(self.host)
+        for packet_id in range(600):
+            circuit.collect_ack(packet_id)
+        self.udp_connection.process_acks()
+
+        assert [ord(packet[10]) for packet in sent] == [255, 255, 90]
+        packets = [self.udp_connection.udp_deserializer.deserialize(packet) for packet in sent]
+        assert [block['ID'] for packet in packets for block in packet.blocks['Packets']] == range(600)
+
+    def test_stats(self):
+        clock = FakeClock(1000.0)
+        self.udp_connection = UDPDispatcher(MockupUDPClient(), settings = self.settings, clock = clock)
+
+        msg = Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0))
+        size = len(self.udp_connection.send_reliable(msg, self.host, 2))
+        circuit = self.udp_connection.find_circuit(self.host)
+        assert circuit.unack_packet_bytes == size
+
+        # resent once, then acked by a reliable packet, which is acked back
+        clock.now += 1.0
+        self.udp_connection.process_acks()
+        in_message = '\x50' + '\x00\x00\x00\x01' + '\x00' + \
+            '\xff\xff\x00\x01' + '\x00\x00\x00\x01' + \
+            '\x00\x00\x00\x01' + '\x01'
+        self.udp_connection.receive_check(self.host, in_message, len(in_message))
+        self.udp_connection.receive_check(self.host, in_message, len(in_message))
+        self.udp_connection.process_acks()
+
+        stats = self.udp_connection.circuit_manager.get_stats()[(self.host.ip, self.host.port)]
+        assert stats['packets_in'] == 2
+        assert stats['bytes_in'] == 2 * len(in_message)
+        assert stats['duplicates_in'] == 1
+        assert stats['acks_in'] == 1
+        assert stats['packets_out'] == 3
+        assert stats['packets_resent'] == 1
+        # both acks for the duplicated packet went out in one PacketAck
+        assert stats['acks_out'] == 2
+        assert stats['bytes_out'] == 2 * size + 11 + 2 * 4
+        assert stats['unack_packet_count'] == 0
+        assert stats['unack_packet_bytes'] == 0
+        # the ack for the resent packet isn't timed
+        assert stats['rtt']['count'] == 0
+
+    def test_throttled_resend(self):
+        clock = FakeClock(1000.0)
+        self.settings.ENABLE_THROTTLES = True
+        self.udp_connection = UDPDispatcher(MockupUDPClient(), settings = self.settings, clock = clock)
+        circuit = self.udp_connection.find_circuit(self.host)
+        circuit.throttle.set_rate(ThrottleCategory.RESEND, 160.0)
+
+        for i in range(2):
+            msg = Message('StartPingCheck', Block('PingID', PingID=i, OldestUnacked=0))
+            self.udp_connection.send_reliable(msg, self.host, 3)
+
+        # one resend overdraws the resend bucket, the other waits for it
+        clock.now += 1.0
+        self.udp_connection.process_acks()
+        assert self.udp_connection.packets_resent == 1
+        self.udp_connection.process_acks()
+        assert self.udp_connection.packets_resent == 1
+        clock.now += 0.5
+        self.udp_connection.process_acks()
+        assert self.udp_connection.packets_resent == 2
+        assert len(self.udp_connection.retransmit_timers) == 2
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
@@ -0,0 +1,74 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+#standard libraries
+import unittest
+import random
+
+#local libraries
+from pyogp.lib.base.message.zerocode import zero_code_expand, zero_code_compress
+from pyogp.lib.base.message.tests.bench_zerocode import legacy_zero_code_expand, make_body
+
+class TestZeroCode(unittest.TestCase):
+
+    def tearDown(self):
+        pass
+
+    def setUp(self):
+        self.random = random.Random(1)
+
+    def test_expand(self):
+        assert zero_code_expand('\x01\x00\x03\x02') == '\x01\x00\x00\x00\x02'
+        assert zero_code_expand('\x00\x01') == '\x00'
+        assert zero_code_expand('abc') == 'abc'
+        assert zero_code_expand('') == ''
+
+    def test_expand_range(self):
+        data = 'xx\x01\x00\x03yy'
+        assert zero_code_expand(data, 2, 5) == '\x01\x00\x00\x00'
+
+    def test_expand_matches_legacy(self):
+        for i in range(200):
+            size = self.random.randint(0, 64)
+            data = ''.join([chr(self.random.choice((0, 0, 1, 2, 255))) for j in range(size)])
+            assert zero_code_expand(data) == legacy_zero_code_expand(data), repr(data)
+
+    def test_compress(self):
+        assert zero_code_compress('\x01\x00\x00\x00\x02') == '\x01\x00\x03\x02'
+        assert zero_code_compress('abc') == 'abc'
+        assert zero_code_compress('\x00' * 300) == '\x00\xff\x00\x2d'
+
+    def test_round_trip(self):
+        for i in range(50):
+            body = make_body(self.random, self.random.randint(0, 1200))
+            assert zero_code_expand(zero_code_compress(body)) == body
+
+    def test_buffer_types(self):
+        data = '\x01\x00\x00\x00\x02'
+        coded = '\x01\x00\x03\x02'
+        assert zero_code_expand(bytearray(coded)) == data
+        assert zero_code_expand(memoryview(coded)) == data
+        assert zero_code_expand(memoryview('x' + coded), 1) == data
+        assert zero_code_compress(bytearray(data)) == coded
+        assert zero_code_compress(memoryview(data)) == coded
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestZeroCode))
+    return suite
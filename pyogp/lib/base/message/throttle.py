@@ -0,0 +1,201 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+import struct
+import time
+
+# pyogp messaging
+from message import Message, Block
+
+class ThrottleCategory(object):
+    """ the traffic categories of AgentThrottle, in the order its
+        Throttles are listed """
+    RESEND  = 0
+    LAND    = 1
+    WIND    = 2
+    CLOUD   = 3
+    TASK    = 4
+    TEXTURE = 5
+    ASSET   = 6
+
+    COUNT   = 7
+    NAMES   = ('resend', 'land', 'wind', 'cloud', 'task', 'texture', 'asset')
+
+# the rates, in bits per second, the viewer splits 1500 kbps into
+DEFAULT_RATES = (150000.0, 170000.0, 34000.0, 34000.0, 446000.0, 446000.0, 220000.0)
+
+# how many seconds worth of its rate a bucket can save up
+DEFAULT_BURST = 0.5
+
+# the Throttles variable of AgentThrottle, an F32 per category
+THROTTLES_FORMAT = struct.Struct('<%df' % (ThrottleCategory.COUNT))
+
+# the categories of the messages that don't go out as task traffic
+MESSAGE_CATEGORIES = {
+    'RequestImage':     ThrottleCategory.TEXTURE,
+    'TransferRequest':  ThrottleCategory.ASSET,
+    'TransferAbort':    ThrottleCategory.ASSET,
+    'AssetUploadRequest': ThrottleCategory.ASSET,
+    'SendXferPacket':   ThrottleCategory.ASSET,
+    'ConfirmXferPacket': ThrottleCategory.ASSET,
+    'RequestXfer':      ThrottleCategory.ASSET,
+    'AbortXfer':        ThrottleCategory.ASSET,
+    }
+
+class TokenBucket(object):
+    """ allows rate bytes per second on average, and bursts of up to
+        burst bytes
+
+    sends are charged once they are made, and may take the bucket below
+    zero, so the size of a packet doesn't need to be known up front. the
+    bucket is ready again once it has refilled past zero.
+    """
+
+    def __init__(self, rate, burst, clock):
+        self.clock = clock
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = clock()
+
+    def refill(self):
+
+        now = self.clock()
+        if now > self.last_refill:
+            self.tokens = min(self.tokens + (now - self.last_refill) * self.rate, self.burst)
+        self.last_refill = now
+
+    def ready(self):
+        """ returns True if something may be sent now """
+
+        self.refill()
+        return self.tokens > 0
+
+    def charge(self, size):
+        """ takes size bytes out of the bucket """
+
+        self.refill()
+        self.tokens -= size
+
+    def time_until_ready(self):
+        """ returns how many seconds until something may be sent, or None
+            if the bucket never refills """
+
+        self.refill()
+        if self.tokens > 0:
+            return 0.0
+        if self.rate <= 0:
+            return None
+        return -self.tokens / self.rate
+
+    def set_rate(self, rate, burst):
+
+        self.refill()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+class Throttle(object):
+    """ a token bucket per traffic category, limiting what a circuit sends
+
+    rates are in bits per second, as in AgentThrottle, and can be set
+    from or turned into the data of its Throttles variable. burst is how
+    many seconds worth of its rate each category can send at once.
+    clock returns the current time, and defaults to time.time
+    """
+
+    def __init__(self, rates = DEFAULT_RATES, burst = DEFAULT_BURST, clock = None):
+
+        if clock == None:
+            clock = time.time
+
+        self.clock = clock
+        self.burst = burst
+        self.rates = [0.0] * ThrottleCategory.COUNT
+        self.buckets = [TokenBucket(0.0, 0.0, clock) for category in range(ThrottleCategory.COUNT)]
+
+        self.set_rates(rates)
+
+        # start out able to send a full burst
+        for bucket in self.buckets:
+            bucket.tokens = bucket.burst
+
+    def set_rate(self, category, rate):
+        """ sets the rate of a category in bits per second """
+
+        self.rates[category] = float(rate)
+        self.buckets[category].set_rate(rate / 8.0, rate / 8.0 * self.burst)
+
+    def set_rates(self, rates):
+        """ sets the rates of all the categories from a sequence of bits
+            per second, in AgentThrottle order """
+
+        if len(rates) != ThrottleCategory.COUNT:
+            raise ValueError("expected %s throttle rates, got %s" % (ThrottleCategory.COUNT, len(rates)))
+
+        for category in range(ThrottleCategory.COUNT):
+            self.set_rate(category, rates[category])
+
+    def get_rates(self):
+
+        return list(self.rates)
+
+    def pack(self):
+        """ returns the rates as the data of AgentThrottle's Throttles """
+
+        return THROTTLES_FORMAT.pack(*self.rates)
+
+    def unpack(self, data):
+        """ sets the rates from the data of AgentThrottle's Throttles,
+            which may be followed by the null the serializer appends """
+
+        self.set_rates(THROTTLES_FORMAT.unpack_from(data))
+
+    def to_message(self, agent_id, session_id, circuit_code, gen_counter = 0):
+        """ returns an AgentThrottle asking for the same rates """
+
+        return Message('AgentThrottle',
+                       Block('AgentData',
+                             AgentID = agent_id,
+                             SessionID = session_id,
+                             CircuitCode = circuit_code),
+                       Block('Throttle',
+                             GenCounter = gen_counter,
+                             Throttles = self.pack()))
+
+    def get_category(self, message_name):
+        """ returns the category a message is sent in """
+
+        return MESSAGE_CATEGORIES.get(message_name, ThrottleCategory.TASK)
+
+    def ready(self, category):
+        """ returns True if the category has bandwidth left to send with """
+
+        return self.buckets[category].ready()
+
+    def time_until_ready(self, category):
+        """ returns how many seconds until the category may send again,
+            or None if it never will """
+
+        return self.buckets[category].time_until_ready()
+
+    def charge(self, category, size):
+        """ takes size bytes sent from the category's bandwidth """
+
+        self.buckets[category].charge(size)
@@ -0,0 +1,232 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+"""
+A hierarchical timer wheel. Timers are filed in slots by the tick they
+are due on, so scheduling and cancelling take constant time, and
+expire() only looks at the slots for the ticks that have passed rather
+than at every pending timer.
+
+Level 0 has one slot per tick. Each higher level has one slot per full
+turn of the level below it, and its timers are moved down a level when
+the wheel below wraps around.
+"""
+
+# standard python libs
+import math
+import time
+
+class Timer(object):
+    """ a timer scheduled on a TimerWheel """
+
+    def __init__(self, deadline, tick, item):
+        self.deadline = deadline
+        self.tick = tick
+        self.item = item
+        self.cancelled = False
+
+    def __repr__(self):
+        return 'Timer(%s, %s)' % (self.deadline, self.item)
+
+class TimerWheel(object):
+    """ schedules items to expire at a time
+
+    resolution is the length of a tick in seconds. deadlines are rounded
+    up to a tick, so timers never expire early. there are levels wheels
+    of 2 ** bits slots each. deadlines further away than the wheels span
+    are filed in the last slot and moved down once it is reached.
+
+    clock returns the current time, and defaults to time.time
+    """
+
+    def __init__(self, resolution = 0.01, bits = 8, levels = 4, clock = None):
+
+        if clock == None:
+            clock = time.time
+
+        self.clock = clock
+        self.resolution = resolution
+        self.bits = bits
+        self.levels = levels
+        self.mask = (1 << bits) - 1
+        self.span = 1 << (bits * levels)
+
+        self.wheels = [[[] for i in range(1 << bits)] for level in range(levels)]
+        self.due = []           # timers already due when scheduled
+        self.count = 0          # timers scheduled and not cancelled or expired
+
+        # the last tick expire() has handled
+        self.current = int(math.floor(self.clock() / self.resolution))
+
+    def __len__(self):
+        return self.count
+
+    def __tick(self, deadline):
+        return int(math.ceil(deadline / self.resolution))
+
+    def schedule(self, deadline, item):
+        """ schedules item to expire at deadline, returning its Timer """
+
+        timer = Timer(deadline, self.__tick(deadline), item)
+        self.__file(timer)
+        self.count += 1
+
+        return timer
+
+    def cancel(self, timer):
+        """ stops timer from expiring """
+
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.count -= 1
+
+    def __file(self, timer):
+        """ puts timer in the slot for its tick """
+
+        if timer.tick <= self.current:
+            self.due.append(timer)
+        else:
+            self.__file_ahead(timer)
+
+    def __file_ahead(self, timer):
+        """ puts timer in the slot for its tick, which is the current tick
+        or later """
+
+        if timer.tick - self.current >= self.span:
+            # out of range, park it in the slot furthest away
+            tick = self.current + self.span - 1
+        else:
+            tick = max(timer.tick, self.current)
+
+        delta = tick - self.current
+        level = 0
+        while delta >> (self.bits * (level + 1)):
+            level += 1
+
+        self.wheels[level][(tick >> (self.bits * level)) & self.mask].append(timer)
+
+    def __cascade(self, level):
+        """ moves the timers in the current slot of level down a level """
+
+        index = (self.current >> (self.bits * level)) & self.mask
+        timers = self.wheels[level][index]
+        self.wheels[level][index] = []
+
+        # what is due on the current tick lands in the level 0 slot that
+        # is expired next
+        for timer in timers:
+            if not timer.cancelled:
+                self.__file_ahead(timer)
+
+    def expire(self, now = None):
+        """ returns the items of the timers due at now, which defaults to
+        the clock's time """
+
+        if now == None:
+            now = self.clock()
+
+        # the last tick that has started by now
+        target = int(math.floor(now / self.resolution))
+
+        expired = []
+
+        if self.due:
+            expired.extend(self.due)
+            self.due = []
+
+        if self.count == 0 or target <= self.current:
+            self.current = max(self.current, target)
+            return self.__collect(expired)
+
+        wheel = self.wheels[0]
+
+        while self.current < target:
+
+            self.current += 1
+            index = self.current & self.mask
+
+            # at the start of each turn, bring down the timers of the
+            # levels above that are now in range
+            if index == 0:
+                level = 1
+                while level < self.levels:
+                    self.__cascade(level)
+                    if (self.current >> (self.bits * level)) & self.mask:
+                        break
+                    level += 1
+
+            if wheel[index]:
+                timers = wheel[index]
+                wheel[index] = []
+                expired.extend(timers)
+
+        return self.__collect(expired)
+
+    def next_deadline(self):
+        """ returns a time no later than the earliest deadline, or None
+        if nothing is scheduled. timers above the first level are only
+        known by their slot, so this can be early, but never late """
+
+        if self.count == 0:
+            return None
+
+        for timer in self.due:
+            if not timer.cancelled:
+                return timer.deadline
+
+        earliest = None
+
+        # a timer filed low a while ago can be due after one filed higher
+        # up since, so every level is looked at
+        for level in range(self.levels):
+            shift = self.bits * level
+            slots = self.wheels[level]
+            start = self.current >> shift
+
+            for step in range(1, (1 << self.bits) + 1):
+                tick = (start + step) << shift
+                if earliest != None and tick >= earliest:
+                    break
+                for timer in slots[(start + step) & self.mask]:
+                    if not timer.cancelled:
+                        earliest = tick
+                        break
+                if earliest == tick:
+                    break
+
+        if earliest == None:
+            return None
+
+        return earliest * self.resolution
+
+    def __collect(self, timers):
+
+        items = []
+
+        for timer in timers:
+            if timer.cancelled:
+                continue
+            if timer.tick > self.current:
+                # a parked timer that isn't due yet
+                self.__file(timer)
+                continue
+            timer.cancelled = True
+            self.count -= 1
+            items.append(timer.item)
+
+        return items
@@ -23,27 +23,37 @@ from logging import getLogger
 #pyogp libs
 from pyogp.lib.base.settings import Settings
 from pyogp.lib.base.message.message_handler import MessageHandler
-from template_dict import TemplateDictionary
+from template_dict import get_template_dict
 from template import MsgData, MsgBlockData, MsgVariableData
 from msgtypes import MsgType, MsgBlockType, MsgFrequency, PacketLayout, EndianType, PackFlags, sizeof
 from data_unpacker import DataUnpacker
-from message import Message
+from zerocode import zero_code_expand
+from message import Message, LazyMessage
 from pyogp.lib.base.message.message_dot_xml import MessageDotXML
 
 from pyogp.lib.base import exc
 
 logger = getLogger('message.udpdeserializer') 
 
+# flags, sequence number and extra header length
+PACKET_HEADER = struct.Struct('>BIB')
+
+# the packet ids of the appended acks, by ack count
+ACK_IDS = [struct.Struct('>%dI' % (count)) for count in range(256)]
+
 class UDPMessageDeserializer(object):
+    """ decodes UDP packets into Message instances
+
+    deserialize() keeps everything about the packet it is decoding in
+    locals, so one instance can be shared by many circuits, greenlets and
+    threads. the only state it touches are the compiled decoders cached on
+    the templates, which are built once and never change. """
 
     def __init__(self, message_handler = None, settings = None, message_template = None, message_xml = None):
 
-        self.context = None
         self.unpacker = DataUnpacker()
-        self.current_template = None
-        self.current_block = None
 
-        self.template_dict = TemplateDictionary(message_template = message_template)
+        self.template_dict = get_template_dict(message_template)
 
         # allow the settings to be passed in
         # otherwise, grab the defaults
@@ -65,329 +75,242 @@ class UDPMessageDeserializer(object):
         elif self.settings.HANDLE_PACKETS:
             self.message_handler = MessageHandler()
 
-    def deserialize(self, context):
+        # dispatch and the handled checks go by template id
+        if hasattr(self, 'message_handler'):
+            self.message_handler.bind(self.template_dict)
+
+    def deserialize(self, msg_buff, message_handler = None):
+
+        return self.__deserialize(msg_buff, {}, message_handler)
+
+    def deserialize_many(self, buffers, message_handler = None):
+        """ deserializes a burst of packets, returning a Message, or None,
+        for each buffer in order
+
+        message_handler, if given, is the handler the packets are decoded
+        for in place of our own, and must be bound to our template_dict
 
-        self.context = context
+        the udp, handler and logging checks are made once per template for
+        the whole burst rather than once per packet. a packet that cannot be
+        decoded is logged and returned as None rather than raising, so it
+        does not take the rest of the burst with it
+        """
 
-        #Must first strip off acks if present, and zero-decode, 
-        #if needed, in order to determine proper template
-        #once we can test again, do the commented out part below for the offset
+        plans = {}
+        deserialize = self.__deserialize
+        packets = []
+
+        for msg_buff in buffers:
+            try:
+                packets.append(deserialize(msg_buff, plans, message_handler))
+            except exc.MessageDeserializationError, error:
+                logger.warning("Error parsing packet due to: %s" % (error))
+                packets.append(None)
+
+        return packets
+
+    def read_acks(self, msg_buff):
+        """ returns the packet ids acked by the acks appended to a packet,
+        reading nothing but the flags byte and the tail of the buffer, so
+        it is cheap enough to run on packets that are not decoded """
 
-        temp_acks = []
-        msg_buff = self.context
         msg_len = len(msg_buff)
 
-        if ord(msg_buff[0]) & PackFlags.LL_ACK_FLAG:
-            num_acks = ord(msg_buff[msg_len-1])
-            #logger.debug("Decoding packet with acks: %d", num_acks)
-            ack_length = 1 + sizeof(MsgType.MVT_U32) * num_acks
-            temp_acks = msg_buff[-ack_length:]
-            msg_buff = msg_buff[:-ack_length]
-
-        #Now zero decode the entire msg except the acks, in order to get the correct evaluation of the template
-
-        if ord(msg_buff[0]) & PackFlags.LL_ZERO_CODE_FLAG:
-            '''
-            #offset = ord(msg_buff[5]) 
-            #header = msg_buff[:6+offset]   #offset will be zero unless the header has extra data
-            header = msg_buff[:6]
-            #inputbuf = msg_buff[6+offset:]  #not yet implemented because we can't test right now
-            inputbuf = msg_buff[6:]      
-            input_len = len(inputbuf)
-            msg_buff = self.zero_code_expand(inputbuf, input_len)
-            '''
-            offset = ord(msg_buff[5])
-            header = msg_buff[:6+offset]   #disregard#offset will be zero unless the header has extra data
-            #header = msg_buff[:6]
-            inputbuf = msg_buff[6+offset:]  #disregard#not yet implemented because we can't test right now
-            #inputbuf = msg_buff[6:]
-            # debugger code commented out 
-            #''.join( [ "%02X " % ord( x ) for x in byteStr ] ).strip() 
-            #print "just did zerodecode " + ''.join( [ "%02X " % ord( x ) for x in header ] ).strip() + ' ' \ 
-                        #+ ''.join( [ "%02X " % ord( x ) for x in msg_buff[:12] ] ).strip() 
-            input_len = len(inputbuf)
-            msg_buff = self.zero_code_expand(inputbuf, input_len)
-            msg_buff = header + msg_buff
-
-        if self.__validate_message(msg_buff) == True:
-
-            # go ahead an merge the acks back in in order for the decode to work
-            # or to get the send_flags for acks
-            msg_buff = msg_buff + ''.join(temp_acks)
-
-            # validate whether we are allowed to receive this message over udp
-            if not self.message_xml.validate_udp_msg(self.current_template.name):
-                logger.warning("Received '%s' over UDP, when it should come over the event queue. Discarding." % (self.current_template.name))
-                return None
+        if msg_len <= PacketLayout.PACKET_ID_LENGTH or \
+           not ord(msg_buff[0]) & PackFlags.LL_ACK_FLAG:
+            return []
 
-            # if the packet is being handled, or if have have disabled deferred packet parsing, handle it!
-            if self.message_handler.is_message_handled(self.current_template.name) or not self.settings.ENABLE_DEFERRED_PACKET_PARSING:
+        num_acks = ord(msg_buff[msg_len-1])
+        ack_pos = msg_len - 1 - num_acks * sizeof(MsgType.MVT_U32)
 
-                try:
-                    return self.__decode_data(msg_buff)
-                except exc.DataUnpackingError, error:
-                    #logger.warning("Error parsing packet due to: %s" % (error))
-                    raise exc.MessageDeserializationError(self.current_template.name, error)
-                    return None
+        if ack_pos < PacketLayout.PACKET_ID_LENGTH:
+            return []
 
-            else:
+        # acks are sent in network byte order
+        return list(ACK_IDS[num_acks].unpack_from(msg_buff, ack_pos))
 
-                if self.settings.LOG_VERBOSE \
-                and self.settings.ENABLE_UDP_LOGGING \
-                and self.settings.LOG_SKIPPED_PACKETS \
-                and not self.settings.PROXY_LOGGING:
-                    logger.debug('Received packet : %s (Skipping)' % (self.current_template.name))
+    def __plan(self, template, message_handler):
+        """ returns (decoder, log_skipped) for a template: the decoder to
+            read it with, or None if it is not being decoded, and whether
+            skipping it should be logged """
 
-        return None
+        # validate whether we are allowed to receive this message over udp
+        if not self.message_xml.validate_udp_msg(template.name):
+            logger.warning("Received '%s' over UDP, when it should come over the event queue. Discarding." % (template.name))
+            return None, False
 
-    def __validate_message(self, message_buffer):
-        """ Determines if the message follows a given template. """
-        if self.__decode_template(message_buffer) == True:
-            return True
+        if message_handler == None:
+            message_handler = self.message_handler
 
-        return False
+        handler = message_handler.get_handler_by_id(template.template_id)
 
-    def __decode_template(self, message_buffer):
-        """ Determines the template that the message in the buffer
-            appears to be using. """
-        if PacketLayout.PACKET_ID_LENGTH >= len(message_buffer):
-            raise exc.MessageDeserializationError("packet length", "template mismatch")
+        # if the packet is being handled, or if have have disabled deferred packet parsing, handle it!
+        if handler != None or not self.settings.ENABLE_DEFERRED_PACKET_PARSING:
 
-        header = message_buffer[PacketLayout.PACKET_ID_LENGTH:12]
-        self.current_template = self.__decode_header(header)
-        if self.current_template != None:
-            return True
+            fields = None
+            if handler != None:
+                fields = handler.fields
 
-        logger.info("Received unknown packet: '%s', packet is not in our message_template" % (header)) 
+            # the template's compiled decoder does the block and variable walk,
+            # reading only the fields subscribers asked for
+            return self.template_dict.get_decoder(template).project(fields), False
 
-        return False
-
-    def __decode_header(self, header):
-        frequency = self.__decode_frequency(header)
-        num = self.__decode_num(header)
-
-        result = self.template_dict.get_template_by_pair(frequency, num)
-
-        return result
-
-    def __decode_frequency(self, header):
-        #if it is not a high
-        if header[0] == '\xFF':
-            #if it is not a medium frequency message
-            if header[1] == '\xFF':
-                #if it is a Fixed frequency message
-                if header[2] == '\xFF':
-                    return 'Fixed'
-                #then it is low
-                else:
-                    return 'Low'
-            #then it is medium
-            else:
-                return 'Medium'
-        #then it is high
-        else:
-            return 'High'
+        log_skipped = self.settings.LOG_VERBOSE \
+                      and self.settings.ENABLE_UDP_LOGGING \
+                      and self.settings.LOG_SKIPPED_PACKETS \
+                      and not self.settings.PROXY_LOGGING
 
-        return None
+        return None, log_skipped
 
-    def __decode_num(self, header):
-        frequency = self.__decode_frequency(header)
+    def __deserialize(self, msg_buff, plans, message_handler = None):
+        """ deserializes one packet, reusing the plans already made for
+            the templates seen in the same burst """
 
-        if frequency == 'Low':
-            return struct.unpack('>H', header[2:4])[0] #int("0x"+ByteToHex(header[2:4]).replace(' ', ''),16)
+        msg_len = len(msg_buff)
+
+        if PacketLayout.PACKET_ID_LENGTH >= msg_len:
+            raise exc.MessageDeserializationError("packet length", "template mismatch")
 
-        elif frequency == 'Medium':
-            return struct.unpack('>B', header[1:2])[0] #int("0x"+ByteToHex(header[1:2]).replace(' ', ''),16)
+        #the acks and the zero coded body are located by offset, so that
+        #the buffer never has to be split up and joined back together
+        send_flags, packet_id, offset = PACKET_HEADER.unpack_from(msg_buff)
 
-        elif frequency == 'High':
-            return struct.unpack('>B', header[0])[0] #int("0x"+ByteToHex(header[0]), 16)  
+        body_end = msg_len
+        if send_flags & PackFlags.LL_ACK_FLAG:
+            num_acks = ord(msg_buff[msg_len-1])
+            #logger.debug("Decoding packet with acks: %d", num_acks)
+            body_end -= 1 + sizeof(MsgType.MVT_U32) * num_acks
 
-        elif frequency == 'Fixed':
-            return struct.unpack('>B', header[3:4])[0] #int("0x"+ByteToHex(header[0:4]).replace(' ', ''), 16)
+        #the message number starts after the header and any extra header data
+        data = msg_buff
+        decode_pos = PacketLayout.PACKET_ID_LENGTH + offset
 
-        else:
+        #Now zero decode the body, in order to get the correct evaluation of the template
+        if send_flags & PackFlags.LL_ZERO_CODE_FLAG:
+            data = zero_code_expand(msg_buff, decode_pos, body_end)
+            decode_pos = 0
+            body_end = len(data)
+
+        template = self.__decode_template(data, decode_pos)
+
+        if template == None:
             return None
 
-    def __decode_data(self, data):
-        if self.current_template == None:
-            raise exc.MessageTemplateNotFound("deserializing data")
+        try:
+            decoder, log_skipped = plans[template.template_id]
+        except KeyError:
+            decoder, log_skipped = plans[template.template_id] = self.__plan(template, message_handler)
 
-        msg_data = MsgData(self.current_template.name)
+        if decoder == None:
+            if log_skipped:
+                logger.debug('Received packet : %s (Skipping)' % (template.name))
+            return None
 
-        packet = Message(msg_data)
-        msg_size = len(data)
+        try:
+            packet = self.__decode_data(template, decoder, data, decode_pos, body_end)
+            if packet != None:
+                packet.send_flags = send_flags
+                packet.packet_id = packet_id
+                self.__decode_flags(packet, msg_buff, msg_len)
+            return packet
+        except exc.DataUnpackingError, error:
+            #logger.warning("Error parsing packet due to: %s" % (error))
+            raise exc.MessageDeserializationError(template.name, error)
+
+    def __decode_template(self, message_buffer, decode_pos):
+        """ Determines the template that the message in the buffer
+            appears to be using, or None if it is unknown. """
+        if decode_pos >= len(message_buffer):
+            raise exc.MessageDeserializationError("packet length", "template mismatch")
 
-        packet.name = self.current_template.name
+        template = self.template_dict.get_template_by_header(message_buffer, decode_pos)
+        if template != None:
+            return template
 
-        #determine packet flags
-        packet.send_flags = ord(data[0])
-        packet.packet_id = self.unpacker.unpack_data(data, MsgType.MVT_U32, 1, endian_type=EndianType.BIG)
+        header = message_buffer[decode_pos:decode_pos+4]
+        logger.info("Received unknown packet: '%s', packet is not in our message_template" % (header)) 
 
-        ##Zero code flag
-        #if packet.send_flags & PackFlags.LL_ZERO_CODE_FLAG:
-            #header = data[0:PacketLayout.PACKET_ID_LENGTH-1]
-            #inputbuf = data[PacketLayout.PACKET_ID_LENGTH-1:]
-            #input_len = len(inputbuf)
-            #data = self.zero_code_expand(inputbuf, input_len)
-            #data = header + data 
+        return None
+
+    def __decode_flags(self, packet, msg_buff, msg_len):
+        """ applies the packet flags, reading appended acks from the tail
+            of the original buffer """
 
         #ACK_FLAG - means the incoming packet is acking some old packets of ours
         if packet.send_flags & PackFlags.LL_ACK_FLAG:
-            msg_size -= 1
-            acks = self.unpacker.unpack_data(data, MsgType.MVT_U8, msg_size)
-            ack_start = acks * sizeof(MsgType.MVT_U32)
-            ack_data = data[msg_size-ack_start:]
-            ack_pos = 0
-            while acks > 0:
-                ack_packet_id = self.unpacker.unpack_data(ack_data, MsgType.MVT_U32, \
-                                                          start_index=ack_pos)
-                ack_pos += sizeof(MsgType.MVT_U32)
+            for ack_packet_id in self.read_acks(msg_buff):
                 packet.add_ack(ack_packet_id)
-                acks -= 1
 
         #RELIABLE - means the message wants to be acked by us
         if packet.send_flags & PackFlags.LL_RELIABLE_FLAG:
             packet.reliable = True
 
         #RESENT   - packet that wasn't previously acked was resent
+        #duplicates are dropped by the dispatcher before they get here
         if packet.send_flags & PackFlags.LL_RESENT_FLAG:
-            #check if its a duplicate and the sender messed up somewhere
-                #case - ack we sent wasn't received by the sender
-            pass
+            packet.resent = True
+
+    def __decode_data(self, template, decoder, data, decode_pos, data_len):
+        """ decodes the message body, which starts with the message number
+            at decode_pos and ends at data_len, with the template's decoder
+            or a projection of it """
 
-        #at the offset position, the messages stores the offset to where the
-        #payload begins (may be extra header information)
-        #print "Decoding offset"
-        offset = self.unpacker.unpack_data(data, MsgType.MVT_U8, PacketLayout.PHL_OFFSET)
+        if template == None:
+            raise exc.MessageTemplateNotFound("deserializing data")
 
-        freq_bytes = self.current_template.frequency
+        freq_bytes = template.frequency
         #HACK: fixed case
         if freq_bytes == -1:
             freq_bytes = 4
 
-        decode_pos = PacketLayout.PACKET_ID_LENGTH + \
-                   freq_bytes + \
-                   offset
-
-        for block in self.current_template.blocks:
-            repeat_count = 0
-
-            if block.block_type == MsgBlockType.MBT_SINGLE:
-                repeat_count = 1
-            elif block.block_type == MsgBlockType.MBT_MULTIPLE:
-                repeat_count = block.number
-
-            elif block.block_type == MsgBlockType.MBT_VARIABLE:
-                #if the block type is VARIABLE, then the current position
-                #will be the repeat count written in
-                #print "Reading VARIABLE block repeat count" 
-                repeat_count = self.unpacker.unpack_data(data, \
-                                                         MsgType.MVT_U8, \
-                                                         decode_pos)
-
-                decode_pos += 1
-            # ToDo: we need to allow the system to parse as much as it knows about 
-            # and to return what is can, not return None
-            else:
-                logger.warning("ERROR: Unknown block type: %s in %s packet." % (str(block.block_type), packet.name))
+        decode_pos += freq_bytes
+
+        lazy = self.settings.ENABLE_LAZY_PACKET_DECODING or self.settings.ENABLE_COLUMNAR_BLOCKS
+
+        # a receive buffer is reused for later packets. a lazy message reads
+        # its blocks later, and the views of ENABLE_ZERO_COPY_PAYLOADS point
+        # into the packet, so those keep a copy of it. otherwise the decoder
+        # copies each value out of the buffer as it reads it
+        if isinstance(data, memoryview) and \
+           (lazy or self.settings.ENABLE_ZERO_COPY_PAYLOADS):
+            data = data.tobytes()
+
+        if lazy:
+
+            # only locate the blocks now, they are decoded on first access
+            offsets = decoder.scan(data, decode_pos, data_len)
+            if offsets == None:
+                return None
+
+            view = None
+            if self.settings.ENABLE_ZERO_COPY_PAYLOADS:
+                view = memoryview(data)
+
+            # blocks can also be read as numpy columns with get_columns()
+            columnar_decoder = None
+            if self.settings.ENABLE_COLUMNAR_BLOCKS:
+                columnar_decoder = self.template_dict.get_columnar_decoder(template)
+
+            packet = LazyMessage(template.name, data, data_len, offsets, view, columnar_decoder)
+
+        else:
+
+            packet = Message(template.name)
+
+            if not decoder.decode(data, decode_pos, packet, data_len, 
+                                  views = self.settings.ENABLE_ZERO_COPY_PAYLOADS):
                 return None
 
-            for i in range(repeat_count):
-                block_data = MsgBlockData(block.name)
-                block_data.block_number = i
-                self.current_block = block_data
-
-                msg_data.add_block(self.current_block)
-
-                for variable in block.variables:
-
-                    var_size = variable.size
-                    if variable.type == MsgType.MVT_VARIABLE:
-                        #this isn't the size of the data, but the max bytes
-                        #the data can be
-                        #need to copy because we have to advance our decode_pos
-                        #afterwards
-                        data_size = var_size
-                        #HACK: this is a slow procedure, should passed in
-                        templen = len(data)
-                        if (decode_pos + data_size) > templen:
-                            logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + var_size), str(len(data)), packet.name))
-                            return None
-                        if data_size == 1:
-                            #print "Reading VARIABLE variable size 1 byte"
-                            var_size = self.unpacker.unpack_data(data, \
-                                                                 MsgType.MVT_U8, \
-                                                                 decode_pos)
-                        elif data_size == 2:
-                            #print "Reading VARIABLE variable size 2 bytes" 
-                            var_size = self.unpacker.unpack_data(data, \
-                                                                 MsgType.MVT_U16, \
-                                                                 decode_pos)
-                        elif data_size == 4:
-                            #print "Reading VARIABLE variable size 4 bytes"
-                            var_size = self.unpacker.unpack_data(data, \
-                                                                 MsgType.MVT_U32, \
-                                                                 decode_pos)
-
-                        else:
-                            raise exc.MessageDeserializationError("variable", "unknown data size")
-
-                        decode_pos += data_size
-
-                    #HACK: this is a slow procedure, should passed in
-                    if (decode_pos + var_size) > len(data):
-                        print var_size
-                        logger.warning("ERROR: trying to read %s from a buffer of len %s in %s" % (str(decode_pos + var_size), str(len(data)), packet.name))
-                        return None
-                    try:
-                        unpacked_data = self.unpacker.unpack_data(data, \
-                                                                variable.type, \
-                                                                decode_pos, \
-                                                                var_size=var_size)
-                    except Exception, e:
-                        logger.error("Problem parsing data in %s for %s:%s. Parameters were: Len(data):%s Type:%s decode_pos:%s var_size:%s" % (packet.name, block.name, variable.name, len(data), variable.type, decode_pos, var_size))
-                        raise
-                    #HACK 2: some unpacked_data of type variable needs to treated as binary instead of as string  
-                    if variable.type == MsgType.MVT_VARIABLE and variable.name != 'Data':
-                        unpacked_data = unpacked_data.rstrip('\x00')
-                    var_data = MsgVariableData(variable.name, unpacked_data, variable.type)
-                    self.current_block.add_variable(var_data)
-                    decode_pos += var_size
-
-
-        if len(msg_data.blocks) <= 0 and len(self.current_template.blocks) > 0:
+        if len(packet.blocks) <= 0 and len(template.blocks) > 0 and decoder.fields == None:
             raise exc.MessageDeserializationError("message", "message is empty")
 
-        packet.blocks = msg_data.blocks
+        packet.template_id = template.template_id
+
         return packet
 
     def zero_code_expand(self, msg_buf, msg_size):
-        """made this call more generic due to changes in how zero_code_expand is called. 
-        no more header issues in actual call. Its taken care of earlier in process""" 
-        #if ord(msg_buf[0]) & PackFlags.LL_ZERO_CODE_FLAG == 0:
-            #return msg_buf
-
-        #header = msg_buf[0:PacketLayout.PACKET_ID_LENGTH]
-        #inputbuf = msg_buf[PacketLayout.PACKET_ID_LENGTH:]
-        inputbuf = msg_buf[:]
-        newstring = ""
-        in_zero = False
-        for c in inputbuf:
-            if c != '\0':
-                if in_zero == True:
-                    zero_count = ord(c)
-                    zero_count = zero_count -1
-                    while zero_count>0:
-                        newstring = newstring + '\x00'
-                        zero_count = zero_count -1
-                    in_zero = False
-                else:
-                    newstring = newstring + c
-            else:
-                newstring = newstring + c
-                in_zero = True
-        #return header + newstring
-        return newstring
-
+        """ zero decodes the first msg_size bytes of msg_buf
 
+        kept for callers of the old method, see zerocode.zero_code_expand """
 
+        return zero_code_expand(msg_buf, 0, msg_size)
@@ -19,13 +19,16 @@ $/LicenseInfo$
 # standard python libs
 from logging import getLogger
 import traceback
+import time
 #from msgtypes import *
 
 # pyogp
-from circuit import CircuitManager
+from circuit import CircuitManager, Host
+from timer_wheel import TimerWheel
+from throttle import ThrottleCategory
 from msgtypes import MsgType, MsgBlockType, MsgFrequency, PacketLayout, EndianType, PackFlags, sizeof
-from udpserializer import UDPMessageSerializer
-from udpdeserializer import UDPMessageDeserializer
+from udpserializer import UDPMessageSerializer, MAX_PACKET_ACK_IDS
+from udpdeserializer import UDPMessageDeserializer, PACKET_HEADER
 from data_unpacker import DataUnpacker
 from message import Message, Block
 from pyogp.lib.base.message.message_dot_xml import MessageDotXML
@@ -38,18 +41,42 @@ from pyogp.lib.base.helpers import Helpers
 # initialize logging
 logger = getLogger('message.udpdispatcher')
 
+# the size of the pooled send buffers, an ethernet MTU. bigger packets
+# are serialized into strings instead
+SEND_BUFFER_SIZE = 1500
+# how many idle send buffers are kept for reuse
+SEND_BUFFER_POOL_SIZE = 8
+
 #maybe make a global utility
 class UDPDispatcher(object):
     #implements(IUDPDispatcher)
 
-    def __init__(self, udp_client = None, settings = None, message_handler = None, message_template = None, message_xml = None):
+    def __init__(self, udp_client = None, settings = None, message_handler = None, message_template = None, message_xml = None, clock = None):
         #holds the details of the message, or how the messages should be sent,
         #built, and read
 
         self.packets_in = 0
         self.packets_out = 0
+        self.packets_resent = 0 # reliable packets sent again, unacked
+        self.acks_out = 0       # acks sent in PacketAcks
+
+        # acks read from packets that weren't decoded, and how many of
+        # those cleared a packet that would otherwise have been resent
+        self.skipped_acks_in = 0
+        self.retransmits_avoided = 0
+
+        # packets dropped without decoding, as we already received them
+        self.duplicates_in = 0
+
+        # the time source for retransmission timeouts, time.time by default
+        if clock == None:
+            clock = time.time
+        self.clock = clock
+
+        self.circuit_manager = CircuitManager(clock = self.clock)
 
-        self.circuit_manager = CircuitManager()
+        # the retransmission timeouts of the reliable packets of every circuit
+        self.retransmit_timers = TimerWheel(clock = self.clock)
         self.data_unpacker = DataUnpacker()
 
         #the ID of the packet we most recently received
@@ -71,6 +98,9 @@ class UDPDispatcher(object):
         else:
             self.settings = Settings()
 
+        if self.settings.UDP_RECEIVE_BUFFER_SIZE != None:
+            self.udp_client.set_receive_buffer(self.socket, self.settings.UDP_RECEIVE_BUFFER_SIZE)
+
         # allow the passing in of message_template.xml as a file handle
         if not message_template:
             self.message_template = None
@@ -103,6 +133,10 @@ class UDPDispatcher(object):
                                                         message_template = self.message_template)
         self.udp_serializer = UDPMessageSerializer(message_template = self.message_template)
 
+        # reusable buffers for ENABLE_POOLED_SEND_BUFFERS. sending can yield
+        # to other greenlets, so each send takes its own buffer from the pool
+        self.send_buffers = []
+
     def find_circuit(self, host):
         circuit = self.circuit_manager.get_circuit(host)
         if circuit == None:
@@ -112,6 +146,44 @@ class UDPDispatcher(object):
 
         return circuit
 
+    def subscribe(self, host, message_handler):
+        """ hands the packets received from host to message_handler,
+        rather than our own, so that one dispatcher and its socket can
+        serve the circuits of many agents. returns host's circuit """
+
+        if message_handler != None:
+            message_handler.bind(self.udp_deserializer.template_dict)
+
+        circuit = self.find_circuit(host)
+        circuit.message_handler = message_handler
+
+        return circuit
+
+    def __get_message_handler(self, circuit):
+        """ returns the handler subscribed to the circuit, or our own """
+
+        if circuit.message_handler != None:
+            return circuit.message_handler
+
+        return self.message_handler
+
+    def unsubscribe(self, host):
+        """ closes host's circuit, dropping the packets still waiting
+        to be acked by it """
+
+        circuit = self.circuit_manager.get_circuit(host)
+        if circuit == None:
+            return
+
+        # their retransmission timers find them gone, and are dropped
+        circuit.unacked_packets.clear()
+        circuit.unack_packet_count = 0
+        circuit.unack_packet_bytes = 0
+        circuit.is_alive = False
+        self.__forget_circuit_if_acked(circuit)
+
+        self.circuit_manager.remove_circuit_data(host)
+
     def receive_check(self, host, msg_buf, msg_size):
         #determine if we have any messages that can be received through UDP
         #also, check and decode the message we have received
@@ -128,45 +200,181 @@ class UDPDispatcher(object):
                 raise exc.CircuitNotFound(host, 'preparing to check for packets')
 
             self.packets_in += 1
+            circuit.packets_in += 1
+            circuit.bytes_in += msg_size
+
+            if self.__is_duplicate(circuit, msg_buf):
+                return None
 
-            recv_packet = self.udp_deserializer.deserialize(msg_buf)
+            recv_packet = self.udp_deserializer.deserialize(msg_buf, circuit.message_handler)
 
-            #couldn't deserialize
-            if recv_packet == None:
+            recv_packet = self.__receive(host, circuit, msg_buf, recv_packet, self.__receive_logging())
 
-                # if its sent as reliable, we should ack it even if we aren't going to parse it
-                # since we can skip parsing the packet in self.udp_deserializer
+        return recv_packet
 
-                # this indicate reliable
-                send_flags = ord(msg_buf[0])
-                packet_id = self.data_unpacker.unpack_data(msg_buf, MsgType.MVT_U32, 1, endian_type=EndianType.BIG)
+    def receive_batch(self, host_buffer_pairs):
+        """ receives a burst of (host, msg_buf) pairs drained from the socket
 
-                # queue the ack up
-                circuit.collect_ack(packet_id)
+        the packets are deserialized together, and the circuit lookups and
+        logging decisions are made once per burst. returns the packets that
+        were received, in order, leaving out the ones receive_check() would
+        have returned None for.
+        """
 
-                return None
+        circuits = {}
+        pairs = []
+
+        for host, msg_buf in host_buffer_pairs:
+
+            if len(msg_buf) <= 0:
+                continue
+
+            key = (host.ip, host.port)
+            circuit = circuits.get(key)
+            if circuit == None:
+                circuit = self.find_circuit(host)
+                if circuit == None:
+                    raise exc.CircuitNotFound(host, 'preparing to check for packets')
+                circuits[key] = circuit
+
+            self.packets_in += 1
+            circuit.packets_in += 1
+            circuit.bytes_in += len(msg_buf)
+
+            if self.__is_duplicate(circuit, msg_buf):
+                continue
+
+            pairs.append((host, circuit, msg_buf))
+
+        # the packets are decoded for the handler subscribed to their
+        # circuit, a burst per handler
+        groups = {}
+        for index in range(len(pairs)):
+            groups.setdefault(pairs[index][1].message_handler, []).append(index)
+
+        if len(groups) == 1:
+            packets = self.udp_deserializer.deserialize_many([msg_buf for host, circuit, msg_buf in pairs],
+                                                             groups.keys()[0])
+        else:
+            packets = [None] * len(pairs)
+            for message_handler, indices in groups.items():
+                decoded = self.udp_deserializer.deserialize_many([pairs[index][2] for index in indices],
+                                                                 message_handler)
+                for index, recv_packet in zip(indices, decoded):
+                    packets[index] = recv_packet
 
-            #Case - trusted packets can only come in over trusted circuits
-            if circuit.is_trusted and \
-                recv_packet.trusted == False:
+        logging = self.__receive_logging()
+        received = []
+
+        for (host, circuit, msg_buf), recv_packet in zip(pairs, packets):
+
+            recv_packet = self.__receive(host, circuit, msg_buf, recv_packet, logging)
+
+            if recv_packet != None:
+                received.append(recv_packet)
+
+        return received
+
+    def receive_views(self, view_addr_pairs):
+        """ receives a burst of (msg_buf, addr) pairs, as receive_batch()
+        does. msg_buf may be a memoryview into the buffers of a receive ring
+
+        the views are only read while this runs, whatever a message keeps
+        of its packet is copied by the deserializer. the circuit's Host is
+        reused for packets from a known address.
+        """
+
+        circuit_map = self.circuit_manager.circuit_map
+        pairs = []
+
+        for view, addr in view_addr_pairs:
+            circuit = circuit_map.get(addr)
+            if circuit != None:
+                pairs.append((circuit.host, view))
+            else:
+                pairs.append((Host(addr), view))
+
+        return self.receive_batch(pairs)
+
+    def __is_duplicate(self, circuit, msg_buf):
+        """ checks the packet id in the header against the ids the circuit
+            has already received. duplicates are acked again, as the sender
+            evidently missed our ack, and dropped without being decoded """
+
+        if len(msg_buf) <= PacketLayout.PACKET_ID_LENGTH:
+            return False
+
+        send_flags, packet_id, offset = PACKET_HEADER.unpack_from(msg_buf)
+
+        if not circuit.track_packet_in(packet_id):
+            return False
+
+        self.duplicates_in += 1
+
+        if send_flags & PackFlags.LL_RELIABLE_FLAG:
+            circuit.collect_ack(packet_id)
+
+        if self.settings.LOG_VERBOSE and self.settings.ENABLE_UDP_LOGGING:
+            logger.debug('Received duplicate packet (%s) from %s, dropping it' % (packet_id, circuit.host))
+
+        return True
+
+    def __receive_logging(self):
+        """ returns (log, log_bytes, log_host) for received packets """
+
+        return (self.settings.ENABLE_UDP_LOGGING and not self.settings.PROXY_LOGGING,
+                self.settings.ENABLE_BYTES_TO_HEX_LOGGING,
+                self.settings.ENABLE_HOST_LOGGING)
+
+    def __receive(self, host, circuit, msg_buf, recv_packet, logging):
+        """ acks, logs and hands a deserialized packet to the message handler """
+
+        #couldn't deserialize
+        if recv_packet == None:
+
+            # the acks appended to the packet still count, read them without
+            # decoding it so our reliable packets aren't resent needlessly
+            acks = self.udp_deserializer.read_acks(msg_buf)
+            if acks:
+                self.skipped_acks_in += len(acks)
+                self.retransmits_avoided += circuit.handle_acks(acks)
+
+            # if its sent as reliable, we should ack it even if we aren't going to parse it
+            # since we can skip parsing the packet in self.udp_deserializer
+            if len(msg_buf) <= PacketLayout.PACKET_ID_LENGTH:
                 return None
 
-            circuit.handle_packet(recv_packet)
+            # this indicate reliable
+            send_flags = ord(msg_buf[0])
+            packet_id = self.data_unpacker.unpack_data_from(msg_buf, MsgType.MVT_U32, 1, endian_type=EndianType.BIG)
 
-            if self.settings.ENABLE_UDP_LOGGING:
-                if self.settings.ENABLE_BYTES_TO_HEX_LOGGING:
-                    hex_string = '<=>' + self.helpers.bytes_to_hex(msg_buf)
-                else:
-                    hex_string = ''
-                if self.settings.ENABLE_HOST_LOGGING:
-                    host_string = ' (%s)' % (host)
-                else:
-                    host_string = ''
-                if not self.settings.PROXY_LOGGING:
-                    logger.debug('Received packet%s : %s (%s)%s' % (host_string, recv_packet.name, recv_packet.packet_id, hex_string))
+            # queue the ack up
+            circuit.collect_ack(packet_id)
+
+            return None
+
+        #Case - trusted packets can only come in over trusted circuits
+        if circuit.is_trusted and \
+            recv_packet.trusted == False:
+            return None
 
-            if self.settings.HANDLE_PACKETS:
-                self.message_handler.handle(recv_packet)
+        circuit.handle_packet(recv_packet)
+
+        log, log_bytes, log_host = logging
+
+        if log:
+            if log_bytes:
+                hex_string = '<=>' + self.helpers.bytes_to_hex(msg_buf)
+            else:
+                hex_string = ''
+            if log_host:
+                host_string = ' (%s)' % (host)
+            else:
+                host_string = ''
+            logger.debug('Received packet%s : %s (%s)%s' % (host_string, recv_packet.name, recv_packet.packet_id, hex_string))
+
+        if self.settings.HANDLE_PACKETS:
+            self.__get_message_handler(circuit).handle(recv_packet)
 
         return recv_packet
 
@@ -179,7 +387,7 @@ class UDPDispatcher(object):
     def send_retry(self, message, host):
         """ This is a retry because we didn't get acked """
         #sets up the message so send_message will add the RETRY flag to it
-        return self.__send_message(host, message, retrying=True)                
+        return self.__send_message(message, host, retrying=True)
 
     def send_message(self, message, host):
         return self.__send_message(message, host)
@@ -195,25 +403,31 @@ class UDPDispatcher(object):
         else:
             packet = message()
 
-        # enable monitoring of outgoing packets
-        if self.settings.HANDLE_OUTGOING_PACKETS:
-            self.message_handler.handle(packet)
-
         #use circuit manager to get the circuit to send on
         circuit = self.find_circuit(host)
 
+        # enable monitoring of outgoing packets
+        if self.settings.HANDLE_OUTGOING_PACKETS:
+            self.__get_message_handler(circuit).handle(packet)
+
         if reliable == True:
             circuit.prepare_packet(packet, PackFlags.LL_RELIABLE_FLAG, retries)
-            if circuit.unack_packet_count <= 0:
-                self.circuit_manager.unacked_circuits[host] = circuit
+            self.circuit_manager.unacked_circuits[(host.ip, host.port)] = circuit
         elif retrying == True:
             circuit.prepare_packet(packet, PackFlags.LL_RESENT_FLAG)
         else:
             circuit.prepare_packet(packet)
 
+        if self.settings.ENABLE_POOLED_SEND_BUFFERS:
+            return self.__send_pooled(packet, host, circuit)
+
         try:
             send_buffer = self.udp_serializer.serialize(packet)
 
+            if send_buffer == None:
+                self.__drop_unsent(circuit, packet)
+                return
+
             if self.settings.ENABLE_UDP_LOGGING:
                 if packet.name in self.settings.UDP_SPAMMERS and self.settings.DISABLE_SPAMMERS:
                     pass
@@ -228,22 +442,108 @@ class UDPDispatcher(object):
                         host_string = ''
                     logger.debug('Sent packet    %s : %s (%s)%s' % (host_string, packet.name, packet.packet_id, hex_string))
 
+            if reliable == True:
+                self.__keep_for_resend(circuit, packet, send_buffer, host)
+
             #TODO: remove this when testing a network
             self.udp_client.send_packet(self.socket, send_buffer, host)
 
             self.packets_out += 1
+            circuit.packets_out += 1
+            circuit.bytes_out += len(send_buffer)
+
+            if self.settings.ENABLE_THROTTLES:
+                circuit.throttle.charge(circuit.throttle.get_category(packet.name), len(send_buffer))
+
+            #the acks the serializer appended don't need a PacketAck
+            if len(packet.acks) > 0:
+                circuit.acks_out += len(packet.acks)
+                circuit.acks_sent(packet.acks)
 
             return send_buffer
 
         except AssertionError:
-            pass
+            self.__drop_unsent(circuit, packet)
 
         except Exception, error:
             logger.warning("Error trying to serialize the following packet: %s" % (packet))
             traceback.print_exc()
+            self.__drop_unsent(circuit, packet)
 
             return
 
+    def __send_pooled(self, packet, host, circuit):
+        """ serializes packet into a buffer from the pool and sends it,
+        returning the number of bytes sent """
+
+        if self.send_buffers:
+            send_buffer = self.send_buffers.pop()
+        else:
+            send_buffer = bytearray(SEND_BUFFER_SIZE)
+
+        try:
+            try:
+                size = self.udp_serializer.serialize_into(packet, send_buffer)
+                data = send_buffer
+            except exc.MessageSerializationError:
+                # too big for a pooled buffer, or not serializable at all,
+                # in which case serialize() raises the error again
+                data = self.udp_serializer.serialize(packet)
+                size = data and len(data)
+
+            if size == None:
+                self.__drop_unsent(circuit, packet)
+                return
+
+            view = memoryview(data)[:size]
+
+            if self.settings.ENABLE_UDP_LOGGING:
+                if packet.name in self.settings.UDP_SPAMMERS and self.settings.DISABLE_SPAMMERS:
+                    pass
+                else:
+                    if self.settings.ENABLE_BYTES_TO_HEX_LOGGING:
+                        hex_string = '<=>' + self.helpers.bytes_to_hex(view.tobytes())
+                    else:
+                        hex_string = ''
+                    if self.settings.ENABLE_HOST_LOGGING:
+                        host_string = ' (%s)' % (host)
+                    else:
+                        host_string = ''
+                    logger.debug('Sent packet    %s : %s (%s)%s' % (host_string, packet.name, packet.packet_id, hex_string))
+
+            if packet.send_flags & PackFlags.LL_RELIABLE_FLAG:
+                self.__keep_for_resend(circuit, packet, view, host)
+
+            self.udp_client.send_packet(self.socket, view, host)
+
+            self.packets_out += 1
+            circuit.packets_out += 1
+            circuit.bytes_out += size
+
+            if self.settings.ENABLE_THROTTLES:
+                circuit.throttle.charge(circuit.throttle.get_category(packet.name), size)
+
+            #the acks the serializer appended don't need a PacketAck
+            if len(packet.acks) > 0:
+                circuit.acks_out += len(packet.acks)
+                circuit.acks_sent(packet.acks)
+
+            return size
+
+        except AssertionError:
+            self.__drop_unsent(circuit, packet)
+
+        except Exception, error:
+            logger.warning("Error trying to serialize the following packet: %s" % (packet))
+            traceback.print_exc()
+            self.__drop_unsent(circuit, packet)
+
+            return
+
+        finally:
+            if len(self.send_buffers) < SEND_BUFFER_POOL_SIZE:
+                self.send_buffers.append(send_buffer)
+
     def process_acks(self):
         """ resends all of our messages that were unacked, and acks all
             the messages that others are waiting to be acked. """
@@ -253,66 +553,177 @@ class UDPDispatcher(object):
         #send the acks we didn't reply to
         self.__send_acks()
 
+    def __keep_for_resend(self, circuit, packet, data, host):
+        """ keeps the bytes of a reliable packet to retransmit them as is,
+            and schedules its retransmission timeout """
+
+        packet.buffer = bytearray(data)
+        packet.host = host
+        circuit.unack_packet_bytes += len(packet.buffer)
+
+        packet.sent_time = self.clock()
+        packet.expiration_time = packet.sent_time + circuit.rto
+        self.retransmit_timers.schedule(packet.expiration_time, (circuit, packet))
+
     def __resend_all_unacked(self):
-        """ Resends all packets sent that haven't yet been acked. """
-        #now_time = get_time_now()
+        """ Resends the packets sent that haven't been acked within their
+            circuit's retransmission timeout, from the bytes kept when they
+            were first sent. """
+
+        now = self.clock()
+        backed_off = set()
+
+        for circuit, packet in self.retransmit_timers.expire(now):
+
+            #acked since its timeout was scheduled
+            if circuit.unacked_packets.get(packet.packet_id) is not packet:
+                self.__forget_circuit_if_acked(circuit)
+                continue
 
-        #go through all circuits in the map
-        for circuit in self.circuit_manager.unacked_circuits.values():
+            #out of resend bandwidth, try again once it has refilled
+            if self.settings.ENABLE_THROTTLES and \
+               not circuit.throttle.ready(ThrottleCategory.RESEND):
+                wait = circuit.throttle.time_until_ready(ThrottleCategory.RESEND)
+                if wait == None:
+                    wait = circuit.rto
+                self.retransmit_timers.schedule(now + wait, (circuit, packet))
+                continue
 
-            for unacked_packet in circuit.unacked_packets.values():
+            #back off once for a burst of timeouts on a circuit
+            if circuit not in backed_off:
+                circuit.back_off()
+                backed_off.add(circuit)
 
-                unacked_packet.retries -= 1
-                #is this correct? should it be serialized or something?
-                #self.reset_send_buffer()
+            packet.retries -= 1
+            packet.resent = True
 
-                self.send_buffer = ''
-                self.send_buffer += unacked_packet.buffer
-                self.send_retry(unacked_packet.host, unacked_packet.buffer)
+            self.__resend(circuit, packet)
 
-                if unacked_packet.retries <= 0:
+            if packet.retries <= 0:
 
-                    circuit.final_retry_packets[unacked_packet.packet_id] = unacked_packet
-                    del circuit.unacked_packets[unacked_packet.packet_id]
+                circuit.final_retry_packets[packet.packet_id] = packet
+                del circuit.unacked_packets[packet.packet_id]
+                circuit.unack_packet_count -= 1
+                circuit.unack_packet_bytes -= len(packet.buffer)
+                circuit.final_packet_count += 1
+                self.__forget_circuit_if_acked(circuit)
+
+            else:
+
+                packet.expiration_time = now + circuit.rto
+                self.retransmit_timers.schedule(packet.expiration_time, (circuit, packet))
 
             #final retries aren't resent, they are just forgotten about. boo
-            #for unacked_packet in circuit.final_retry_packets.values():
-            #    if now_time > unacked_packet.expiration_time:
-            #        del circuit.final_retry_packets[unacked_packet.packet_id] 
+
+    def __drop_unsent(self, circuit, packet):
+        """ takes a reliable packet that failed to serialize or send back
+            off its circuit, as there is nothing to wait for an ack of """
+
+        if packet.send_flags & PackFlags.LL_RELIABLE_FLAG:
+            circuit.remove_reliable_packet(packet)
+            self.__forget_circuit_if_acked(circuit)
+
+    def __forget_circuit_if_acked(self, circuit):
+
+        if len(circuit.unacked_packets) == 0:
+            key = (circuit.host.ip, circuit.host.port)
+            if self.circuit_manager.unacked_circuits.get(key) is circuit:
+                del self.circuit_manager.unacked_circuits[key]
+
+    def __resend(self, circuit, packet):
+        """ sends a reliable packet again, flagged as resent. the packet id
+            stays the same so the ack for either copy clears it """
+
+        if packet.buffer == None:
+            return
+
+        packet.buffer[0] |= PackFlags.LL_RESENT_FLAG
+
+        self.udp_client.send_packet(self.socket, packet.buffer, packet.host)
+
+        self.packets_out += 1
+        self.packets_resent += 1
+        circuit.packets_out += 1
+        circuit.bytes_out += len(packet.buffer)
+        circuit.packets_resent += 1
+
+        if self.settings.ENABLE_THROTTLES:
+            circuit.throttle.charge(ThrottleCategory.RESEND, len(packet.buffer))
+
+        if self.settings.ENABLE_UDP_LOGGING and self.settings.LOG_VERBOSE:
+            logger.debug('Resent packet  (%s) : %s (%s)' % (packet.host, packet.name, packet.packet_id))
 
     def __send_acks(self):
-        """ Acks all packets received that we haven't acked yet. """
+        """ Acks the packets received that we haven't acked yet, on the
+            circuits where the oldest ack has waited ACK_FLUSH_DELAY or
+            ACK_FLUSH_THRESHOLD acks are pending. """
+
+        now = self.clock()
 
-        # ToDo: review this, not sure it's right?
         for circuit in self.circuit_manager.circuit_map.values():
 
-            acks_this_packet = 0
-            msg = None
+            if len(circuit.acks) == 0:
+                continue
+
+            if len(circuit.acks) < self.settings.ACK_FLUSH_THRESHOLD and \
+               now < circuit.oldest_ack_time + self.settings.ACK_FLUSH_DELAY:
+                continue
 
-            for packet_id in circuit.acks:
+            self.send_acks(circuit)
 
-                if acks_this_packet == 0:
+    def send_acks(self, circuit):
+        """ sends all the acks a circuit owes in PacketAcks, packed
+            straight into datagrams of up to MAX_PACKET_ACK_IDS ids """
+
+        if circuit.host.is_ok() == False:
+            return
 
-                    msg = Message('PacketAck')
+        acks = circuit.take_acks()
 
-                block = Block("Packets", ID=packet_id)
-                msg.add_block(block)
+        for start in range(0, len(acks), MAX_PACKET_ACK_IDS):
 
-                if self.settings.LOG_VERBOSE and not self.settings.DISABLE_SPAMMERS:
-                    logger.debug("Acking packet id: %s" % (packet_id))
+            ack_ids = acks[start:start + MAX_PACKET_ACK_IDS]
+            packet_id = circuit.next_packet_id()
 
-                acks_this_packet += 1
+            send_buffer = self.udp_serializer.serialize_acks(packet_id, ack_ids)
 
-                if acks_this_packet > 250:
+            # enable monitoring of outgoing packets
+            if self.settings.HANDLE_OUTGOING_PACKETS:
+                packet = Message('PacketAck', *[Block('Packets', ID=ack_id) for ack_id in ack_ids])
+                packet.packet_id = packet_id
+                self.__get_message_handler(circuit).handle(packet)
 
-                    self.send_message(msg, circuit.host)
-                    acks_this_packet = 0
+            if self.settings.LOG_VERBOSE and not self.settings.DISABLE_SPAMMERS:
+                logger.debug("Acking packet ids: %s" % (ack_ids))
 
-            if acks_this_packet > 0:
+            self.udp_client.send_packet(self.socket, send_buffer, circuit.host)
+
+            self.packets_out += 1
+            self.acks_out += len(ack_ids)
+            circuit.packets_out += 1
+            circuit.bytes_out += len(send_buffer)
+            circuit.acks_out += len(ack_ids)
+
+    def next_process_time(self):
+        """ returns the time process_acks() next has something to do, or
+            None if that waits on packets being sent or received """
+
+        deadline = self.retransmit_timers.next_deadline()
+
+        for circuit in self.circuit_manager.circuit_map.values():
+
+            if len(circuit.acks) == 0:
+                continue
+
+            if len(circuit.acks) >= self.settings.ACK_FLUSH_THRESHOLD:
+                flush = circuit.oldest_ack_time
+            else:
+                flush = circuit.oldest_ack_time + self.settings.ACK_FLUSH_DELAY
 
-                self.send_message(msg, circuit.host)
+            if deadline == None or flush < deadline:
+                deadline = flush
 
-            circuit.acks = []
+        return deadline
 
     def has_unacked(self):
         for circuit in self.circuit_manager.circuit_map.values():
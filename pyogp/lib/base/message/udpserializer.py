@@ -21,92 +21,244 @@ import struct
 from logging import getLogger
 
 # pygop
-from msgtypes import MsgType, MsgBlockType, EndianType
+from msgtypes import MsgType, MsgBlockType, MsgEncoding, EndianType, PackFlags, PacketLayout, sizeof
 from data_packer import DataPacker
-from template_dict import TemplateDictionary
+from template_dict import get_template_dict
+from zerocode import zero_code_compress
+from udpdeserializer import ACK_IDS
 from pyogp.lib.base import exc
 from pyogp.lib.base.message.message_dot_xml import MessageDotXML
 
 logger = getLogger('message.udpserializer') 
 
+# flags, packet id and offset to the data
+PACKET_HEADER = struct.Struct('>BIB')
+
+# flags that are set by the serializer, depending on how the packet is sent
+UNSET_FLAGS = PackFlags.LL_ZERO_CODE_FLAG | PackFlags.LL_ACK_FLAG
+
+# the size of each appended ack
+ACK_SIZE = sizeof(MsgType.MVT_U32)
+
+# the most ids a PacketAck carries, as its block count is a single byte
+MAX_PACKET_ACK_IDS = 255
+
+# the ids of a PacketAck's Packets blocks, by count
+PACKET_ACK_IDS = [struct.Struct('<%dI' % (count)) for count in range(MAX_PACKET_ACK_IDS + 1)]
+
 class UDPMessageSerializer(object):
     """ an adpater for serializing a IUDPMessage into the UDP message format
 
         This class builds messages at its high level, that is, keeping
         that data in data structure form. A serializer should be used on
-        the message produced by this so that it can be sent over a network. """
+        the message produced by this so that it can be sent over a network.
+
+        serialize() keeps everything about the message it is packing in
+        locals, so one instance can be shared by many circuits, greenlets
+        and threads. only the zero coding statistics are updated, and the
+        message's acks are trimmed to the ones appended to the packet. """
 
     def __init__(self, message_template = None, message_xml = None):
         """initialize the adapter"""
-        self.context = None	# the UDPMessage
-
-        self.template_dict = TemplateDictionary(message_template)
-        self.current_template = None
+        self.template_dict = get_template_dict(message_template)
         self.packer = DataPacker()
 
+        # zero coding statistics for Zerocoded templates
+        self.zero_coded_packets = 0     # packets sent zero coded
+        self.zero_code_bytes_in = 0     # body bytes before zero coding
+        self.zero_code_bytes_saved = 0  # bytes zero coding took off the wire
+
+        # the message number of PacketAck, for serialize_acks()
+        self.packet_ack_header = None
+
         if not message_xml:
             self.message_xml = MessageDotXML()
         else:
             self.message_xml = message_xml
 
-    def set_current_template(self):
-        """ establish the template for the current packet """
+    def __get_template(self, message):
+        """ returns the template to send message with, or None """
+
+        template = self.template_dict.get_template(message.name)
+
+        if template == None:
+            return None
+
+        # validate whether we are allowed to receive this message over udp
+        if not self.message_xml.validate_udp_msg(template.name):
+            logger.warning("Sending '%s' over UDP, which is deprecated. Discarding." % (template.name))
+            return None
 
-        self.current_template = self.template_dict.get_template(self.context.name)
+        return template
 
-    def serialize(self, context):
+    def serialize(self, message):
         """ Builds the message by serializing the data. Creates a packet ready
             to be sent. """
 
-        self.context = context
-
-        self.set_current_template()
+        template = self.__get_template(message)
 
-        # validate whether we are allowed to receive this message over udp
-        if not self.message_xml.validate_udp_msg(self.current_template.name):
-            logger.warning("Sending '%s' over UDP, which is deprecated. Discarding." % (self.current_template.name))
+        if template == None:
             return None
 
-        #doesn't build in the header flags, sequence number, or data offset
-        msg_buffer = ''
-        bytes = 0
+        #put the flags, the packet id and the offset to the data in the
+        #header. the zero code and ack flags are only set once the body is
+        #actually zero coded and acks are actually appended
+        pieces = [PACKET_HEADER.pack(message.send_flags & ~UNSET_FLAGS, \
+                                     message.packet_id, \
+                                     0)]
+
+        #the message number and the blocks, packed by the template's
+        #compiled encoder
+        self.template_dict.get_encoder(template).encode(message, pieces)
+
+        if template.name == 'RegionHandshakeReply':
+            # testing a hack to let RegionHandshakeReply get parsed
+            pieces.append(struct.pack(">I", 0))
 
-        #put the flags in the begining of the data. NOTE: for 1 byte, endian doesn't matter
-        msg_buffer += self.packer.pack_data(self.context.send_flags, MsgType.MVT_U8)
+        msg_buffer = ''.join(pieces)
 
-        #set packet ID
-        msg_buffer += self.packer.pack_data(self.context.packet_id, \
-                                                  MsgType.MVT_S32, \
-                                                  endian_type=EndianType.BIG)
+        if template.msg_encoding == MsgEncoding.LL_ZEROCODED:
+            msg_buffer = self.zero_code(msg_buffer)
 
-        #pack in the offset to the data. NOTE: for 1 byte, endian doesn't matter
-        msg_buffer += self.packer.pack_data(0, MsgType.MVT_U8)
+        num_acks = self.__fit_acks(message, len(msg_buffer))
 
-        if self.current_template == None:
+        if num_acks > 0:
+            msg_buffer = chr(ord(msg_buffer[0]) | PackFlags.LL_ACK_FLAG) + \
+                         msg_buffer[1:] + \
+                         ACK_IDS[num_acks].pack(*message.acks) + \
+                         chr(num_acks)
+
+        return msg_buffer
+
+    def serialize_into(self, message, buffer, offset = 0):
+        """ Writes the packet for message into the bytearray buffer at
+            offset, and returns its length, or None if the message can't be
+            sent. Raises MessageSerializationError if the packet doesn't fit
+            in the buffer. """
+
+        template = self.__get_template(message)
+
+        if template == None:
             return None
 
-        #don't need to pack the frequency and message number. The template
-        #stores it because it doesn't change per template.
-        pack_freq_num = self.current_template.msg_num_hex
-        msg_buffer += pack_freq_num
-        bytes += len(pack_freq_num)
+        end = offset + PacketLayout.PACKET_ID_LENGTH
+        if end > len(buffer):
+            raise exc.MessageSerializationError(template.name, "packet does not fit in the buffer")
 
-        #message_data = self.context.message_data
+        PACKET_HEADER.pack_into(buffer, offset, \
+                                message.send_flags & ~UNSET_FLAGS, \
+                                message.packet_id, \
+                                0)
 
-        for block in self.current_template.get_blocks():
-            packed_block, block_size = self.build_block(block, context)
-            msg_buffer += packed_block
-            bytes += block_size
+        end = self.template_dict.get_encoder(template).encode_into(message, buffer, end)
 
-        if self.current_template.name == 'RegionHandshakeReply':
+        if template.name == 'RegionHandshakeReply':
             # testing a hack to let RegionHandshakeReply get parsed
-            msg_buffer += struct.pack(">I", 0)
+            if end + 4 > len(buffer):
+                raise exc.MessageSerializationError(template.name, "packet does not fit in the buffer")
+            struct.pack_into(">I", buffer, end, 0)
+            end += 4
 
-        self.message_buffer = msg_buffer
+        if template.msg_encoding == MsgEncoding.LL_ZEROCODED:
+            end = self.zero_code_into(buffer, offset, end)
 
-        return msg_buffer
+        num_acks = self.__fit_acks(message, end - offset, len(buffer) - offset)
+
+        if num_acks > 0:
+            buffer[offset] |= PackFlags.LL_ACK_FLAG
+            ACK_IDS[num_acks].pack_into(buffer, end, *message.acks)
+            end += ACK_IDS[num_acks].size
+            buffer[end] = num_acks
+            end += 1
+
+        return end - offset
+
+    def __fit_acks(self, message, packet_size, max_size = PacketLayout.ACK_MTU):
+        """ trims message.acks down to the acks that can be appended to a
+            packet of packet_size, returning how many there are. the
+            packet is kept within PacketLayout.ACK_MTU, and within
+            max_size """
+
+        max_size = min(max_size, PacketLayout.ACK_MTU)
+        num_acks = min(len(message.acks), \
+                       PacketLayout.MAX_APPENDED_ACKS, \
+                       (max_size - packet_size - 1) / ACK_SIZE)
+
+        if num_acks <= 0:
+            num_acks = 0
+
+        if num_acks < len(message.acks):
+            del message.acks[num_acks:]
+            message.num_acks = num_acks
+
+        return num_acks
+
+    def serialize_acks(self, packet_id, ack_ids, flags = PackFlags.LL_NONE):
+        """ Builds a PacketAck acking up to MAX_PACKET_ACK_IDS packet ids,
+            packing them straight into the packet rather than going
+            through a Message. """
+
+        count = len(ack_ids)
+        if count > MAX_PACKET_ACK_IDS:
+            raise exc.MessageSerializationError("Packets", "too many acks for one PacketAck")
+
+        if self.packet_ack_header == None:
+            self.packet_ack_header = self.template_dict.get_template('PacketAck').msg_num_hex
+
+        return PACKET_HEADER.pack(flags, packet_id, 0) + \
+               self.packet_ack_header + \
+               chr(count) + \
+               PACKET_ACK_IDS[count].pack(*ack_ids)
+
+    def zero_code_into(self, buffer, offset, end):
+        """ zero codes the body of the packet in buffer between offset and
+            end in place, like zero_code(), returning the new end """
+
+        header_end = offset + PacketLayout.PACKET_ID_LENGTH
+        body_size = end - header_end
+
+        coded = zero_code_compress(buffer, header_end, end)
+
+        self.zero_code_bytes_in += body_size
+
+        if len(coded) >= body_size:
+            return end
+
+        self.zero_coded_packets += 1
+        self.zero_code_bytes_saved += body_size - len(coded)
+
+        buffer[offset] |= PackFlags.LL_ZERO_CODE_FLAG
+        buffer[header_end:header_end + len(coded)] = coded
+
+        return header_end + len(coded)
+
+    def zero_code(self, msg_buffer):
+        """ zero codes everything after the packet header and sets
+            LL_ZERO_CODE_FLAG. If zero coding doesn't make the packet
+            smaller, the packet is sent as is. """
+
+        header_size = PacketLayout.PACKET_ID_LENGTH
+        body_size = len(msg_buffer) - header_size
+
+        coded = zero_code_compress(msg_buffer, header_size)
+
+        self.zero_code_bytes_in += body_size
+
+        if len(coded) >= body_size:
+            return msg_buffer
+
+        self.zero_coded_packets += 1
+        self.zero_code_bytes_saved += body_size - len(coded)
+
+        flags = ord(msg_buffer[0]) | PackFlags.LL_ZERO_CODE_FLAG
+
+        return chr(flags) + msg_buffer[1:header_size] + coded
 
     def build_block(self, template_block, message_data):
+        """ packs one block of message_data with DataPacker, returning
+        (buffer, size). serialize() uses the compiled TemplateEncoder, this
+        is kept for callers that pack blocks on their own """
+
         block_buffer = ''
         bytes = 0
 
@@ -0,0 +1,108 @@
+"""
+zerocode.py
+Zero coding of message bodies. A zero coded body replaces each run of
+zero bytes with a single zero followed by the length of the run (at most
+255, longer runs are split). Both directions work on whole slices of the
+input rather than single characters, so they run in linear time.
+
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+import re
+
+ZERO = '\x00'
+
+# a run of zeros that fits in a single count byte
+ZERO_RUN = re.compile('\x00{1,255}')
+
+# the expanded zero runs, and their coded form, by count
+ZERO_RUNS = [ZERO * count for count in range(256)]
+CODED_RUNS = [ZERO + chr(count) for count in range(256)]
+
+def _as_string(data, start, end):
+    """ returns (string, start, end) for the range of data, copying only
+    when data is not already a str """
+
+    if end == None:
+        end = len(data)
+
+    if isinstance(data, str):
+        return data, start, end
+
+    if isinstance(data, memoryview):
+        return data[start:end].tobytes(), 0, end - start
+
+    return str(data[start:end]), 0, end - start
+
+def zero_code_expand(data, start = 0, end = None):
+    """ expands the zero coded bytes of data between start and end
+
+    data may be a str, bytearray or memoryview, the result is a str
+    """
+
+    data, pos, end = _as_string(data, start, end)
+
+    pieces = []
+    append = pieces.append
+    find = data.find
+
+    while pos < end:
+
+        zero = find(ZERO, pos, end)
+
+        if zero < 0:
+            append(data[pos:end])
+            break
+
+        if zero > pos:
+            append(data[pos:zero])
+
+        if zero + 1 >= end:
+            # a trailing zero without a count
+            append(ZERO)
+            break
+
+        count = ord(data[zero + 1])
+
+        if count == 0:
+            # a zero count byte is itself a zero starting the next run
+            append(ZERO)
+            pos = zero + 1
+        else:
+            append(ZERO_RUNS[count])
+            pos = zero + 2
+
+    return ''.join(pieces)
+
+def _encode_run(match):
+    return CODED_RUNS[len(match.group())]
+
+def zero_code_compress(data, start = 0, end = None):
+    """ zero codes the bytes of data between start and end
+
+    data may be a str, bytearray or memoryview, the result is a str
+    """
+
+    data, pos, end = _as_string(data, start, end)
+
+    if pos != 0 or end != len(data):
+        data = data[pos:end]
+
+    if ZERO not in data:
+        return data
+
+    return ZERO_RUN.sub(_encode_run, data)
@@ -18,16 +18,19 @@ $/LicenseInfo$
 """
 #stdlib
 from logging import getLogger
+import socket
 
 # pyogp.lib.base
 from pyogp.lib.base.message.udpdispatcher import UDPDispatcher
+from pyogp.lib.base.network.net import receive_error_delay
 from pyogp.lib.base.message.message_handler import MessageHandler
 from pyogp.lib.base.message.message_dot_xml import MessageDotXML
 from pyogp.lib.base.event_queue import EventQueueClient
 from pyogp.lib.base.settings import Settings
+from pyogp.lib.base.helpers import use_coroutine_sockets
 
 # related
-from eventlet import api
+from eventlet import api, queue
 
 # initialize logging
 logger = getLogger('pyogp.lib.base.message_manager')
@@ -38,15 +41,26 @@ class MessageManager(object):
     functionality in the base/message directory.
     """
 
+    # the UDP loops are eventlet coroutines, waiting on cooperative sockets
+    coroutine_sockets = True
+
     def __init__(self, host, message_handler=None, capabilities={},
-                 settings=None, start_monitors=False, message_template = None, message_xml = None):
+                 settings=None, start_monitors=False, message_template = None, message_xml = None,
+                 udp_client = None, udp_service = None):
         """ 
         Initialize the MessageManager, applying custom settings and dedicated 
         message_handler if needed 
+
+        With a UDPDispatcherService as udp_service, the UDP messages go over
+        its shared sockets and loops rather than ones of our own
         """
 
         logger.debug("Initializing the Message Manager ")        
 
+        # before the UDP socket is made
+        if self.coroutine_sockets:
+            use_coroutine_sockets()
+
         self.host = host
 
         # allow the settings to be passed in
@@ -103,13 +117,23 @@ class MessageManager(object):
             self.event_queue = None
 
         #UDP-related attributes
-        #NOTE udpdispatcher can already multiplex hosts 
+        #NOTE udpdispatcher can already multiplex hosts, see udp_service
         self.incoming_queue = []
         self.outgoing_queue = []
 
-        self.udp_dispatcher = UDPDispatcher(settings = self.settings,
-                                            message_handler = self.message_handler,
-                                            message_template = self.message_template)
+        # wakes _udp_dispatcher up when there is something to send
+        self._wakeup = queue.LightQueue()
+        self._udp_receiver_thread = None
+
+        self.udp_service = udp_service
+
+        if self.udp_service != None:
+            self.udp_dispatcher = self.udp_service.subscribe(self)
+        else:
+            self.udp_dispatcher = UDPDispatcher(udp_client = udp_client,
+                                                settings = self.settings,
+                                                message_handler = self.message_handler,
+                                                message_template = self.message_template)
 
         # if start parameter = True, kick off the queue monitors
         if start_monitors:
@@ -120,9 +144,16 @@ class MessageManager(object):
 
         self._is_running = True
 
-        logger.debug('Spawning region UDP connection')
+        if self.udp_service != None:
+            # subscribes again, if stop_monitors closed the circuit
+            self.udp_dispatcher = self.udp_service.subscribe(self)
+            self.udp_service.start()
+            self.wake()
+        else:
+            logger.debug('Spawning region UDP connection')
 
-        api.spawn(self._udp_dispatcher)
+            api.spawn(self._udp_dispatcher)
+            self._udp_receiver_thread = api.spawn(self._udp_receiver)
 
         if self.event_queue != None and self.settings.ENABLE_REGION_EVENT_QUEUE:
             logger.debug('Spawning region event queue connection')
@@ -138,9 +169,18 @@ class MessageManager(object):
 
         self._is_running = False
 
+        if self.udp_service != None:
+            self.udp_service.unsubscribe(self)
+        else:
+            self.wake()
+
+        if self._udp_receiver_thread != None:
+            api.kill(self._udp_receiver_thread)
+            self._udp_receiver_thread = None
+
         #stops event_queue
 
-        if self.event_queue._running:
+        if self.event_queue != None and self.event_queue._running:
             self.event_queue.stop()        
 
     def monitor_outgoing_queue(self):
@@ -157,6 +197,16 @@ class MessageManager(object):
         else:
             self.outgoing_queue.append((message, reliable))
 
+        self.wake()
+
+    def wake(self):
+        """ wakes the UDP loop up to send what is queued """
+
+        if self.udp_service != None:
+            self.udp_service.wake(self)
+        elif self._wakeup.qsize() == 0:
+            self._wakeup.put(None)
+
     def send_message(self):
         """  """
         pass
@@ -166,24 +216,142 @@ class MessageManager(object):
 
     def _udp_dispatcher(self):
         """
-        Sends and receives UDP messages.
+        Sends UDP messages, acks and resends. Sleeps until a message is
+        enqueued, a packet comes in, or an ack or resend is due.
         """
         logger.debug('Spawning region UDP connection')
         while self._is_running:
-            api.sleep(0)
-            msg_buf, msg_size = self.udp_dispatcher.udp_client.receive_packet(self.udp_dispatcher.socket)
-            recv_packet = self.udp_dispatcher.receive_check(self.udp_dispatcher.udp_client.get_sender(),
-                                                            msg_buf, 
-                                                            msg_size)
-            #self.incoming_queue.append(recv_packet)
-            if self.udp_dispatcher.has_unacked():
-                self.udp_dispatcher.process_acks()
-
-            while len(self.outgoing_queue) > 0:                
+            self.udp_dispatcher.process_acks()
+
+            self.send_outgoing()
+
+            try:
+                self._wakeup.get(timeout = self.get_wait_time())
+            except queue.Empty:
+                pass
+
+        logger.debug("Stopped the UDP connection for %s" % (self.host))
+
+    def _udp_receiver(self):
+        """
+        Receives UDP messages. The socket is a coroutine socket, so this
+        waits in the hub until a packet arrives, then reads every packet
+        that is waiting before the kernel's buffer can fill up.
+        """
+        udp_client = self.udp_dispatcher.udp_client
+        errors = 0
+
+        while self._is_running:
+            try:
+                if self.settings.ENABLE_RECEIVE_RING:
+                    packets = udp_client.receive_into(self.udp_dispatcher.socket,
+                                                      self.settings.RECEIVE_BATCH_PACKETS,
+                                                      self.settings.RECEIVE_BATCH_BYTES)
+                else:
+                    packets = udp_client.receive_batch(self.udp_dispatcher.socket,
+                                                       self.settings.RECEIVE_BATCH_PACKETS,
+                                                       self.settings.RECEIVE_BATCH_BYTES)
+            except socket.error, error:
+                errors += 1
+                delay = receive_error_delay(error, errors)
+                if delay == None or not self._is_running:
+                    logger.error("Stopped receiving on the UDP connection for %s: %s" % (self.host, error))
+                    break
+                logger.warning("Error receiving from the UDP connection for %s: %s" % (self.host, error))
+                api.sleep(delay)
+                continue
+
+            errors = 0
+
+            if len(packets) == 0:
+                continue
+
+            if self.settings.ENABLE_RECEIVE_RING:
+                recv_packets = self.udp_dispatcher.receive_views(packets)
+            else:
+                recv_packets = self.udp_dispatcher.receive_batch(packets)
+            #self.incoming_queue.extend(recv_packets)
+            #it may need acking, or have acked what was waiting to be resent
+            self.wake()
+
+    def get_wait_time(self):
+        """
+        Returns how long the UDP loop can sleep for, or None if it can
+        sleep until it is woken up
+        """
+
+        wait = None
+
+        deadline = self.udp_dispatcher.next_process_time()
+        if deadline != None:
+            wait = max(deadline - self.udp_dispatcher.clock(), 0.0)
+
+        send_wait = self.get_send_wait_time()
+        if send_wait != None and (wait == None or send_wait < wait):
+            wait = send_wait
+
+        return wait
+
+    def get_send_wait_time(self):
+        """
+        Returns how long until the messages the throttle holds back in
+        the outgoing_queue can go, or None if none are held
+        """
+
+        wait = None
+
+        # messages held back by the throttle go once it has refilled
+        if self.settings.ENABLE_THROTTLES and len(self.outgoing_queue) > 0:
+            throttle = self.get_throttle()
+            for (packet, reliable) in self.outgoing_queue:
+                ready = throttle.time_until_ready(throttle.get_category(packet.name))
+                if ready != None and (wait == None or ready < wait):
+                    wait = ready
+
+        return wait
+
+    def send_outgoing(self):
+        """
+        Sends the messages in the outgoing_queue. With ENABLE_THROTTLES on,
+        the messages of a traffic category that is out of bandwidth stay
+        queued, in order, until a later call
+        """
+
+        if not self.settings.ENABLE_THROTTLES:
+            while len(self.outgoing_queue) > 0:
                 (packet, reliable) = self.outgoing_queue.pop(0)
                 self.send_udp_message(packet, reliable)
+            return
 
-        logger.debug("Stopped the UDP connection for %s" % (self.host))
+        throttle = self.get_throttle()
+
+        pending = self.outgoing_queue
+        self.outgoing_queue = []
+        held = []
+        blocked = set()
+
+        for (packet, reliable) in pending:
+            category = throttle.get_category(packet.name)
+            if category in blocked or not throttle.ready(category):
+                blocked.add(category)
+                held.append((packet, reliable))
+                continue
+            self.send_udp_message(packet, reliable)
+
+        self.outgoing_queue[0:0] = held
+
+    def get_throttle(self):
+        """
+        Returns the Throttle of the circuit to host
+        """
+        return self.udp_dispatcher.find_circuit(self.host).throttle
+
+    def set_throttles(self, rates):
+        """
+        Sets the rates, in bits per second and in the order of the
+        Throttles of AgentThrottle, messages are sent to host with
+        """
+        self.get_throttle().set_rates(rates)
 
     def send_udp_message(self, packet, reliable=False):
         """
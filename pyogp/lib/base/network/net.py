@@ -18,22 +18,90 @@ $/LicenseInfo$
 
 # std python libs
 import socket
+import errno
+import os
 from logging import getLogger
 
 from pyogp.lib.base.message.circuit import Host
 
 logger = getLogger('net.net')
 
+# the largest datagram receive_packet() and receive_batch() read
+RECEIVE_SIZE = 10000
+
+# how much receive_batch() reads at most by default
+RECEIVE_BATCH_PACKETS = 64
+RECEIVE_BATCH_BYTES = 262144
+
+# how many buffers receive_into() reads into, in turn
+RECEIVE_RING_SLOTS = 64
+
+# errors that leave nothing to read, rather than break the socket: an
+# empty non blocking socket, or an icmp error left behind by an earlier send
+EMPTY_READ_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNREFUSED)
+
+# errors receiving that can clear up, such as an icmp error left behind by
+# an earlier send or a shortage of memory. any other, like EBADF once the
+# socket is closed, will only happen again
+TRANSIENT_RECEIVE_ERRORS = EMPTY_READ_ERRORS + (errno.ECONNRESET, errno.EHOSTUNREACH,
+                                                errno.ENETUNREACH, errno.ENOBUFS, errno.ENOMEM)
+
+# how long a receiver waits after a transient error, doubled for each
+# error in a row, up to RECEIVE_ERROR_MAX_DELAY
+RECEIVE_ERROR_DELAY = 0.01
+RECEIVE_ERROR_MAX_DELAY = 1.0
+
+# the kernel's tables of udp sockets, with a count of the datagrams each
+# dropped for lack of buffer space
+PROC_NET_UDP = ('/proc/net/udp', '/proc/net/udp6')
+
+def receive_error_delay(error, errors):
+    """ returns how long to wait before receiving again after a
+    socket.error, the errors'th in a row, or None if the socket won't
+    recover from it """
+
+    if len(error.args) == 0 or error.args[0] not in TRANSIENT_RECEIVE_ERRORS:
+        return None
+
+    return min(RECEIVE_ERROR_DELAY * 2 ** (errors - 1), RECEIVE_ERROR_MAX_DELAY)
+
+class ReceiveRing(object):
+    """ a ring of preallocated buffers to receive datagrams into
+
+    a slot is reused once every other slot has been read into, so a view
+    into it stays valid for at least that many more datagrams
+    """
+
+    def __init__(self, slots = RECEIVE_RING_SLOTS, size = RECEIVE_SIZE):
+        self.buffers = [bytearray(size) for slot in range(slots)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.position = 0
+
+    def __len__(self):
+        return len(self.views)
+
+    def current(self):
+        """ returns a view of the whole buffer to read into next """
+        return self.views[self.position]
+
+    def advance(self):
+        """ moves on from the current buffer, once it holds a datagram """
+        self.position = (self.position + 1) % len(self.views)
+
 #returns true if packet was sent successfully
 class NetUDPClient(object):
 
     def __init__(self):
         self.sender = Host((None, None))
+        self.receive_ring = None
 
     def get_sender(self):
         return self.sender
 
     def send_packet(self, sock, send_buffer, host):
+        """ sends send_buffer to host. send_buffer may be a memoryview into
+        a pooled buffer, which is reused once this returns """
+
         #print "Sending to " + str(host.ip) + ":" + str(host.port) + ":" + send_buffer
         #logger.debug("In send_packet")
         if send_buffer == None:
@@ -42,17 +110,161 @@ class NetUDPClient(object):
         bytes = sock.sendto(send_buffer, (host.ip, host.port))
 
     def receive_packet(self, sock):
-        buf = 10000
+        """ receives a packet from sock, returning the data and its size.
+        the size is 0 if nothing could be read, other errors are raised """
+
+        buf = RECEIVE_SIZE
         try:
             data, addr = sock.recvfrom(buf)
             #print "Received data: " + repr(data)
-        except:
+        except socket.timeout:
             return '', 0
+        except socket.error, error:
+            if error.args[0] in EMPTY_READ_ERRORS:
+                logger.debug("Nothing received: %s" % (error))
+                return '', 0
+            raise
         #print self.sender
         self.sender.ip = addr[0]
         self.sender.port = addr[1]
         return data, len(data)
 
+    def receive_batch(self, sock, max_packets = RECEIVE_BATCH_PACKETS,
+                      max_bytes = RECEIVE_BATCH_BYTES, block = True):
+        """ reads every datagram that is ready on sock, up to max_packets
+        of them or max_bytes of data, returning a list of (Host, data).
+        if block is True, waits for the first one to arrive """
+
+        # a coroutine socket waits in the hub for each read, the socket
+        # under it reads what is ready without waiting
+        raw = getattr(sock, 'fd', sock)
+
+        packets = []
+        size = 0
+
+        if block:
+            data, addr = self.__recvfrom(sock, 0)
+            if data:
+                packets.append((Host(addr), data))
+                size += len(data)
+
+        while len(packets) < max_packets and size < max_bytes:
+
+            data, addr = self.__recvfrom(raw, socket.MSG_DONTWAIT)
+            if addr == None:
+                break
+
+            if data:
+                packets.append((Host(addr), data))
+                size += len(data)
+
+        if packets:
+            self.sender.ip, self.sender.port = packets[-1][0].ip, packets[-1][0].port
+
+        return packets
+
+    def receive_into(self, sock, max_packets = RECEIVE_BATCH_PACKETS,
+                     max_bytes = RECEIVE_BATCH_BYTES, block = True):
+        """ reads the datagrams that are ready on sock into the buffers of
+        receive_ring, like receive_batch(), returning a list of (memoryview,
+        addr). the views are valid until the next call, and nothing is
+        allocated for the data itself """
+
+        if self.receive_ring == None:
+            self.receive_ring = ReceiveRing()
+
+        ring = self.receive_ring
+        raw = getattr(sock, 'fd', sock)
+
+        # each view in the batch needs a slot of its own
+        max_packets = min(max_packets, len(ring))
+
+        packets = []
+        size = 0
+
+        while len(packets) < max_packets and size < max_bytes:
+
+            view = ring.current()
+
+            if block and len(packets) == 0:
+                nbytes, addr = self.__recvfrom_into(sock, view, 0)
+            else:
+                nbytes, addr = self.__recvfrom_into(raw, view, socket.MSG_DONTWAIT)
+
+            if addr == None:
+                if block and len(packets) == 0:
+                    # an error that left nothing to read, don't wait again
+                    block = False
+                    continue
+                break
+
+            if nbytes > 0:
+                ring.advance()
+                packets.append((view[:nbytes], addr))
+                size += nbytes
+
+        return packets
+
+    def __recvfrom_into(self, sock, view, flags):
+        """ returns (nbytes, addr), or (0, None) if nothing could be read """
+
+        try:
+            return sock.recvfrom_into(view, 0, flags)
+        except socket.timeout:
+            return 0, None
+        except socket.error, error:
+            if error.args[0] in EMPTY_READ_ERRORS:
+                return 0, None
+            raise
+
+    def __recvfrom(self, sock, flags):
+        """ returns (data, addr), or ('', None) if nothing could be read """
+
+        try:
+            return sock.recvfrom(RECEIVE_SIZE, flags)
+        except socket.timeout:
+            return '', None
+        except socket.error, error:
+            if error.args[0] in EMPTY_READ_ERRORS:
+                return '', None
+            raise
+
+    def set_receive_buffer(self, sock, size):
+        """ asks for a kernel receive buffer of size bytes for sock, so it
+        can hold bursts between reads. returns the size the kernel set,
+        which Linux doubles for its bookkeeping and caps at rmem_max """
+
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        return self.get_receive_buffer(sock)
+
+    def get_receive_buffer(self, sock):
+
+        return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    def get_drops(self, sock):
+        """ returns how many datagrams the kernel dropped for sock, as the
+        receive buffer was full, or None where /proc/net/udp isn't there """
+
+        try:
+            inode = str(os.fstat(sock.fileno()).st_ino)
+        except (OSError, socket.error):
+            return None
+
+        for path in PROC_NET_UDP:
+            try:
+                lines = open(path).readlines()
+            except IOError:
+                continue
+
+            # sl local_address rem_address st tx_queue:rx_queue tr:tm->when
+            # retrnsmt uid timeout inode ref pointer drops
+            for line in lines[1:]:
+                fields = line.split()
+                if len(fields) >= 13 and fields[9] == inode:
+                    return int(fields[12])
+
+        return None
+
     def start_udp_connection(self):
         """ Starts a udp connection, returning socket and port. """
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
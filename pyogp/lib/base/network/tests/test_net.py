@@ -0,0 +1,109 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+import unittest
+import socket
+import os
+
+# pyogp
+import errno
+from pyogp.lib.base.network.net import NetUDPClient, ReceiveRing, receive_error_delay, \
+     RECEIVE_ERROR_DELAY, RECEIVE_ERROR_MAX_DELAY
+
+class TestNetUDPClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = NetUDPClient()
+        self.sock = self.client.start_udp_connection()
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender.bind(('127.0.0.1', 0))
+
+    def tearDown(self):
+        self.sock.close()
+        self.sender.close()
+
+    def test_receive_batch(self):
+        for i in range(5):
+            self.sender.sendto('packet %s' % (i), self.address)
+
+        packets = self.client.receive_batch(self.sock, max_packets = 3)
+        assert [data for host, data in packets] == ['packet 0', 'packet 1', 'packet 2']
+        host = packets[0][0]
+        assert (host.ip, host.port) == self.sender.getsockname()
+        assert host is not packets[1][0]
+
+        # the byte limit is checked after each datagram
+        packets = self.client.receive_batch(self.sock, max_bytes = 1)
+        assert [data for host, data in packets] == ['packet 3']
+
+        packets = self.client.receive_batch(self.sock, block = False)
+        assert [data for host, data in packets] == ['packet 4']
+        assert self.client.receive_batch(self.sock, block = False) == []
+
+    def test_receive_into(self):
+        self.client.receive_ring = ReceiveRing(slots = 2, size = 100)
+        buffers = self.client.receive_ring.buffers
+        for i in range(3):
+            self.sender.sendto('packet %s' % (i), self.address)
+
+        # a batch is no bigger than the ring
+        packets = self.client.receive_into(self.sock)
+        assert [view.tobytes() for view, addr in packets] == ['packet 0', 'packet 1']
+        assert packets[0][1] == self.sender.getsockname()
+        assert str(buffers[1][:8]) == 'packet 1'
+
+        packets = self.client.receive_into(self.sock, block = False)
+        assert [view.tobytes() for view, addr in packets] == ['packet 2']
+        # read into the first buffer again
+        assert str(buffers[0][:8]) == 'packet 2'
+        assert self.client.receive_into(self.sock, block = False) == []
+        assert self.client.receive_ring.position == 1
+
+    def test_receive_error_delay(self):
+        refused = socket.error(errno.ECONNREFUSED, 'Connection refused')
+        assert receive_error_delay(refused, 1) == RECEIVE_ERROR_DELAY
+        assert receive_error_delay(refused, 2) == RECEIVE_ERROR_DELAY * 2
+        assert receive_error_delay(refused, 100) == RECEIVE_ERROR_MAX_DELAY
+        assert receive_error_delay(socket.error(errno.EBADF, 'Bad file descriptor'), 1) == None
+
+    def test_receive_buffer(self):
+        size = self.client.set_receive_buffer(self.sock, 65536)
+        assert size >= 65536
+        assert self.client.get_receive_buffer(self.sock) == size
+
+    def test_drops(self):
+        if not os.path.exists('/proc/net/udp'):
+            return
+
+        self.client.set_receive_buffer(self.sock, 1)
+        before = self.client.get_drops(self.sock)
+        assert before == 0
+
+        for i in range(100):
+            self.sender.sendto('x' * 1000, self.address)
+
+        assert self.client.get_drops(self.sock) > 0
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestNetUDPClient))
+    return suite
@@ -37,6 +37,48 @@ class Settings(object):
         # toggle parsing all/handled packets
         self.ENABLE_DEFERRED_PACKET_PARSING = True
 
+        # return MVT_FIXED and binary MVT_VARIABLE ('Data') payloads as
+        # memoryviews into the received buffer instead of copies
+        self.ENABLE_ZERO_COPY_PAYLOADS = False
+
+        # keep the buffer of handled packets and decode each block only
+        # when a handler first looks it up
+        self.ENABLE_LAZY_PACKET_DECODING = False
+
+        # deserialize handled packets lazily, and also allow their blocks to
+        # be read as numpy structured arrays with get_columns(). needs numpy
+        self.ENABLE_COLUMNAR_BLOCKS = False
+
+        # serialize outgoing packets into reusable send buffers rather than
+        # new strings. UDPDispatcher's send methods then return the number
+        # of bytes sent instead of the packet
+        self.ENABLE_POOLED_SEND_BUFFERS = False
+
+        # acks that didn't go out appended to other packets are sent in
+        # PacketAcks once the oldest has waited ACK_FLUSH_DELAY seconds, or
+        # once ACK_FLUSH_THRESHOLD of them are pending. with no delay they
+        # are sent every time UDPDispatcher.process_acks() runs
+        self.ACK_FLUSH_DELAY = 0.0
+        self.ACK_FLUSH_THRESHOLD = 255
+
+        # limit what each circuit sends to the rates of its Throttle, by
+        # traffic category. messages over the limit are held in the
+        # MessageManager's outgoing_queue, and resends are put off
+        self.ENABLE_THROTTLES = False
+
+        # the MessageManager reads every datagram waiting on its socket at
+        # once, up to this many of them or this many bytes
+        self.RECEIVE_BATCH_PACKETS = 64
+        self.RECEIVE_BATCH_BYTES = 262144
+
+        # the kernel receive buffer, in bytes, to ask for on UDP sockets
+        # so bursts aren't dropped. None keeps the system default
+        self.UDP_RECEIVE_BUFFER_SIZE = None
+
+        # read packets into a ring of preallocated buffers, and decode them
+        # from there, rather than into a new string each
+        self.ENABLE_RECEIVE_RING = False
+
         #~~~~~~~~~~~~~~~~~~
         # Logging behaviors
         #~~~~~~~~~~~~~~~~~~
@@ -64,6 +64,14 @@ class MockupUDPClient(object):
 
         return '', 0
 
+    def receive_batch(self, socket, max_packets = 64, max_bytes = 262144, block = True):
+        data, size = self.receive_packet(socket)
+
+        if size > 0:
+            return [(self.sender, data)]
+
+        return []
+
     def start_udp_connection(self):
         """ Starts a udp connection, returning socket and port. """
         sock = random.randint(0,80)
@@ -0,0 +1,134 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+import unittest
+import socket
+
+# pyogp
+from pyogp.lib.base.message.asyncio_dispatcher import asyncio, UDPDispatcherProtocol
+from pyogp.lib.base.asyncio_message_manager import AsyncioMessageManager
+from pyogp.lib.base.message.message import Message, Block
+from pyogp.lib.base.message.circuit import Host
+from pyogp.lib.base.settings import Settings
+
+# pyogp tests
+import pyogp.lib.base.tests.config
+
+# a reliable StartPingCheck from the region, acking our packet 1
+ACKING_PACKET = '\x50' + '\x00\x00\x00\x01' + '\x00' + '\x01' + '\x07' + '\x00\x00\x00\x00' + \
+                '\x00\x00\x00\x01' + '\x01'
+
+class TestAsyncioMessageManager(unittest.TestCase):
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.close()
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(2)
+        self.host = Host(self.server.getsockname())
+
+        self.settings = Settings()
+        self.settings.ENABLE_DEFERRED_PACKET_PARSING = False
+
+        self.message_manager = AsyncioMessageManager(self.host, loop = self.loop,
+                                                     settings = self.settings)
+
+    def run_loop(self, seconds):
+        self.loop.call_later(seconds, self.loop.stop)
+        self.loop.run_forever()
+
+    def test_protocol(self):
+        received = []
+        protocol = UDPDispatcherProtocol(self.message_manager.udp_dispatcher, received.append)
+
+        protocol.datagram_received(ACKING_PACKET, self.server.getsockname())
+
+        packets = received[0]
+        assert len(packets) == 1
+        assert packets[0].name == 'StartPingCheck'
+        circuit = self.message_manager.udp_dispatcher.find_circuit(self.host)
+        assert circuit.packets_in == 1
+
+    def test_udp_loop(self):
+        self.message_manager.start_monitors()
+        try:
+            # sent once the loop runs
+            self.message_manager.enqueue_message(Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0)),
+                                                 reliable = True)
+            self.run_loop(0.1)
+            data, addr = self.server.recvfrom(10000)
+            assert data[0] == '\x40'
+
+            # acked by the region, and its reliable packet acked back
+            self.server.sendto(ACKING_PACKET, addr)
+            self.run_loop(0.1)
+            circuit = self.message_manager.udp_dispatcher.find_circuit(self.host)
+            assert circuit.unack_packet_count == 0
+            assert circuit.packets_in == 1
+            assert self.message_manager.udp_dispatcher.packets_resent == 0
+
+            data, addr = self.server.recvfrom(10000)
+            assert data[6:10] == '\xff\xff\xff\xfb', repr(data)
+        finally:
+            self.message_manager.stop_monitors()
+
+        self.assertFalse(self.message_manager._is_running)
+        self.assertEquals(self.message_manager.transport, None)
+
+    def test_event_queue(self):
+        posts = []
+        class FakeCap(object):
+            def POST(self, data):
+                posts.append(dict(data))
+                return {'id': len(posts), 'events': []}
+
+        self.settings.ENABLE_REGION_EVENT_QUEUE = True
+        self.settings.REGION_EVENT_QUEUE_POLL_INTERVAL = 0.01
+        self.message_manager = AsyncioMessageManager(self.host, loop = self.loop,
+                                                     settings = self.settings,
+                                                     capabilities = {'EventQueueGet': FakeCap()})
+        event_queue = self.message_manager.event_queue
+
+        self.message_manager.start_monitors()
+        try:
+            self.run_loop(0.2)
+            assert event_queue._running
+            assert len(posts) >= 2, posts
+            assert posts[0] == {}
+            assert posts[1] == {'ack': 1}
+        finally:
+            self.message_manager.stop_monitors()
+
+        self.run_loop(0.1)
+        self.assertFalse(event_queue._running)
+        self.assertEquals(posts[-1]['done'], True)
+
+if asyncio == None:
+    TestAsyncioMessageManager = unittest.skip("asyncio is not available")(TestAsyncioMessageManager)
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestAsyncioMessageManager))
+    return suite
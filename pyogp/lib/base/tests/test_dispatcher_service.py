@@ -0,0 +1,146 @@
+
+"""
+Contributors can be viewed at:
+http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/trunk/CONTRIBUTORS.txt
+
+$LicenseInfo:firstyear=2008&license=apachev2$
+
+Copyright 2009, Linden Research, Inc.
+
+Licensed under the Apache License, Version 2.0.
+You may obtain a copy of the License at:
+    http://www.apache.org/licenses/LICENSE-2.0
+or in
+    http://svn.secondlife.com/svn/linden/projects/2008/pyogp/lib/base/LICENSE.txt
+
+$/LicenseInfo$
+"""
+
+# standard python libs
+import unittest
+import socket
+
+# pyogp
+from pyogp.lib.base.dispatcher_service import UDPDispatcherService
+from pyogp.lib.base.message_manager import MessageManager
+from pyogp.lib.base.message.message_handler import MessageHandler
+from pyogp.lib.base.message.message import Message, Block
+from pyogp.lib.base.message.circuit import Host
+from pyogp.lib.base.settings import Settings
+
+# pyogp tests
+import pyogp.lib.base.tests.config
+
+from eventlet import api
+
+class TestUDPDispatcherService(unittest.TestCase):
+
+    def tearDown(self):
+        self.service.stop()
+        for region in self.regions:
+            region.close()
+        api.sleep(0)
+
+    def setUp(self):
+        self.settings = Settings()
+        self.settings.ENABLE_DEFERRED_PACKET_PARSING = False
+
+        self.service = UDPDispatcherService(settings = self.settings)
+
+        self.regions = []
+        for i in range(2):
+            region = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            region.bind(('127.0.0.1', 0))
+            self.regions.append(region)
+
+    def new_manager(self, region):
+        message_handler = MessageHandler()
+        pings = []
+        message_handler.register('StartPingCheck').subscribe(pings.append)
+
+        message_manager = MessageManager(Host(region.getsockname()),
+                                         message_handler = message_handler,
+                                         settings = self.settings,
+                                         udp_service = self.service)
+        message_manager.pings = pings
+        return message_manager
+
+    def ping(self, message_manager, ping_id):
+        message_manager.enqueue_message(Message('StartPingCheck', Block('PingID', PingID=ping_id, OldestUnacked=0)))
+
+    def test_sockets(self):
+        # two agents in the first region, and one of them in the second
+        region1, region2 = self.regions
+        agent1_region1 = self.new_manager(region1)
+        agent2_region1 = self.new_manager(region1)
+        agent1_region2 = self.new_manager(region2)
+
+        # a second socket only for the second circuit to the same region
+        assert len(self.service.udp_dispatchers) == 2
+        assert agent1_region1.udp_dispatcher is agent1_region2.udp_dispatcher
+        assert agent2_region1.udp_dispatcher is not agent1_region1.udp_dispatcher
+
+        for message_manager in (agent1_region1, agent2_region1, agent1_region2):
+            message_manager.start_monitors()
+
+        self.ping(agent1_region1, 1)
+        self.ping(agent2_region1, 2)
+        self.ping(agent1_region2, 3)
+
+        # the address each ping came from, by region and PingID
+        addrs = {}
+        for region in (region1, region1, region2):
+            data, addr = api.with_timeout(2, region.recvfrom, 10000)
+            addrs[(region.getsockname(), ord(data[7]))] = addr
+
+        assert addrs[(region1.getsockname(), 1)] != addrs[(region1.getsockname(), 2)]
+        assert addrs[(region1.getsockname(), 1)] == addrs[(region2.getsockname(), 3)]
+
+        # the regions' pings go to the agent the circuit belongs to
+        for (region_addr, ping_id), addr in addrs.items():
+            region = [region for region in self.regions if region.getsockname() == region_addr][0]
+            region.sendto('\x00' + '\x00\x00\x00\x01' + '\x00' + '\x01' + chr(ping_id) + '\x00\x00\x00\x00', addr)
+        api.sleep(0.1)
+
+        assert [packet.blocks['PingID'][0]['PingID'] for packet in agent1_region1.pings] == [1]
+        assert [packet.blocks['PingID'][0]['PingID'] for packet in agent2_region1.pings] == [2]
+        assert [packet.blocks['PingID'][0]['PingID'] for packet in agent1_region2.pings] == [3]
+
+        # the circuit is closed, and a new agent takes over its socket
+        agent1_region1.stop_monitors()
+        assert agent1_region1 not in self.service.managers[0].values()
+        agent3_region1 = self.new_manager(region1)
+        assert agent3_region1.udp_dispatcher is agent1_region2.udp_dispatcher
+
+    def test_restart(self):
+        region1 = self.regions[0]
+        agent1 = self.new_manager(region1)
+        agent2 = self.new_manager(region1)
+        udp_dispatcher = agent2.udp_dispatcher
+
+        # agent2 keeps its socket, and is subscribed to it only
+        agent2.start_monitors()
+        assert agent2.udp_dispatcher is udp_dispatcher
+        assert [agent2 in managers.values() for managers in self.service.managers] == [False, True]
+
+        agent2.stop_monitors()
+        agent2.start_monitors()
+        assert agent2.udp_dispatcher is self.service.udp_dispatchers[1]
+        assert [agent2 in managers.values() for managers in self.service.managers] == [False, True]
+        assert [len(udp_dispatcher.circuit_manager.circuit_map) for udp_dispatcher in self.service.udp_dispatchers] == [1, 1]
+
+    def test_receive_closed(self):
+        agent1 = self.new_manager(self.regions[0])
+        agent1.udp_dispatcher.socket.close()
+
+        agent1.start_monitors()
+        api.sleep(0.05)
+
+        # gave up on the closed socket, rather than spinning on it
+        assert [thread.dead for thread in self.service._udp_receiver_threads] == [True]
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestUDPDispatcherService))
+    return suite
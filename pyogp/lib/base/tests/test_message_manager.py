@@ -19,6 +19,7 @@ $/LicenseInfo$
 # standard python libs
 import unittest
 import os
+import socket
 
 # pyogp
 from pyogp.lib.base.message_manager import MessageManager
@@ -27,6 +28,8 @@ from pyogp.lib.base.message.message import Message, Block
 from pyogp.lib.base.tests.mockup_net import MockupUDPServer, MockupUDPClient
 from pyogp.lib.base.message.circuit import Host
 from pyogp.lib.base.message.udpdispatcher import UDPDispatcher
+from pyogp.lib.base.datatypes import UUID
+from pyogp.lib.base.settings import Settings
 
 # pyogp tests
 import pyogp.lib.base.tests.config 
@@ -97,6 +100,128 @@ class TestMessageManager(unittest.TestCase):
                'Expected: ' + repr('\x00' + '\x00\x00\x00\x01' + '\x00' + \
                             '\xff\xff\xff\xfb' + '\x01' + '\x03\x00\x00\x00')
 
+    def test_throttled_outgoing(self):
+        now = [100.0]
+        settings = self.message_manager.settings
+        settings.ENABLE_THROTTLES = True
+        self.message_manager.udp_dispatcher = UDPDispatcher(MockupUDPClient(),
+                                                            settings,
+                                                            self.message_manager.message_handler,
+                                                            clock = lambda: now[0])
+        sent = []
+        self.host.ip.receive_message = lambda client, buf: sent.append(str(buf))
+
+        # one packet overdraws a category, and holds back the rest of it
+        self.message_manager.set_throttles([160.0] * 7)
+        for i in range(3):
+            self.message_manager.enqueue_message(Message('StartPingCheck', Block('PingID', PingID=i, OldestUnacked=0)))
+        self.message_manager.enqueue_message(Message('RequestImage',
+                                                     Block('AgentData', AgentID=UUID(), SessionID=UUID()),
+                                                     Block('RequestImage', Image=UUID(), DiscardLevel=0,
+                                                           DownloadPriority=0.0, Packet=0, Type=0)))
+
+        self.message_manager.send_outgoing()
+        assert len(sent) == 2
+        assert [packet.name for packet, reliable in self.message_manager.outgoing_queue] == \
+               ['StartPingCheck', 'StartPingCheck']
+
+        # the task bucket refills at 20 bytes a second
+        now[0] += 0.5
+        self.message_manager.send_outgoing()
+        assert len(sent) == 3
+        assert [packet.name for packet, reliable in self.message_manager.outgoing_queue] == \
+               ['StartPingCheck']
+
+    def test_udp_receive_error(self):
+        class FailingUDPClient(MockupUDPClient):
+            errors = [socket.error(111, 'Connection refused')]
+            def receive_batch(self, sock, max_packets = 64, max_bytes = 262144, block = True):
+                if self.errors:
+                    raise self.errors.pop()
+                api.sleep(0.01)
+                return MockupUDPClient.receive_batch(self, sock, max_packets, max_bytes, block)
+
+        udp_client = FailingUDPClient()
+        message_manager = MessageManager(self.host, udp_client = udp_client)
+        message_manager.start_monitors()
+        try:
+            api.sleep(0.05)
+            # still receiving after the error
+            self.host.ip.send_message(udp_client, '\x00' + '\x00\x00\x00\x01' + '\x00' + \
+                                      '\xff\xff\xff\xfb' + '\x01' + '\x01\x00\x00\x00')
+            api.sleep(0.05)
+            assert message_manager.udp_dispatcher.packets_in == 1
+        finally:
+            message_manager.stop_monitors()
+        api.sleep(0)
+
+    def test_udp_receive_closed(self):
+        message_manager = MessageManager(self.host)
+        udp_client = message_manager.udp_dispatcher.udp_client
+        calls = []
+        receive_batch = udp_client.receive_batch
+        def counted_receive_batch(*args, **kwargs):
+            calls.append(1)
+            return receive_batch(*args, **kwargs)
+        udp_client.receive_batch = counted_receive_batch
+
+        message_manager.udp_dispatcher.socket.close()
+        message_manager.start_monitors()
+        try:
+            api.sleep(0.05)
+            # gave up on the closed socket, rather than spinning on it
+            assert len(calls) == 1
+            assert message_manager._udp_receiver_thread.dead
+        finally:
+            message_manager.stop_monitors()
+        api.sleep(0)
+
+    def test_udp_loop(self):
+        self.run_udp_loop(Settings())
+
+    def test_udp_loop_receive_ring(self):
+        settings = Settings()
+        settings.ENABLE_RECEIVE_RING = True
+        self.run_udp_loop(settings)
+
+    def run_udp_loop(self, settings):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        host = Host(server.getsockname())
+        message_manager = MessageManager(host, settings = settings)
+
+        runs = []
+        process_acks = message_manager.udp_dispatcher.process_acks
+        def counted_process_acks():
+            runs.append(1)
+            process_acks()
+        message_manager.udp_dispatcher.process_acks = counted_process_acks
+
+        message_manager.start_monitors()
+        try:
+            # sent as soon as it is enqueued
+            message_manager.enqueue_message(Message('StartPingCheck', Block('PingID', PingID=1, OldestUnacked=0)),
+                                            reliable = True)
+            data, addr = api.with_timeout(2, server.recvfrom, 10000)
+            assert data[0] == '\x40'
+
+            # idle, the loop sleeps rather than spinning
+            api.sleep(0.2)
+            assert len(runs) <= 3, len(runs)
+
+            # acked by the server, nothing is left to resend
+            server.sendto('\x10' + '\x00\x00\x00\x01' + '\x00' + '\xff\xff\x00\x01' + \
+                          '\x00\x00\x00\x01' + '\x01', addr)
+            api.sleep(0.1)
+            circuit = message_manager.udp_dispatcher.find_circuit(host)
+            assert circuit.unack_packet_count == 0
+            assert message_manager.udp_dispatcher.packets_resent == 0
+        finally:
+            message_manager.stop_monitors()
+            server.close()
+        api.sleep(0)
+        self.assertFalse(message_manager._is_running)
+
     def test_custom_message_template_count(self):
 
         message_manager = MessageManager(self.host,
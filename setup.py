@@ -54,5 +54,12 @@ setup(name='pyogp.lib.base',
          'wsgiref',
          'eventlet',
          'pyOpenssl'
-]
+],
+     extras_require={
+         # message/columnar.py
+         'columnar': ['numpy'],
+         # message/asyncio_dispatcher.py, the backport of asyncio to python 2,
+         # which is deprecated and no longer maintained
+         'asyncio': ['trollius'],
+     }
      )